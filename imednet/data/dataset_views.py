@@ -0,0 +1,63 @@
+"""
+Index-based train, test and validation splits.
+
+The samples of every split are gathered once into a single input and a
+single output tensor ordered [train, test, validate], the splits are views
+of those. Training permutes indices and gathers every batch on its own, so
+the dataset is held once and an epoch does not copy it.
+"""
+import numpy as np
+import torch
+
+
+def split_views(images, outputs, indeks, chunk=4096):
+    """
+    Tensors of the splits as views of one gathered copy of the data.
+
+    uint8 images stay uint8 and are normalized by the models, anything else
+    becomes float32.
+
+    # Arguments
+        images: [B x ...] inputs
+        outputs: [B*de x ...] outputs, de rows per image of which the first
+            two are kept, like Trainer.split_dataset always did
+        indeks: [B] split of every image, 0 train, 1 test and 2 validate
+        chunk: gather this many samples at a time, so no full copy in the
+            dtype of the data is made on the way to float32
+
+    # Returns
+        input_data_train, output_data_train, input_data_test, output_data_test,
+        input_data_validate, output_data_validate
+    """
+    indeks = np.asarray(indeks)
+    de = int(len(outputs) / len(images))
+    rows_per_image = min(de, 2)
+    samples = [np.flatnonzero(indeks == split) for split in (0, 1, 2)]
+    order = np.concatenate(samples)
+    rows = (order[:, None] * de + np.arange(rows_per_image)).ravel()
+
+    inputs = gather(images, order, chunk)
+    targets = gather(outputs, rows, chunk)
+
+    views = []
+    start = 0
+    for index in samples:
+        stop = start + len(index)
+        views += [inputs[start:stop], targets[start * rows_per_image:stop * rows_per_image]]
+        start = stop
+    return tuple(views)
+
+
+def gather(data, index, chunk=4096):
+    """data[index] as a float32 tensor, or uint8 for uint8 images, gathered chunk by chunk."""
+    if torch.is_tensor(data):
+        data = data[torch.from_numpy(np.asarray(index))]
+        return data if data.dtype == torch.uint8 else data.float()
+    if not hasattr(data, 'shape'):
+        data = np.asarray(data)
+    dtype = np.uint8 if data.dtype == np.uint8 else np.float32
+    out = np.empty((len(index),) + tuple(data.shape[1:]), dtype=dtype)
+    for start in range(0, len(index), chunk):
+        out[start:start + chunk] = data[index[start:start + chunk]]
+    return torch.from_numpy(out)
+
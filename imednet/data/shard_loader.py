@@ -0,0 +1,282 @@
+"""
+Sharded, memory-mapped image/trajectory datasets.
+
+MatLoader.load_data holds a whole dataset in memory. convert_mat writes
+the images (uint8 when they are 8-bit), the unscaled [tau, y0, goal, w]
+outputs and optionally the original trajectories of any number of .mat
+files into fixed-size .npy shards described by an index.json, and
+ShardedDataset memory-maps them. The trajectories can have different
+lengths, a shard keeps their concatenated points and offsets. Only the pages that are read are loaded,
+so a dataset has to fit on disk instead of in RAM, and DataLoader workers
+share them through the page cache.
+"""
+import os
+import json
+
+import numpy as np
+import torch
+from torch.utils.data import BatchSampler, DataLoader, Dataset, Sampler, SubsetRandomSampler
+
+from imednet.data.smnist_loader import Mapping, MatLoader, output_range, scale_outputs, stored_images
+
+INDEX_FILE = 'index.json'
+
+
+class ShardWriter(object):
+    def __init__(self, directory, shard_size=100000, dof=2):
+        """
+        Writes samples into shards of shard_size samples.
+
+        # Arguments
+            directory: output directory, created if needed
+            shard_size: samples per shard
+            dof: number of DOF of the outputs
+        """
+        self.directory = directory
+        self.shard_size = shard_size
+        self.dof = dof
+        self.shards = []
+        self.x_min = None
+        self.x_max = None
+        self.lengths = set()
+        self._buffer = []
+        self._buffered = 0
+        self._trajectories = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def append(self, images, outputs, trajectories=None):
+        """
+        Adds samples, writing every shard that is full.
+
+        # Arguments
+            images: [B x H x W] images
+            outputs: [B x (1+2*Dof+N*Dof)] unscaled [tau, y0, goal, w]
+            trajectories: B [T_i x 3] original trajectories, or None
+        """
+        images = np.asarray(images)
+        outputs = np.asarray(outputs, dtype=np.float64)
+        if trajectories is not None:
+            trajectories = [np.asarray(t, dtype=np.float32) for t in trajectories]
+            if len(trajectories) != len(images):
+                raise ValueError('every sample needs a trajectory')
+            self.lengths.update(len(t) for t in trajectories)
+        if self._trajectories is None:
+            self._trajectories = trajectories is not None
+        elif self._trajectories != (trajectories is not None):
+            raise ValueError('either all or no samples need trajectories')
+
+        # the output scaling of MatLoader.load_data, kept as running extremes
+        x_min, x_max = output_range(outputs, self.dof)
+        self.x_min = x_min if self.x_min is None else np.minimum(self.x_min, x_min)
+        self.x_max = x_max if self.x_max is None else np.maximum(self.x_max, x_max)
+
+        self._buffer.append((images, outputs, trajectories))
+        self._buffered += len(images)
+        while self._buffered >= self.shard_size:
+            self._flush(self.shard_size)
+
+    def close(self):
+        """Writes the last shard and the index, returns the index."""
+        if self._buffered:
+            self._flush(self._buffered)
+        index = {'shards': self.shards,
+                 'x_min': self.x_min.tolist(),
+                 'x_max': self.x_max.tolist(),
+                 # the samples of all trajectories, None if they differ
+                 'trajectory_length': next(iter(self.lengths)) if len(self.lengths) == 1 else None}
+        with open(os.path.join(self.directory, INDEX_FILE), 'w') as f:
+            json.dump(index, f, indent=1)
+        return index
+
+    def _flush(self, count):
+        images, outputs, trajectories = zip(*self._buffer)
+        images, outputs = np.concatenate(images), np.concatenate(outputs)
+        trajectories = [t for part in trajectories for t in part] if self._trajectories else None
+        self._buffer = [(images[count:], outputs[count:], trajectories[count:] if self._trajectories else None)] \
+            if len(images) > count else []
+        self._buffered -= count
+
+        number = len(self.shards)
+        shard = {'size': count}
+        arrays = [('images', images[:count]), ('outputs', outputs[:count])]
+        if self._trajectories:
+            # ragged trajectories as their concatenated points and the offsets of every sample
+            arrays += [('trajectories', np.concatenate(trajectories[:count])),
+                       ('trajectory_offsets', np.cumsum([0] + [len(t) for t in trajectories[:count]]))]
+        else:
+            shard['trajectories'] = shard['trajectory_offsets'] = None
+        for name, array in arrays:
+            shard[name] = '{}_{:05d}.npy'.format(name, number)
+            np.save(os.path.join(self.directory, shard[name]), np.ascontiguousarray(array))
+        self.shards.append(shard)
+
+
+def convert_mat(files, directory, shard_size=100000,
+                load_original_trajectories=False,
+                image_key='imageArray',
+                traj_key='trajArray',
+                dmp_params_key='DMPParamsArray',
+                dmp_traj_key='DMPTrajArray',
+                dof=2):
+    """
+    Converts .mat files into one sharded dataset, see MatLoader.load_data.
+
+    The files are read one at a time with MatLoader.read_data, so the legacy
+    'slike' layout and the 'trans_*' keys are handled the same way.
+
+    # Arguments
+        files: a .mat file or a list of them
+        directory: output directory of the shards
+        shard_size: samples per shard
+        dof: number of DOF of the DMPs
+
+    # Returns
+        the index written to directory/index.json
+    """
+    if isinstance(files, str):
+        files = [files]
+    writer = ShardWriter(directory, shard_size, dof)
+    for file in files:
+        images, outputs, original_trj = MatLoader.read_data(file, load_original_trajectories, image_key, traj_key,
+                                                            dmp_params_key, dmp_traj_key)
+        writer.append(stored_images(images), outputs, original_trj if load_original_trajectories else None)
+    return writer.close()
+
+
+class ShardedDataset(Dataset):
+    def __init__(self, directory, targets='outputs', length=None):
+        """
+        Memory-mapped samples written by ShardWriter.
+
+        The memory maps are opened on first access in every process, so the
+        dataset can be handed to DataLoader workers. Items can be single
+        indices or index arrays, an array is read shard by shard at once.
+
+        # Arguments
+            directory: directory of the shards
+            targets: 'outputs' for the [tau, y0, goal, w] outputs scaled like
+                MatLoader.load_data, 'trajectories' for the [Dof x T] x and
+                y rows of the original trajectories as used by
+                Trainer.train_dmp
+            length: samples T of the trajectory targets, every trajectory is
+                linearly resampled to it. By default the common length of
+                the trajectories, which have to be equally long then
+        """
+        if targets not in ('outputs', 'trajectories'):
+            raise ValueError('targets must be "outputs" or "trajectories"')
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        if targets == 'trajectories' and self.index['shards'][0]['trajectories'] is None:
+            raise ValueError('the shards were written without trajectories')
+        self.length = length or self.index.get('trajectory_length')
+        if targets == 'trajectories' and not self.length:
+            raise ValueError('the trajectories have different lengths, pass length to resample them')
+        self.directory = directory
+        self.targets = targets
+        self.offsets = np.cumsum([0] + [shard['size'] for shard in self.index['shards']])
+
+        self.scale = Mapping()
+        self.scale.x_min = np.array(self.index['x_min'])
+        self.scale.x_max = np.array(self.index['x_max'])
+        self._shards = None
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        """
+        # Returns
+            images: uint8 or float tensor of the image, [B x H x W] for an index array
+            targets: float tensor of the target, [B x ...] for an index array
+        """
+        if np.ndim(index) == 0:
+            images, targets = self[np.array([index])]
+            return images[0], targets[0]
+        if self._shards is None:
+            self._open()
+        index = np.asarray(index)
+        shard = np.searchsorted(self.offsets, index, side='right') - 1
+        # uint8 images stay uint8, the models normalize them
+        dtype = np.uint8 if self._shards[0][0].dtype == np.uint8 else np.float32
+        images = np.empty((len(index),) + self._shards[0][0].shape[1:], dtype=dtype)
+        targets = np.empty((len(index),) + self._target_shape, dtype=np.float32)
+        for k in np.unique(shard):
+            members = np.flatnonzero(shard == k)
+            rows = index[members] - self.offsets[k]
+            order = np.argsort(rows)
+            members, rows = members[order], rows[order]
+            data, outputs, trajectories = self._shards[k]
+            images[members] = data[rows]
+            if self.targets == 'outputs':
+                targets[members] = scale_outputs(outputs[rows], self.scale.x_min, self.scale.x_max)
+            else:
+                targets[members] = np.swapaxes(self._resampled(*trajectories, rows), 1, 2)
+        return torch.from_numpy(images), torch.from_numpy(targets)
+
+    def loader(self, indices=None, batch_size=32, shuffle=True, workers=4, prefetch_factor=4, pin_memory=False,
+               drop_last=False):
+        """
+        A DataLoader of whole batches, each read with one index array.
+
+        # Arguments
+            indices: samples to load, all of them by default
+            shuffle: new random batches every epoch
+            workers: worker processes, 0 loads in the main process
+            prefetch_factor: batches every worker loads ahead
+        """
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+        sampler = SubsetRandomSampler(indices) if shuffle else _IndexSampler(indices)
+        return DataLoader(self, batch_size=None,
+                          sampler=BatchSampler(sampler, batch_size, drop_last),
+                          num_workers=workers,
+                          prefetch_factor=prefetch_factor if workers else None,
+                          persistent_workers=workers > 0,
+                          pin_memory=pin_memory)
+
+    @property
+    def _target_shape(self):
+        if self.targets == 'outputs':
+            return (len(self.scale.x_min),)
+        return (2, self.length)
+
+    def _resampled(self, points, offsets, rows):
+        """[B x T x 2] x and y of the trajectories of rows, linearly resampled to T samples."""
+        start = offsets[rows]
+        samples = offsets[rows + 1] - start
+        if np.all(samples == self.length):
+            return points[start[:, None] + np.arange(self.length), :2]
+        position = np.linspace(0, 1, self.length) * (samples[:, None] - 1)
+        low = np.minimum(np.floor(position).astype(np.int64), samples[:, None] - 1)
+        high = np.minimum(low + 1, samples[:, None] - 1)
+        fraction = (position - low)[:, :, None]
+        return (1 - fraction) * points[start[:, None] + low, :2] + fraction * points[start[:, None] + high, :2]
+
+    def _open(self):
+        def load(name):
+            return np.load(os.path.join(self.directory, name), mmap_mode='r') if name is not None else None
+
+        self._shards = []
+        for shard in self.index['shards']:
+            trajectories = None
+            if shard['trajectories'] is not None:
+                trajectories = (load(shard['trajectories']), np.array(load(shard['trajectory_offsets'])))
+            self._shards.append((load(shard['images']), load(shard['outputs']), trajectories))
+
+    def __getstate__(self):
+        # every worker opens its own memory maps
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+
+class _IndexSampler(Sampler):
+    """The given indices in order."""
+    def __init__(self, indices):
+        self.indices = indices
+
+    def __iter__(self):
+        return iter(self.indices.tolist())
+
+    def __len__(self):
+        return len(self.indices)
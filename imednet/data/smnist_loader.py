@@ -1,8 +1,16 @@
+import os
+import hashlib
+
 import scipy.io as sio
 import torch
 from torch.autograd import Variable
 import numpy as np
 
+from imednet.utils.dmp_basis import operator_cache
+
+# bump when the parsed arrays change, invalidates the cached ones
+CACHE_VERSION = 2
+
 
 class Mapping:
     y_max = 1
@@ -12,12 +20,16 @@ class Mapping:
 
 
 class MatLoader:
-    def load_data(file,
+    def read_data(file,
                   load_original_trajectories=False,
                   image_key='imageArray',
                   traj_key='trajArray',
                   dmp_params_key='DMPParamsArray',
                   dmp_traj_key='DMPTrajArray'):
+        """
+        Images in their stored dtype, unscaled [tau, y0, goal, w] outputs and
+        the original trajectories of a .mat file, see load_data.
+        """
         # Load data struct
         data = sio.loadmat(file)
 
@@ -33,44 +45,94 @@ class MatLoader:
             dmp_traj_key = 'DMP_trj'
 
         # Load images
-        images = []
-        for image in data[image_key][0, 0][0]:
-            images.append(image.astype('float'))
-        images = np.array(images)
+        images = np.stack(data[image_key][0, 0][0])
 
-        # Load DMPs
+        # Load DMPs, one field of all structs at a time, as [tau, y0, goal, w]
         DMP_data = data[dmp_params_key][0, 0][0]
-        outputs = []
-        for dmp in DMP_data:
-            tau = dmp['tau'][0, 0][0, 0]
-            w = dmp['w'][0, 0]
-            goal = dmp['goal'][0, 0][0]
-            y0 = dmp['y0'][0, 0][0]
-            # dy0 = np.array([0,0])
-            learn = np.append(tau, y0)
-            # learn = np.append(learn,dy0)
-            learn = np.append(learn, goal)  # Correction
-            learn = np.append(learn, w)
-            outputs.append(learn)
-        outputs = np.array(outputs)
-
-        '''
-        scale = np.array([np.abs(outputs[:, i]).max() for i in range(0, 5)])
-        scale = np.concatenate((scale, np.array([np.abs(outputs[:, 5:outputs.shape[1]]).max() for i in range(5, outputs.shape[1])])))
-        '''
-
-        # Scale outputs
+        tau = np.array([dmp['tau'][0, 0][0, 0] for dmp in DMP_data], dtype=np.float64)
+        y0 = np.array([dmp['y0'][0, 0][0] for dmp in DMP_data], dtype=np.float64)
+        goal = np.array([dmp['goal'][0, 0][0] for dmp in DMP_data], dtype=np.float64)
+        w = np.array([dmp['w'][0, 0] for dmp in DMP_data], dtype=np.float64)
+        outputs = np.column_stack((tau, y0, goal, w.reshape(len(w), -1)))
+
+        # Load original trajectories
+        original_trj = []
+        if load_original_trajectories:
+            original_trj = list(data[traj_key][0, 0][0])
+
+        return images, outputs, original_trj
+
+    def load_data(file,
+                  load_original_trajectories=False,
+                  image_key='imageArray',
+                  traj_key='trajArray',
+                  dmp_params_key='DMPParamsArray',
+                  dmp_traj_key='DMPTrajArray',
+                  cache=True,
+                  uint8=False):
+        """
+        Images, outputs scaled to [-1, 1], their Mapping and the original
+        trajectories of a .mat file.
+
+        The images are float64. With uint8, 8-bit images stay uint8 (an
+        eighth of the memory, the models convert them, see
+        encoder_decoder.image_input), any other images are float64.
+
+        With cache and a cache directory ($IMEDNET_CACHE_DIR, see
+        dmp_basis.OperatorCache) the parsed arrays are stored there under the
+        sha1 of the file contents and the keys, so loading the same file
+        again only memory-maps them (copy-on-write).
+        """
+        keys = (image_key, traj_key, dmp_params_key, dmp_traj_key)
+        if not cache or not operator_cache.directory:
+            images, outputs, scaling, original_trj = MatLoader._parse(file, load_original_trajectories, *keys)
+            return images if uint8 else np.asarray(images, dtype='float'), outputs, scaling, original_trj
+
+        # parse the file at most once, whatever is missing from the cache; the
+        # dataset arrays are only memory-mapped, never kept by the cache
+        parsed = []
+
+        def build(i, array):
+            def build_array():
+                if not parsed:
+                    parsed.extend(MatLoader._parse(file, load_original_trajectories, *keys))
+                return array(parsed[i])
+            return build_array
+
+        key = (CACHE_VERSION, _file_digest(file)) + keys
+        images = operator_cache.get('smnist_images', key, build(0, lambda images: images), memory=False)
+        outputs = operator_cache.get('smnist_outputs', key, build(1, lambda outputs: outputs), memory=False)
+        x_range = operator_cache.get('smnist_scaling', key,
+                                     build(2, lambda scaling: np.stack((scaling.x_min, scaling.x_max))),
+                                     memory=False)
+        scaling = Mapping()
+        scaling.x_min = np.array(x_range[0])
+        scaling.x_max = np.array(x_range[1])
+        scaling.y_max = 1
+        scaling.y_min = -1
+
+        original_trj = []
+        if load_original_trajectories:
+            # ragged trajectories as their concatenated points and lengths
+            points = operator_cache.get('smnist_trajectories', key,
+                                        build(3, lambda trajectories: np.concatenate(trajectories)), memory=False)
+            lengths = operator_cache.get('smnist_trajectory_lengths', key,
+                                         build(3, lambda trajectories: np.array([len(t) for t in trajectories])),
+                                         memory=False)
+            original_trj = np.split(points.view(np.ndarray), np.cumsum(lengths)[:-1])
+
+        return images if uint8 else np.asarray(images, dtype='float'), outputs, scaling, original_trj
+
+    def _parse(file, load_original_trajectories, image_key, traj_key, dmp_params_key, dmp_traj_key):
+        images, outputs, original_trj = MatLoader.read_data(file, load_original_trajectories, image_key, traj_key,
+                                                            dmp_params_key, dmp_traj_key)
+        images = stored_images(images)
+
+        # Scale outputs, every column of tau, y0 and goal and all weights together
         y_max = 1
         y_min = -1
-        x_max = np.array([outputs[:, i].max() for i in range(0, 5)])
-        x_max = np.concatenate(
-            (x_max, np.array([outputs[:, 5:outputs.shape[1]].max() for i in range(5, outputs.shape[1])])))
-        x_min = np.array([outputs[:, i].min() for i in range(0, 5)])
-        x_min = np.concatenate(
-            (x_min, np.array([outputs[:, 5:outputs.shape[1]].min() for i in range(5, outputs.shape[1])])))
-        scale = x_max-x_min
-        scale[np.where(scale == 0)] = 1
-        outputs = (y_max - y_min) * (outputs-x_min) / scale + y_min
+        x_min, x_max = output_range(outputs)
+        outputs = scale_outputs(outputs, x_min, x_max, y_min, y_max)
 
         # Load scaling
         scaling = Mapping()
@@ -79,15 +141,59 @@ class MatLoader:
         scaling.y_max = y_max
         scaling.y_min = y_min
 
-        # Load original trajectories
-        original_trj = []
-        if load_original_trajectories:
-            trj_data = data[traj_key][0, 0][0]
-            original_trj = [(trj) for trj in trj_data[:]]
-
         return images, outputs, scaling, original_trj
 
     def data_for_network(images, outputs):
         input_data = Variable(torch.from_numpy(images)).float()
         output_data = Variable(torch.from_numpy(outputs), requires_grad=False).float()
         return input_data, output_data
+
+
+def output_range(outputs, dof=2):
+    """
+    x_min and x_max of the output scaling of MatLoader.load_data.
+
+    # Arguments
+        outputs: [B x (1+2*Dof+N*Dof)] unscaled [tau, y0, goal, w]
+        dof: number of DOF
+
+    # Returns
+        the extremes of every column of tau, y0 and goal and of all weights
+        together, each [1+2*Dof+N*Dof]
+    """
+    k = 1 + 2*dof
+    x_max = np.concatenate((outputs[:, :k].max(0), np.full(outputs.shape[1] - k, outputs[:, k:].max())))
+    x_min = np.concatenate((outputs[:, :k].min(0), np.full(outputs.shape[1] - k, outputs[:, k:].min())))
+    return x_min, x_max
+
+
+def scale_outputs(outputs, x_min, x_max, y_min=-1, y_max=1):
+    """outputs mapped from [x_min, x_max] to [y_min, y_max], constant columns to y_min."""
+    scale = x_max - x_min
+    scale[np.where(scale == 0)] = 1
+    return (y_max - y_min) * (outputs - x_min) / scale + y_min
+
+
+def stored_images(images):
+    """Images as uint8 if every pixel is an 8-bit value, as float64 otherwise."""
+    images = np.asarray(images)
+    if images.dtype == np.uint8:
+        return images
+    if images.size and np.issubdtype(images.dtype, np.number) and images.min() >= 0 and images.max() <= 255 \
+            and np.array_equal(images, np.round(images)):
+        return images.astype(np.uint8)
+    return images.astype('float')
+
+
+def _file_digest(file, chunk=2**20):
+    """sha1 of the file contents, remembered for the same path, size and modification time."""
+    def build():
+        digest = hashlib.sha1()
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(chunk), b''):
+                digest.update(block)
+        return np.frombuffer(digest.digest(), dtype=np.uint8)
+
+    stat = os.stat(file)
+    key = (os.path.realpath(file), stat.st_size, stat.st_mtime_ns)
+    return bytes(operator_cache.get('smnist_digest', key, build)).hex()
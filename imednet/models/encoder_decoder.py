@@ -8,6 +8,8 @@ import numpy as np
 
 from imednet.data.smnist_loader import Mapping
 from imednet.models.mnist_cnn import Net as MNISTNet
+from imednet.utils.dmp_loss import parameter_rows
+from imednet.utils.dmp_pca import PCAWeightHead
 
 try:
     from imednet.utils.dmp_layer import DMPIntegrator, DMPParameters
@@ -16,6 +18,26 @@ except ImportError:
     from imednet.utils.dmp_layer_no_cuda import DMPIntegrator, DMPParameters
 
 
+# x/128 - 1, the normalization of 8-bit MNIST images in Trainer.get_data_for_network
+MNIST_NORMALIZATION = (1.0 / 128, -1.0)
+
+
+def image_input(x, normalization=None):
+    """
+    Float network input from stored images.
+
+    Images kept as uint8 are converted here, as the first operation of the
+    models, and mapped to x*scale + offset with normalization = (scale,
+    offset) if given. Float inputs are already normalized and pass as they are.
+    """
+    if x.dtype != torch.uint8:
+        return x
+    x = x.float()
+    if normalization is not None:
+        x = x * normalization[0] + normalization[1]
+    return x
+
+
 def load_model(model_path, root_path=None):
     if root_path:
         model_path = os.path.join(root_path, model_path)
@@ -85,6 +107,12 @@ def load_model(model_path, root_path=None):
     else:
         model = model_class(layer_sizes, None, scaling)
 
+    # Load the normalization of uint8 images
+    try:
+        model.image_normalization = tuple(np.load(os.path.join(model_path, 'image_normalization.npy')).tolist())
+    except IOError:
+        pass
+
     # Load the model state parameters
     state = torch.load(os.path.join(model_path, 'net_parameters'))
     model.load_state_dict(state)
@@ -186,6 +214,7 @@ class EncoderDecoderNet(torch.nn.Module):
             self.add_module("middle_layer_" + str(i), layer)
         self.output_layer = torch.nn.Linear(layer_sizes[-2], layer_sizes[-1])
         self.scale = scale
+        self.image_normalization = None
         self.loss = 0
 
     def forward(self, x):
@@ -198,6 +227,7 @@ class EncoderDecoderNet(torch.nn.Module):
         #activation_fn = torch.nn.ReLU6()
         activation_fn = torch.nn.Tanh()
 
+        x = image_input(x, self.image_normalization)
         if self.conv:
             x = x.view(-1, 1, self.imageSize, self.imageSize)
             x = self.firstLayer(x)
@@ -220,7 +250,9 @@ class DMPEncoderDecoderNet(torch.nn.Module):
                  layer_sizes=[784, 200, 50],
                  conv=None,
                  scale=None,
-                 root_path=None):
+                 root_path=None,
+                 dmp_forward_mode=None,
+                 pca_basis=None):
         """
         Creates a custom Network
 
@@ -231,6 +263,18 @@ class DMPEncoderDecoderNet(torch.nn.Module):
                 input_layer -> torch.nn.Linear(784,500)
                 middle_layers -> [torch.nn.Linear(500,200)]
                 output_layer -> torch.nn.Linear(200,50)
+
+        dmp_forward_mode -> DMPIntegrator forward mode, 'operator' computes
+                            the trajectories as one matrix multiply, 'fused'
+                            uses the TorchScript kernel of dmp_fused, 'tau'
+                            also takes tau as the first of the
+                            layer_sizes[-1] = 55 outputs, 'parameters'
+                            returns the [y0, goal, w] rows of every DOF
+                            for dmp_loss.GramMSELoss
+        pca_basis -> dmp_pca.WeightBasis of the training weights; the output
+                     layer then predicts y0, goal and its k coefficients
+                     (4 + k outputs instead of layer_sizes[-1]) and
+                     dmp_pca.PCAWeightHead rolls them out
         """
         super(DMPEncoderDecoderNet, self).__init__()
         self.conv = conv
@@ -248,14 +292,26 @@ class DMPEncoderDecoderNet(torch.nn.Module):
             layer = torch.nn.Linear(layer_sizes[i], layer_sizes[i+1])
             self.middle_layers.append(layer)
             self.add_module("middle_layer_" + str(i), layer)
-        self.output_layer = torch.nn.Linear(layer_sizes[-2], layer_sizes[-1])
+        output_size = layer_sizes[-1] if pca_basis is None else 4 + len(pca_basis)
+        self.output_layer = torch.nn.Linear(layer_sizes[-2], output_size)
         self.scale = scale
+        self.image_normalization = None
         self.loss = 0
         self.DMPparam = DMPParameters(25, 3, 0.01, 2, scale)
+        self.pca_head = None if pca_basis is None else PCAWeightHead(pca_basis, self.DMPparam)
         self.func = DMPIntegrator()
-        '''self.register_buffer('DMPp', self.DMPparam.data_tensor)
-        self.register_buffer('scale_t', self.DMPparam.scale_tensor)
-        self.register_buffer('param_grad', self.DMPparam.grad_tensor)'''
+        self.dmp_forward_mode = dmp_forward_mode
+        # time steps of the output, all when None (set by Trainer.train_dmp)
+        self.time_indices = None
+        # tau bucket of every sample and the TauBuckets.operators (set by Trainer.train_dmp)
+        self.tau_buckets = None
+        self.tau_operators = None
+        self.register_buffer('DMPp', self.DMPparam.data_tensor)
+        if dmp_forward_mode == 'tau':
+            self.register_buffer('scale_t', self.DMPparam.tau_scale_tensor)
+        else:
+            self.register_buffer('scale_t', self.DMPparam.scale_tensor)
+        self.register_buffer('param_grad', self.DMPparam.grad_tensor)
 
     def forward(self, x):
         """
@@ -267,6 +323,7 @@ class DMPEncoderDecoderNet(torch.nn.Module):
         # activation_fn = torch.nn.ReLU6()
         activation_fn = torch.nn.Tanh()
 
+        x = image_input(x, self.image_normalization)
         if self.conv:
             x = x.view(-1, 1, self.imageSize, self.imageSize)
             x = self.firstLayer(x)
@@ -278,7 +335,17 @@ class DMPEncoderDecoderNet(torch.nn.Module):
         for layer in self.middle_layers:
             x = activation_fn(layer(x))
         x = self.output_layer(x)
-        output = self.func.apply(x, self.DMPp, self.param_grad, self.scale_t)
+        if self.pca_head is not None:
+            # principal-component coefficients straight to trajectories
+            return self.pca_head(x, self.time_indices)
+        if self.dmp_forward_mode == 'parameters':
+            # [y0, goal, w] rows for dmp_loss.GramMSELoss instead of trajectories
+            return parameter_rows(x, self.DMPp, self.scale_t)
+        if self.tau_buckets is not None:
+            # samples of mixed duration, see dmp_buckets.TauBuckets
+            return self.func.apply(x, self.DMPp, self.tau_operators, self.scale_t, 'buckets', self.time_indices,
+                                   self.tau_buckets)
+        output = self.func.apply(x, self.DMPp, self.param_grad, self.scale_t, self.dmp_forward_mode, self.time_indices)
         return output
 
     def isCuda(self):
@@ -338,6 +405,7 @@ class CNNEncoderDecoderNet(torch.nn.Module):
             self.add_module("middle_layer_" + str(i), layer)
         self.output_layer = torch.nn.Linear(layer_sizes[-2], layer_sizes[-1])
         self.scale = scale
+        self.image_normalization = None
         self.loss = 0
 
     def forward(self, x):
@@ -350,7 +418,7 @@ class CNNEncoderDecoderNet(torch.nn.Module):
         # activation_fn = torch.nn.ReLU6()
         activation_fn = torch.nn.Tanh()
 
-        x = x.view(-1, 1, self.image_size, self.image_size)
+        x = image_input(x, self.image_normalization).view(-1, 1, self.image_size, self.image_size)
 
         # Run the input through the pretrained CNN
         x = self.cnn_model(x)
@@ -374,7 +442,9 @@ class FullCNNEncoderDecoderNet(torch.nn.Module):
                  pretrained_cnn_model_path=None,
                  layer_sizes=[784, 200, 50],
                  scale=None,
-                 root_path=None):
+                 root_path=None,
+                 dmp_forward_mode=None,
+                 pca_basis=None):
         """
         Creates a full convolutional image-to-motion encoder-decoder
         (CIMEDNet) network with DMP integration.
@@ -387,6 +457,18 @@ class FullCNNEncoderDecoderNet(torch.nn.Module):
                 input_layer -> torch.nn.Linear(784,500)
                 middle_layers -> [torch.nn.Linear(500,200)]
                 output_layer -> torch.nn.Linear(200,50)
+
+        dmp_forward_mode -> DMPIntegrator forward mode, 'operator' computes
+                            the trajectories as one matrix multiply, 'fused'
+                            uses the TorchScript kernel of dmp_fused, 'tau'
+                            also takes tau as the first of the
+                            layer_sizes[-1] = 55 outputs, 'parameters'
+                            returns the [y0, goal, w] rows of every DOF
+                            for dmp_loss.GramMSELoss
+        pca_basis -> dmp_pca.WeightBasis of the training weights; the output
+                     layer then predicts y0, goal and its k coefficients
+                     (4 + k outputs instead of layer_sizes[-1]) and
+                     dmp_pca.PCAWeightHead rolls them out
         """
         super(FullCNNEncoderDecoderNet, self).__init__()
 
@@ -420,15 +502,27 @@ class FullCNNEncoderDecoderNet(torch.nn.Module):
             layer = torch.nn.Linear(layer_sizes[i], layer_sizes[i+1])
             self.middle_layers.append(layer)
             self.add_module("middle_layer_" + str(i), layer)
-        self.output_layer = torch.nn.Linear(layer_sizes[-2], layer_sizes[-1])
+        output_size = layer_sizes[-1] if pca_basis is None else 4 + len(pca_basis)
+        self.output_layer = torch.nn.Linear(layer_sizes[-2], output_size)
         self.scale = scale
+        self.image_normalization = None
         self.loss = 0
 
         self.dmp_params = DMPParameters(25, 3, 0.01, 2, scale)
+        self.pca_head = None if pca_basis is None else PCAWeightHead(pca_basis, self.dmp_params)
         self.dmp_integrator = DMPIntegrator()
+        self.dmp_forward_mode = dmp_forward_mode
+        # time steps of the output, all when None (set by Trainer.train_dmp)
+        self.time_indices = None
+        # tau bucket of every sample and the TauBuckets.operators (set by Trainer.train_dmp)
+        self.tau_buckets = None
+        self.tau_operators = None
 
         self.register_buffer('dmp_p', self.dmp_params.data_tensor)
-        self.register_buffer('scale_t', self.dmp_params.scale_tensor)
+        if dmp_forward_mode == 'tau':
+            self.register_buffer('scale_t', self.dmp_params.tau_scale_tensor)
+        else:
+            self.register_buffer('scale_t', self.dmp_params.scale_tensor)
         self.register_buffer('param_grad', self.dmp_params.grad_tensor)
 
         if self.isCuda():
@@ -446,7 +540,7 @@ class FullCNNEncoderDecoderNet(torch.nn.Module):
         # activation_fn = torch.nn.ReLU6()
         activation_fn = torch.nn.Tanh()
 
-        x = x.view(-1, 1, self.image_size, self.image_size)
+        x = image_input(x, self.image_normalization).view(-1, 1, self.image_size, self.image_size)
 
         # Run the input through the pretrained CNN
         x = self.cnn_model(x)
@@ -460,7 +554,18 @@ class FullCNNEncoderDecoderNet(torch.nn.Module):
         x = self.output_layer(x)
 
         # Integrate the DMPs to calculate the predicted output trajectories
-        output = self.dmp_integrator.apply(x, self.dmp_p, self.param_grad, self.scale_t)
+        if self.pca_head is not None:
+            # principal-component coefficients straight to trajectories
+            return self.pca_head(x, self.time_indices)
+        if self.dmp_forward_mode == 'parameters':
+            # [y0, goal, w] rows for dmp_loss.GramMSELoss instead of trajectories
+            return parameter_rows(x, self.dmp_p, self.scale_t)
+        if self.tau_buckets is not None:
+            # samples of mixed duration, see dmp_buckets.TauBuckets
+            return self.dmp_integrator.apply(x, self.dmp_p, self.tau_operators, self.scale_t, 'buckets',
+                                             self.time_indices, self.tau_buckets)
+        output = self.dmp_integrator.apply(x, self.dmp_p, self.param_grad, self.scale_t, self.dmp_forward_mode,
+                                           self.time_indices)
 
         return output
 
@@ -519,10 +624,12 @@ class STIMEDNet(torch.nn.Module):
         self.fc_loc[2].bias.data.copy_(torch.tensor([1, 0, 0, 0, 1, 0], dtype=torch.float))
 
         self.scale = scale
+        self.image_normalization = None
         self.loss = 0
 
     # Spatial transformer network forward function
     def stn(self, x):
+        x = image_input(x, self.image_normalization)
         xs = self.localization(x)
         xs = xs.view(-1, self.localizer_out_size)
         theta = self.fc_loc(xs)
@@ -557,10 +664,15 @@ class FullSTIMEDNet(torch.nn.Module):
                  image_size=[40, 40, 1],
                  grid_size=None,
                  scale=None,
-                 root_path=None):
+                 root_path=None,
+                 dmp_forward_mode=None):
         """
         image_size: [H, W, C]
         grid_size: [H, W, C]
+        dmp_forward_mode: DMPIntegrator forward mode, 'operator' computes
+                          the trajectories as one matrix multiply, 'fused'
+                          uses the TorchScript kernel of dmp_fused, 'tau'
+                          also takes tau as the first of the 55 outputs
         """
         super(FullSTIMEDNet, self).__init__()
 
@@ -630,13 +742,23 @@ class FullSTIMEDNet(torch.nn.Module):
         self.fc_T[4].bias.data.copy_(torch.tensor([1, 0, 0, 0, 1, 0, 0, 0, 1], dtype=torch.float))
 
         self.scale = scale
+        self.image_normalization = None
         self.loss = 0
 
         self.dmp_params = DMPParameters(25, 3, 0.01, 2, scale)
         self.dmp_integrator = DMPIntegrator()
+        self.dmp_forward_mode = dmp_forward_mode
+        # time steps of the output, all when None (set by Trainer.train_dmp)
+        self.time_indices = None
+        # tau bucket of every sample and the TauBuckets.operators (set by Trainer.train_dmp)
+        self.tau_buckets = None
+        self.tau_operators = None
 
         self.register_buffer('dmp_p', self.dmp_params.data_tensor)
-        self.register_buffer('scale_t', self.dmp_params.scale_tensor)
+        if dmp_forward_mode == 'tau':
+            self.register_buffer('scale_t', self.dmp_params.tau_scale_tensor)
+        else:
+            self.register_buffer('scale_t', self.dmp_params.scale_tensor)
         self.register_buffer('param_grad', self.dmp_params.grad_tensor)
 
         if self.isCuda():
@@ -646,6 +768,7 @@ class FullSTIMEDNet(torch.nn.Module):
 
     # Spatial transformer network forward function
     def stn(self, x):
+        x = image_input(x, self.image_normalization)
         xs = self.localization(x)
         xs = xs.view(-1, self.localizer_out_size)
         theta = self.fc_loc(xs)
@@ -660,11 +783,17 @@ class FullSTIMEDNet(torch.nn.Module):
     # Motion transformer network forward function
     def mtn(self, x, theta):
         # 1. Integrate the DMPs to calculate the predicted canonical motion trajectories.
-        x = self.dmp_integrator.apply(x, self.dmp_p, self.param_grad, self.scale_t)
+        if self.tau_buckets is not None:
+            # samples of mixed duration, see dmp_buckets.TauBuckets
+            x = self.dmp_integrator.apply(x, self.dmp_p, self.tau_operators, self.scale_t, 'buckets',
+                                          self.time_indices, self.tau_buckets)
+        else:
+            x = self.dmp_integrator.apply(x, self.dmp_p, self.param_grad, self.scale_t, self.dmp_forward_mode,
+                                          self.time_indices)
 
         # 2. Reshape the DMP integrator output into vector trajectories.
         x_traj_vectors = x.view(int(x.shape[0]/2), 2, x.shape[1]).transpose(0,1)
-        x_traj_vectors_with_ones = torch.cat((x_traj_vectors, torch.ones(1,int(x.shape[0]/2), x.shape[1]).cuda()), 0).cuda()
+        x_traj_vectors_with_ones = torch.cat((x_traj_vectors, x.new_ones(1,int(x.shape[0]/2), x.shape[1])), 0)
 
         # 3. Do the transformations.
         transformed_x_traj_vectors = torch.einsum('nij,jnm->nim', [theta, x_traj_vectors_with_ones])
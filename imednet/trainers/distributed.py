@@ -0,0 +1,231 @@
+"""
+Data-parallel training on CPU processes with torch.distributed (gloo).
+
+launch forks the training into processes of one gloo process group, the
+Trainer methods notice the initialized group and train data-parallel:
+every process holds the whole model, computes one contiguous shard of
+every batch and the gradients and loss of a step are averaged over all
+processes inside the optimizer closure. All processes see the same loss,
+gradients and parameters, so the custom SCG and Adam optimizers (and
+their reset) take the same steps everywhere, exactly as in a single
+process on the whole batch. Without a process group all functions here
+act on the one process.
+"""
+import os
+import pickle
+import signal
+import socket
+import traceback
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from multiprocessing.connection import wait
+
+
+def world_size():
+    """Number of processes of the initialized process group, 1 without one."""
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_world_size()
+    return 1
+
+
+def rank():
+    """Rank of this process, 0 without a process group."""
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank()
+    return 0
+
+
+def shard(x, y=None):
+    """
+    This process's contiguous part of a batch.
+
+    # Arguments
+        x: [B x ...] samples or sample indices
+        y: [k*B x ...] targets with k consecutive rows of every sample, or None
+
+    # Returns
+        the part of x, and of y if given
+    """
+    size = world_size()
+    if size > 1:
+        r = rank()
+        start, stop = len(x) * r // size, len(x) * (r + 1) // size
+        if y is not None:
+            k = len(y) // len(x)
+            y = y[start * k:stop * k]
+        x = x[start:stop]
+    return x if y is None else (x, y)
+
+
+def broadcast(tensor):
+    """tensor of rank 0 in every process, copied in place."""
+    if world_size() > 1:
+        dist.broadcast(tensor, 0)
+    return tensor
+
+
+def broadcast_model(model):
+    """Parameters and buffers of rank 0 in every process."""
+    for tensor in model.state_dict().values():
+        broadcast(tensor)
+
+
+def mean_loss(loss, weight):
+    """
+    Mean of the losses of all processes, each weighted by weight, e.g. its
+    number of target rows, so a mean loss over shards equals the one over
+    the whole batch.
+    """
+    if world_size() == 1:
+        return loss
+    total = torch.stack((loss.detach() * weight, torch.tensor(float(weight), dtype=loss.dtype)))
+    dist.all_reduce(total)
+    return total[0] / total[1]
+
+
+def all_reduce_gradients(parameters, loss, weight):
+    """
+    Averages the gradients and the loss of a step over all processes, each
+    weighted by weight, in one all-reduce.
+
+    Processes without samples pass a zero loss and weight 0. The gradients
+    are replaced by the averaged ones.
+
+    # Returns
+        the averaged loss
+    """
+    if world_size() == 1:
+        return loss
+    parameters = [p for p in parameters if p.requires_grad]
+    flat = [(p.grad if p.grad is not None else torch.zeros_like(p)).reshape(-1) for p in parameters]
+    flat = torch.cat(flat + [loss.detach().reshape(1).to(flat[0].dtype)]) * weight
+    flat = torch.cat((flat, flat.new_tensor([weight])))
+    dist.all_reduce(flat)
+    flat = flat[:-1] / flat[-1]
+    offset = 0
+    for p in parameters:
+        p.grad = flat[offset:offset + p.numel()].view_as(p)
+        offset += p.numel()
+    return flat[-1]
+
+
+def agree(stop, flag):
+    """
+    The training control of all processes, e.g. a stop from the GUI or
+    Ctrl-C in one process.
+
+    # Returns
+        whether any process stops, whether any process has flag set
+    """
+    if world_size() == 1:
+        return stop, flag
+    state = torch.tensor([float(stop), float(flag)])
+    dist.all_reduce(state, dist.ReduceOp.MAX)
+    return bool(state[0]), bool(state[1])
+
+
+class NullWriter(object):
+    """Stands in for the SummaryWriter and files of the processes that do not write."""
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def launch(fn, processes, threads=None, port=None):
+    """
+    Runs fn() data-parallel in forked processes of one gloo process group.
+
+    The processes share the data loaded before launching through fork. Only
+    rank 0 prints, its return value is returned. When a process fails, the
+    others are terminated and its traceback is raised as a RuntimeError.
+
+    # Arguments
+        fn: training function, e.g. calling Trainer.train_dmp
+        processes: number of processes
+        threads: torch threads of every process, the cores divided among the
+            processes by default
+        port: port of the process group on localhost, a free one by default
+    """
+    if port is None:
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // processes)
+
+    context = mp.get_context('fork')
+    pipes = [context.Pipe(duplex=False) for _ in range(processes)]
+    # the workers handle Ctrl-C, every trainer stops at the end of its epoch
+    handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    workers = []
+    records = {}
+    try:
+        for r in range(processes):
+            workers.append(context.Process(target=_run, args=(fn, r, processes, threads, port, handler,
+                                                              pipes[r][1])))
+            workers[r].start()
+            pipes[r][1].close()
+
+        # a (failure, result) record of every rank, or its exit without one;
+        # after a failure the others get a moment to report theirs, as a rank
+        # that dies shows up as a connection error in the others
+        timeout = None
+        while len(records) < processes:
+            waiting = {}
+            for r in range(processes):
+                if r not in records:
+                    waiting[pipes[r][0]] = r
+                    waiting[workers[r].sentinel] = r
+            ready = wait(list(waiting), timeout)
+            if not ready:
+                break
+            for r in sorted(set(waiting[connection] for connection in ready)):
+                if pipes[r][0].poll():
+                    try:
+                        records[r] = pickle.loads(pipes[r][0].recv_bytes())
+                    except EOFError:
+                        pass
+                if r not in records and not workers[r].is_alive():
+                    records[r] = ('exited with code {}\n'.format(workers[r].exitcode), None)
+                if r in records and records[r][0] and timeout is None:
+                    timeout = 1.0
+    finally:
+        if len(records) < processes or any(record[0] for record in records.values()):
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+        for worker in workers:
+            worker.join()
+        for reader, _ in pipes:
+            reader.close()
+        signal.signal(signal.SIGINT, handler)
+    failures = ['rank {}: {}'.format(r, records[r][0]) for r in sorted(records) if records[r][0]]
+    failures += ['rank {}: exited with code {}\n'.format(r, worker.exitcode)
+                 for r, worker in enumerate(workers) if r not in records]
+    if failures:
+        raise RuntimeError('data-parallel training failed\n' + ''.join(failures))
+    return records[0][1]
+
+
+def _run(fn, r, processes, threads, port, handler, connection):
+    if handler is not None:
+        signal.signal(signal.SIGINT, handler)
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    torch.set_num_threads(threads)
+    if r != 0:
+        devnull = open(os.devnull, 'w')
+        os.dup2(devnull.fileno(), 1)
+    dist.init_process_group('gloo', rank=r, world_size=processes)
+    try:
+        result = fn()
+    except BaseException:
+        connection.send_bytes(pickle.dumps((traceback.format_exc(), None)))
+        raise
+    finally:
+        dist.destroy_process_group()
+    # only rank 0 returns its result, in a plain pickle so the tensors do not
+    # refer to memory of this process
+    connection.send_bytes(pickle.dumps((None, result if r == 0 else None)))
+    connection.close()
@@ -20,8 +20,14 @@ import signal
 import sys
 
 from imednet.data.trajectory_loader import TrajectoryLoader
-from imednet.utils.dmp_class import DMP
+from imednet.data.dataset_views import split_views
+from imednet.utils.dmp_class import DMP, DMPSet
+from imednet.utils.dmp_batch import joint_dmps
+from imednet.utils.dmp_cache import rollout_cache
+from imednet.utils.dmp_layer_no_cuda import time_subset
+from imednet.utils.dmp_loss import GramMSELoss, project_trajectories
 from imednet.utils.custom_optim import SCG, Adam
+from imednet.trainers import distributed
 
 
 
@@ -35,6 +41,7 @@ class Trainer:
     plot_im = False
     indeks = []
     resetting_optimizer = False
+    rank = 0
 
     def __init__(self,
                  launch_tensorboard=False,
@@ -83,7 +90,9 @@ class Trainer:
                 plt.imshow(image, cmap='gray', extent=[0, H+1, W+1, 0])
 
         if dmp is not None:
-            dmp.joint()
+            # the rollout of the current parameters, a DMP that was already
+            # rolled out (e.g. by show_network_output) is a cache hit
+            dmp.joint(cache=rollout_cache)
             # plt.plot(dmp.Y[:,0], dmp.Y[:,1],'-r', label='dmp', )
             # print("dmp.Y{}".format(dmp.Y))
             # print("dmp.Y len{}".format(dmp.Y.shape))
@@ -134,38 +143,18 @@ class Trainer:
         trajectories = np.array(trajectories)
         return trajectories
 
-    def create_dmps(trajectories,N, sampling_time):
+    def create_dmps(trajectories,N, sampling_time, dtype=np.float64):
         """
         Creates DMPs from the trajectorires
 
         trajectories -> list of trajectories to convert to DMPs
         N -> ampunt of base functions in the DMPs
         sampling_time -> sampling time for the DMPs
+        dtype -> storage type of the DMP parameters (e.g. np.float32)
         """
-        DMPs = []
-        i = 0
-        for trajectory in trajectories:
-            dmp = DMP(N,sampling_time)
-            x = trajectory[:,0]
-            y = trajectory[:,1]
-            time = np.array([trajectory[:,2],trajectory[:,2]]).transpose()[:-2]
-            dt = np.diff(trajectory[:,2],1)
-            if (dt == 0).any():
-                print("Problem with ", i, " -th trajectory")
-            dx = np.diff(x,1)/dt
-            dy = np.diff(y,1)/dt
-            ddy = np.diff(dy,1)/dt[:-1]
-            ddx = np.diff(dx,1)/dt[:-1]
-            path = np.array([i for i in zip(x,y)])[:-2]
-            velocity = np.array([i for i in zip(dx,dy)])[:-1]
-            acceleration = np.array([i for i in zip(ddx,ddy)])
-            try:
-                dmp.track(time, path, velocity, acceleration)
-            except:
-                print("Problem with ", i, " -th trajectory")
-            DMPs.append(dmp)
-            i += 1
-        DMPs = np.array(DMPs)
+        DMPs = DMPSet.from_trajectories(trajectories, N, sampling_time, dtype)
+        for i in np.where(~np.isfinite(DMPs.w).all(axis=(1,2)))[0]:
+            print("Problem with ", i, " -th trajectory")
         return DMPs
 
     def create_output_parameters(DMPs, scale = None):
@@ -173,23 +162,18 @@ class Trainer:
         Returns desired output parameters for the network from the given DMPs
 
         create_output_parameters(DMPs) -> parameters for each DMP in form [tau, y0, dy0, goal, w]
-        DMPs -> list of DMPs that pair with the images input to the network
+        DMPs -> DMPSet (or list of DMPs) that pair with the images input to the network
         """
-        outputs = []
-        for dmp in DMPs:
-            learn = np.append(dmp.tau[0], dmp.y0)
-            learn = np.append(learn, dmp.dy0)
-            learn = np.append(learn, dmp.goal)
-            learn = np.append(learn, dmp.w)
-            outputs.append(learn)
-        outputs = np.array(outputs)
+        if not isinstance(DMPs, DMPSet):
+            DMPs = DMPSet.from_dmps(DMPs)
+        outputs = DMPs.parameters().astype(float)
         if scale is None:
-            scale = np.array([np.abs(outputs[:,i]).max() for i in range(outputs.shape[1])])
+            scale = np.abs(outputs).max(axis=0)
             scale[7:] = scale[7:].max()
         outputs = outputs / scale
         return outputs, scale
 
-    def get_data_for_network(images,DMPs, scale = None, useData = None):
+    def get_data_for_network(images,DMPs, scale = None, useData = None, uint8 = False):
         """
         Generates data that will be given to the Network
 
@@ -197,12 +181,17 @@ class Trainer:
         images -> MNIST images that will be fed to the Network
         DMPs -> DMPs that pair with MNIST images given in the same order
         useData -> array like containing indexes of images to use
+        uint8 -> keep the images as uint8 instead of normalizing them to x/128 - 1,
+                 the model has to do that (encoder_decoder.MNIST_NORMALIZATION)
         """
+        images = np.asarray(images)
         if useData is not None:
-            input_data = Variable(torch.from_numpy(images[useData])).float()
+            images = images[useData]
+        if uint8:
+            input_data = torch.from_numpy(images.astype(np.uint8))
         else:
             input_data = Variable(torch.from_numpy(images)).float()
-        input_data = input_data/128 - 1
+            input_data = input_data/128 - 1
         if DMPs is not None:
             if scale is None:
                 outputs, scale = Trainer.create_output_parameters(DMPs)
@@ -252,14 +241,31 @@ class Trainer:
         dmp.values(N, sampling_time, tau, y0, [0, 0], goal, w)
         return dmp
 
+    def create_dmp_set(self, outputs, scale, sampling_time, N, cuda = False):
+        """
+        Unscales a batch of network outputs into a DMPSet
+
+        create_dmp_set(outputs, scale, sampling_time, N) -> DMPSet of the predicted DMPs
+        outputs -> [B x (2N+5)] network outputs in form [tau, y0, goal, w]
+        """
+        if cuda:
+          outputs = outputs.cpu()
+
+        outputs = (scale.x_max-scale.x_min) * (outputs.double().data.numpy() -scale.y_min) / (scale.y_max-scale.y_min) + scale.x_min
+
+        tau = np.repeat(outputs[:, 0:1], 2, axis=1)
+        y0 = outputs[:, 1:3]
+        goal = outputs[:, 3:5]
+        w = outputs[:, 5:].reshape(-1, N, 2)
+        return DMPSet(N, sampling_time, tau, y0, np.zeros_like(y0), goal, w)
+
     def show_network_output(network, i, images, trajectories, DMPs, N, sampling_time, available=None, cuda=False):
         input_data, output_data, scale = Trainer.get_data_for_network(images, DMPs, available)
         scale = network.scale
         if i != -1:
             input_data = input_data[i]
         dmps = Trainer.get_dmp_from_image(network, input_data, N, sampling_time, cuda)
-        for dmp in dmps:
-            dmp.joint()
+        joint_dmps(dmps, cache=rollout_cache)
 
         if i != -1:
             print('Dmp from network:')
@@ -348,7 +354,6 @@ class Trainer:
 
     def split_dataset(self, images, outputs, train_set = 0.7, validation_set = 0.15, test_set = 0.15):
         r = len(images)
-        de = int(len(outputs)/r)
         trl = round(r*train_set)
         tel = round(r*test_set)
         val = r - trl - tel
@@ -357,53 +362,16 @@ class Trainer:
         indeks = np.append(indeks, 2*np.ones(val))
 
         random.shuffle(indeks)
-        x_t = []
-        y_t = []
-        x_v = []
-        y_v = []
-        x_te = []
-        y_te = []
 
         if self.indeks != []:
             indeks = self.indeks
         else:
+            # the split of rank 0 in data-parallel training
+            indeks = distributed.broadcast(torch.from_numpy(indeks)).numpy()
             self.indeks = indeks
 
-        for i in range(0, len(indeks)):
-            if indeks[i] == 0:
-                x_t.append(images[i])
-                y_t.append(outputs[i * de])
-
-                if de > 1:
-                    y_t.append(outputs[i * de+1])
-
-            if indeks[i] == 2:
-                x_v.append(images[i])
-                y_v.append(outputs[i*de])
-                if de > 1:
-                    y_v.append(outputs[i * de+1])
-
-            if indeks[i] == 1:
-                x_te.append(images[i])
-                y_te.append(outputs[i*de])
-                if de > 1:
-                    y_te.append(outputs[i * de+1])
-
-        x_train = np.array(x_t)
-        y_train = np.array(y_t)
-        x_validate = np.array(x_v)
-        y_validate = np.array(y_v)
-        x_test = np.array(x_te)
-        y_test = np.array(y_te)
-
-        input_data_train = Variable(torch.from_numpy(x_train)).float()
-        output_data_train = Variable(torch.from_numpy(y_train), requires_grad=False).float()
-        input_data_test = Variable(torch.from_numpy(x_test)).float()
-        output_data_test = Variable(torch.from_numpy(y_test), requires_grad=False).float()
-        input_data_validate = Variable(torch.from_numpy(x_validate)).float()
-        output_data_validate = Variable(torch.from_numpy(y_validate), requires_grad=False).float()
-
-        return input_data_train, output_data_train, input_data_test, output_data_test, input_data_validate, output_data_validate
+        # views of one gathered copy of the data, see dataset_views.split_views
+        return split_views(images, outputs, indeks)
 
     def train(self, model, images, outputs, path, train_param, file,
               optimizer_type='SCG', learning_rate=None,
@@ -416,7 +384,11 @@ class Trainer:
         epochs -> how many times to repeat learning_rate
         learning_rate -> how much the weight will be changed each epoch
         log_interval -> on each epoch divided by log_interval log will be printed
+
+        Trains data-parallel in the processes of distributed.launch.
         """
+        file = self._data_parallel(train_param, file)
+
         # Launch GUI
         if self._launch_gui:
             root = tk.Tk()
@@ -449,7 +421,7 @@ class Trainer:
         print(train_param.write_out())
 
         # Train
-        writer = SummaryWriter(path+'/log')
+        writer = SummaryWriter(path+'/log') if self.rank == 0 else distributed.NullWriter()
 
         if self._launch_tensorboard:
             command = ["tensorboard", "--logdir=" + path+"/log"]
@@ -476,6 +448,11 @@ class Trainer:
             input_data_validate_b = input_data_validate_b.cuda()
             output_data_validate_b = output_data_validate_b.cuda()
 
+        # the validation and test samples of this process
+        input_data_validate, output_data_validate = distributed.shard(input_data_validate_b, output_data_validate_b)
+        input_data_test, output_data_test = distributed.shard(input_data_test_b, output_data_test_b)
+        distributed.broadcast_model(model)
+
         print('finish dividing')
 
         criterion = torch.nn.MSELoss(size_average=True) #For calculating loss (mean squared error)
@@ -483,51 +460,10 @@ class Trainer:
         # scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, 200)
 
         # Set up optimizer
-        if optimizer_type.lower() == 'customadam':
-            if learning_rate:
-                optimizer = Adam(model.parameters(), lr=learning_rate, amsgrad=True)
-            else:
-                optimizer = Adam(model.parameters(), amsgrad=True)
-        elif optimizer_type.lower() == 'adam':
-            if learning_rate and weight_decay:
-                optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate, weight_decay=weight_decay, eps=0.001)
-            elif learning_rate:
-                optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate, eps=0.001)
-            else:
-                optimizer = torch.optim.Adam(model.parameters(), eps=0.001)
-        elif optimizer_type.lower() == 'sgd':
-            if learning_rate and momentum:
-                optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate, momentum=momentum)
-            elif learning_rate:
-                optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate)
-            elif momentum:
-                optimizer = torch.optim.SGD(model.parameters(), momentum=momentum)
-            else:
-                optimizer = torch.optim.SGD(model.parameters())
-        elif optimizer_type.lower() == 'adagrad':
-            if learning_rate and lr_decay and weight_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate, lr_decay=lr_decay, weight_decay=weight_decay)
-            elif learning_rate and lr_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate, lr_decay=lr_decay)
-            elif learning_rate and weight_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
-            elif learning_rate:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate)
-            elif lr_decay and weight_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr_decay=lr_decay, weight_decay=weight_decay)
-            elif lr_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr_decay=lr_decay)
-            elif lr_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr_decay=lr_decay)
-            else:
-                optimizer = torch.optim.Adagrad(model.parameters())
-        elif optimizer_type.lower() == 'rmsprop':
-            optimizer = torch.optim.RMSprop(model.parameters())
-        else:
-            optimizer = SCG(filter(lambda p: p.requires_grad, model.parameters()))
+        optimizer = self._create_optimizer(model, optimizer_type, learning_rate, momentum, lr_decay, weight_decay)
 
-        y_val = model(input_data_validate_b)
-        oldValLoss = criterion(y_val, output_data_validate_b[:, 1:55]).data.item()
+        y_val = model(input_data_validate)
+        oldValLoss = distributed.mean_loss(criterion(y_val, output_data_validate[:, 1:55]), len(y_val)).data.item()
         bestValLoss = oldValLoss
         best_nn_parameters = copy.deepcopy(model.state_dict())
         # Infinite epochs
@@ -544,13 +480,6 @@ class Trainer:
         lr = 0
 
         while self.train:
-            input_data_train = input_data_train_b.clone()
-            output_data_train = output_data_train_b.clone()
-            input_data_test = input_data_test_b.clone()
-            output_data_test = output_data_test_b.clone()
-            input_data_validate = input_data_validate_b.clone()
-            output_data_validate = output_data_validate_b.clone()
-
             if self._launch_gui:
                 root.update()
 
@@ -568,15 +497,15 @@ class Trainer:
             # writer.add_scalar('data/learning_rate', scheduler.get_lr()[0], t)
 
             self.loss = Variable(torch.Tensor([0]))
-            permutations = torch.randperm(len(input_data_train))
+            # a permutation of indices, every batch is gathered on its own
+            permutations = distributed.broadcast(torch.randperm(len(input_data_train_b)))
             if model.isCuda():
                 permutations = permutations.cuda()
                 self.loss = self.loss.cuda()
-            input_data_train = input_data_train[permutations]
-            output_data_train = output_data_train[permutations]
             ena = []
-            while j <= len(input_data_train):
-                self.train_one_step(model,input_data_train[i:j], output_data_train[i:j, 1:55], learning_rate, criterion, optimizer)
+            while j <= len(input_data_train_b):
+                batch = distributed.shard(permutations[i:j])
+                self.train_one_step(model,input_data_train_b[batch], output_data_train_b[batch, 1:55], learning_rate, criterion, optimizer)
                 i = j
                 j += train_param.batch_size
 
@@ -588,11 +517,12 @@ class Trainer:
 
                             r1 = p.data[0][0]'''
 
-            if i < len(input_data_train):
-                self.train_one_step(model,input_data_train[i:], output_data_train[i:, 1:], learning_rate, criterion, optimizer)
+            if i < len(input_data_train_b):
+                batch = distributed.shard(permutations[i:])
+                self.train_one_step(model,input_data_train_b[batch], output_data_train_b[batch, 1:], learning_rate, criterion, optimizer)
 
             if (t-1)%train_param.log_interval ==0:
-                self.loss = self.loss * train_param.batch_size / len(input_data_train)
+                self.loss = self.loss * train_param.batch_size / len(input_data_train_b)
 
                 if t == 1:
                     oldLoss = self.loss
@@ -609,14 +539,15 @@ class Trainer:
 
             if (t-1)%train_param.validation_interval == 0:
                 y_val = model(input_data_validate)
-                val_loss = criterion(y_val, output_data_validate[:, 1:55])
+                val_loss = distributed.mean_loss(criterion(y_val, output_data_validate[:, 1:55]), len(y_val))
                 writer.add_scalar('data/val_loss', math.log(val_loss), t)
 
                 if val_loss.data.item() < bestValLoss:
                     bestValLoss = val_loss.data.item()
                     best_nn_parameters = copy.deepcopy(model.state_dict())
                     saving_epochs = t
-                    torch.save(model.state_dict(), path + '/net_parameters')
+                    if self.rank == 0:
+                        torch.save(model.state_dict(), path + '/net_parameters')
 
                 if val_loss.data.item() > bestValLoss:  # oldValLoss:
                     val_count = val_count+1
@@ -654,19 +585,20 @@ class Trainer:
                     # if model contains an STN module (e.g. STIMEDNet)
                     try:
                         plt.subplot(211)
-                        stn_val_image, stn_val_theta = model.stn(input_data_validate[0].reshape(-1,1,40,40))
+                        stn_val_image, stn_val_theta = model.stn(input_data_validate_b[0].reshape(-1,1,40,40))
                         plt.imshow(np.reshape(stn_val_image.data[0].cpu().numpy(), (40, 40)), cmap='gray', extent=[0, 40, 40, 0])
                         plt.subplot(212)
                     except:
                         pass
 
-                    plot_vector = torch.cat((output_data_validate[0,0:1], y_val[0, :]), 0)
+                    plot_vector = torch.cat((output_data_validate_b[0,0:1], y_val[0, :]), 0)
                     dmp_v = self.create_dmp(plot_vector, model.scale, 0.01, 25, True)
-                    dmp = self.create_dmp(output_data_validate[0,:], model.scale, 0.01, 25, True)
-                    dmp.joint()
+                    dmp = self.create_dmp(output_data_validate_b[0,:], model.scale, 0.01, 25, True)
+                    # the target of the plotted sample is the same every time
+                    dmp.joint(cache=rollout_cache)
                     dmp_v.joint()
-                    _,mat = self.show_dmp((input_data_validate.data[0]).cpu().numpy(), dmp.Y , dmp_v, plot=False)
-                    a = output_data_validate[0, :]
+                    _,mat = self.show_dmp((input_data_validate_b.data[0]).cpu().numpy(), dmp.Y , dmp_v, plot=False)
+                    a = output_data_validate_b[0, :]
                     writer.add_image('image'+str(t), mat)
                     self.plot_im = False
 
@@ -674,13 +606,17 @@ class Trainer:
 
             if (t - 1) % train_param.test_interval == 0:
                 y_test = model(input_data_test)
-                test_loss = criterion(y_test, output_data_test[:, 1:55])
+                test_loss = distributed.mean_loss(criterion(y_test, output_data_test[:, 1:55]), len(y_test))
                 writer.add_scalar('data/test_loss', math.log(test_loss), t)
 
             '''if (t-1) % 1500 == 0:
                 optimizer.reset = True
                 print('reset optimizer')
             '''
+            # stop and reset together with the other processes
+            stop, self.resetting_optimizer = distributed.agree(not self.train, self.resetting_optimizer)
+            self.train = not stop
+
             if self.resetting_optimizer:
                 optimizer.reset = True
 
@@ -737,7 +673,8 @@ class Trainer:
 
     def train_dmp(self, model, images, outputs, path, train_param, file,
                   optimizer_type='SCG', learning_rate=None, momentum=None,
-                  lr_decay=None, weight_decay=None):
+                  lr_decay=None, weight_decay=None, time_samples=None,
+                  random_time_samples=False, gram_loss=False, tau=None, tau_buckets=None):
         """
         teaches the network using provided data
 
@@ -746,7 +683,24 @@ class Trainer:
         epochs -> how many times to repeat learning_rate
         learning_rate -> how much the weight will be changed each epoch
         log_interval -> on each epoch divided by log_interval log will be printed
+        time_samples -> train on only this many time steps of the trajectories
+                        (model.time_indices), validation still uses all of them
+        random_time_samples -> draw new time steps for every batch instead of
+                               evenly spaced ones
+        gram_loss -> project the target trajectories onto DMP parameters once
+                     and compute the same MSE from those (dmp_loss.GramMSELoss),
+                     with the model in the 'parameters' forward mode
+        tau -> duration of every image, e.g. the unscaled tau of the
+               MatLoader outputs, for tau_buckets
+        tau_buckets -> dmp_buckets.TauBuckets on the data tensor of the model;
+                       every batch holds samples of one bucket and is
+                       integrated with its operator instead of the one tau
+                       of the model
+
+        Trains data-parallel in the processes of distributed.launch.
         """
+        file = self._data_parallel(train_param, file)
+
         # Launch GUI
         if self._launch_gui:
             root = tk.Tk()
@@ -780,165 +734,451 @@ class Trainer:
 
         # Train
 
-        writer = SummaryWriter(path + '/log')
+        writer = SummaryWriter(path + '/log') if self.rank == 0 else distributed.NullWriter()
 
         if self._launch_tensorboard:
             command = ["tensorboard", "--logdir=" + path + "/log"]
             tensorboard_process = subprocess.Popen(command)
             print('Launching tensorboard with process id: {}'.format(tensorboard_process.pid))
 
-        # Divide data
-        print("Dividing data")
-        input_data_train_b, output_data_train_b, input_data_test_b, output_data_test_b, input_data_validate_b, output_data_validate_b = self.split_dataset(
-            images, outputs)
+        if (gram_loss or tau_buckets is not None) and getattr(model, 'pca_head', None) is not None:
+            raise ValueError('gram_loss and tau_buckets need the full DMP output layer, not a pca_basis')
+        # the forward mode and the tau buckets of the model are only changed during the training
+        restore = {'tau_buckets': getattr(model, 'tau_buckets', None),
+                   'tau_operators': getattr(model, 'tau_operators', None)}
+        if hasattr(model, 'dmp_forward_mode'):
+            restore['dmp_forward_mode'] = model.dmp_forward_mode
+        try:
+            if gram_loss:
+                if time_samples:
+                    raise ValueError('gram_loss and time_samples can not be combined')
+                outputs = project_trajectories(outputs, model.param_grad)
+                model.dmp_forward_mode = 'parameters'
+
+            if tau_buckets is not None:
+                if tau is None or gram_loss or model.dmp_forward_mode in ('tau', 'parameters'):
+                    raise ValueError('tau_buckets need the tau of every sample and a fixed tau forward mode')
+                if tau_buckets.operators.shape[1] != model.param_grad.shape[0]:
+                    raise ValueError('tau_buckets were built for another number of time steps')
+                sample_buckets = tau_buckets.assign(tau).numpy()
+
+            # Divide data
+            print("Dividing data")
+            input_data_train_b, output_data_train_b, input_data_test_b, output_data_test_b, input_data_validate_b, output_data_validate_b = self.split_dataset(
+                images, outputs)
+            if tau_buckets is not None:
+                # the bucket of every sample, split like the images
+                _, bucket_train, _, bucket_test, _, bucket_validate = self.split_dataset(np.zeros(len(images)),
+                                                                                        sample_buckets)
+                bucket_train, bucket_test, bucket_validate = bucket_train.long(), bucket_test.long(), bucket_validate.long()
+            else:
+                bucket_train = bucket_test = bucket_validate = None
+
+            # dummy = model(torch.autograd.Variable(torch.rand(1,1600)))
+            # writer.add_graph(model, dummy)
+
+            if self._launch_tensorboard:
+                window = webbrowser.open_new('http://localhost:6006')
+
+            if train_param.cuda:
+                torch.cuda.set_device(train_param.device)
+                model = model.cuda()
+                input_data_train_b = input_data_train_b.cuda()
+                output_data_train_b = output_data_train_b.cuda()
+                input_data_test_b = input_data_test_b.cuda()
+                output_data_test_b = output_data_test_b.cuda()
+                input_data_validate_b = input_data_validate_b.cuda()
+                output_data_validate_b = output_data_validate_b.cuda()
+
+            if tau_buckets is not None:
+                model.tau_operators = tau_buckets.operators.to(output_data_train_b.device)
+                bucket_train = bucket_train.to(output_data_train_b.device)
+                bucket_test = bucket_test.to(output_data_train_b.device)
+                bucket_validate = bucket_validate.to(output_data_train_b.device)
+
+            # the validation and test samples of this process
+            input_data_validate, output_data_validate = distributed.shard(input_data_validate_b, output_data_validate_b)
+            input_data_test, output_data_test = distributed.shard(input_data_test_b, output_data_test_b)
+            if tau_buckets is not None:
+                bucket_validate, bucket_test = distributed.shard(bucket_validate), distributed.shard(bucket_test)
+            distributed.broadcast_model(model)
+
+            print('finish dividing')
+
+            if gram_loss:
+                criterion = GramMSELoss(model.param_grad)
+            else:
+                criterion = torch.nn.MSELoss(size_average=True)  # For calculating loss (mean squared error)
+            # criterion=torch.nn.CrossEntropyLoss(size_average=True)
 
-        # dummy = model(torch.autograd.Variable(torch.rand(1,1600)))
-        # writer.add_graph(model, dummy)
+            # Set up optimizer
+            optimizer = self._create_optimizer(model, optimizer_type, learning_rate, momentum, lr_decay, weight_decay)
 
-        if self._launch_tensorboard:
-            window = webbrowser.open_new('http://localhost:6006')
+            model.tau_buckets = bucket_validate
+            y_val = model(input_data_validate)
+            oldValLoss = distributed.mean_loss(criterion(y_val, output_data_validate[:, :]), len(y_val))
+            bestValLoss = oldValLoss
+            best_nn_parameters = copy.deepcopy(model.state_dict())
 
-        if train_param.cuda:
-            torch.cuda.set_device(train_param.device)
-            model = model.cuda()
-            input_data_train_b = input_data_train_b.cuda()
-            output_data_train_b = output_data_train_b.cuda()
-            input_data_test_b = input_data_test_b.cuda()
-            output_data_test_b = output_data_test_b.cuda()
-            input_data_validate_b = input_data_validate_b.cuda()
-            output_data_validate_b = output_data_validate_b.cuda()
+            # Infinite epochs
+            if train_param.epochs == -1:
+                inf_k = 0
+            else:
+                inf_k = 1
 
-        print('finish dividing')
+            self.train = True
 
-        criterion = torch.nn.MSELoss(size_average=True)  # For calculating loss (mean squared error)
-        # criterion=torch.nn.CrossEntropyLoss(size_average=True)
+            t = 0
 
-        # Set up optimizer
-        if optimizer_type.lower() == 'customadam':
-            if learning_rate:
-                optimizer = Adam(model.parameters(), lr=learning_rate, amsgrad=True)
-            else:
-                optimizer = Adam(model.parameters(), amsgrad=True)
-        elif optimizer_type.lower() == 'adam':
-            if learning_rate and weight_decay:
-                optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate, weight_decay=weight_decay, eps=0.001)
-            elif learning_rate:
-                optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate, eps=0.001)
-            else:
-                optimizer = torch.optim.Adam(model.parameters(), eps=0.001)
-        elif optimizer_type.lower() == 'sgd':
-            if learning_rate and momentum:
-                optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate, momentum=momentum)
-            elif learning_rate:
-                optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate)
-            elif momentum:
-                optimizer = torch.optim.SGD(model.parameters(), momentum=momentum)
-            else:
-                optimizer = torch.optim.SGD(model.parameters())
-        elif optimizer_type.lower() == 'adagrad':
-            if learning_rate and lr_decay and weight_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate, lr_decay=lr_decay, weight_decay=weight_decay)
-            elif learning_rate and lr_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate, lr_decay=lr_decay)
-            elif learning_rate and weight_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
-            elif learning_rate:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate)
-            elif lr_decay and weight_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr_decay=lr_decay, weight_decay=weight_decay)
-            elif lr_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr_decay=lr_decay)
-            elif lr_decay:
-                optimizer = torch.optim.Adagrad(model.parameters(), lr_decay=lr_decay)
-            else:
-                optimizer = torch.optim.Adagrad(model.parameters())
-        elif optimizer_type.lower() == 'rmsprop':
-            optimizer = torch.optim.RMSprop(model.parameters())
-        else:
-            optimizer = SCG(filter(lambda p: p.requires_grad, model.parameters()))
+            t_init = 200
+            lr = 0
 
-        y_val = model(input_data_validate_b)
-        oldValLoss = criterion(y_val, output_data_validate_b[:, 1:55])
-        bestValLoss = oldValLoss
-        best_nn_parameters = copy.deepcopy(model.state_dict())
+            while self.train:
+                if self._launch_gui:
+                    root.update()
 
-        # Infinite epochs
-        if train_param.epochs == -1:
-            inf_k = 0
-        else:
-            inf_k = 1
+                if t > 0 and self.plot_freq != 0 and t % self.plot_freq == 0:
+                    self.plot_im = True
 
-        self.train = True
+                t = t + 1
+                i = 0
+                j = train_param.batch_size
 
-        t = 0
+                # scheduler.step()
+                # if t%t_init == 0:
+                #    scheduler.last_epoch = -1
 
-        t_init = 200
-        lr = 0
+                # writer.add_scalar('data/learning_rate', scheduler.get_lr()[0], t)
 
-        while self.train:
-            input_data_train = input_data_train_b.clone()
-            output_data_train = output_data_train_b.clone()
-            input_data_test = input_data_test_b.clone()
-            output_data_test = output_data_test_b.clone()
-            input_data_validate = input_data_validate_b.clone()
-            output_data_validate = output_data_validate_b.clone()
+                self.loss = Variable(torch.Tensor([0]))
+                if t==1:
+                    permutations = distributed.broadcast(torch.randperm(len(input_data_train_b)))
+                    if model.isCuda():
+                        permutations = permutations.cuda()
+                        self.loss = self.loss.cuda()
+                if model.isCuda():
 
-            if self._launch_gui:
-                root.update()
+                    self.loss = self.loss.cuda()
+                # the two output rows of every permuted sample, gathered batch by batch
+                per = torch.stack([permutations*2,permutations*2+1]).transpose(1,0).contiguous().view(1,-1).squeeze()
+                ena = []
+
+                if tau_buckets is not None:
+                    # batches of one tau bucket, each integrated with one operator
+                    for batch in self._bucket_batches(bucket_train, train_param.batch_size):
+                        batch = distributed.shard(batch)
+                        model.tau_buckets = bucket_train[batch]
+                        rows = torch.stack((batch*2, batch*2+1), 1).view(-1)
+                        self.train_one_step(model, input_data_train_b[batch],
+                                            self._time_samples(model, output_data_train_b[rows], time_samples, random_time_samples),
+                                            learning_rate, criterion, optimizer)
+                else:
+                    while j <= len(input_data_train_b):
+                        batch, rows = distributed.shard(permutations[i:j], per[i*2:j*2])
+                        self.train_one_step(model, input_data_train_b[batch],
+                                            self._time_samples(model, output_data_train_b[rows], time_samples, random_time_samples),
+                                            learning_rate, criterion, optimizer)
+                        i = j
+                        j += train_param.batch_size
+
+                        '''for group in optimizer.param_groups:
+                            i = 0
+                            for p in group['params']:
+                                i = i+1
+                                if i ==15:
+
+                                    r1 = p.data[0][0]'''
+
+                    if i < len(input_data_train_b):
+                        batch, rows = distributed.shard(permutations[i:], per[i*2:])
+                        self.train_one_step(model, input_data_train_b[batch],
+                                            self._time_samples(model, output_data_train_b[rows], time_samples, random_time_samples),
+                                            learning_rate, criterion, optimizer)
+                model.time_indices = None
+
+                if (t - 1) % train_param.log_interval == 0:
+
+                    self.loss = self.loss * train_param.batch_size / len(input_data_train_b)
+                    if t == 1:
+                        oldLoss = self.loss
+
+                    print('Epoch: ', t, ' loss: ', self.loss.data[0])
+                    time_d = datetime.now() - starting_time
+                    writer.add_scalar('data/time', t, time_d.total_seconds())
+                    writer.add_scalar('data/training_loss', math.log(self.loss), t)
+                    writer.add_scalar('data/epochs_speed',
+                                      60 * train_param.log_interval / (time_d.total_seconds() - old_time_d), t)
+                    writer.add_scalar('data/gradient_of_performance', (self.loss - oldLoss) / train_param.log_interval, t)
+                    old_time_d = time_d.total_seconds()
+                    oldLoss = self.loss
 
-            if t > 0 and self.plot_freq != 0 and t % self.plot_freq == 0:
-                self.plot_im = True
+                if (t - 1) % train_param.validation_interval == 0:
+                    model.tau_buckets = bucket_validate
+                    y_val = model(input_data_validate)
+
+                    val_loss = distributed.mean_loss(criterion(y_val, output_data_validate[:, :]), len(y_val))
+
+                    writer.add_scalar('data/val_loss', math.log(val_loss), t)
+                    if val_loss < bestValLoss:
+                        bestValLoss = val_loss
+                        best_nn_parameters = copy.deepcopy(model.state_dict())
+                        saving_epochs = t
+                        if self.rank == 0:
+                            torch.save(model.state_dict(), path + '/net_parameters')
+
+                    if val_loss > bestValLoss:  # oldValLoss:
+                        val_count = val_count + 1
+
+                    else:
+
+                        val_count = 0
+
+                    oldValLoss = val_loss
+                    writer.add_scalar('data/val_count', val_count, t)
+                    print('Validation: ', t, ' loss: ', val_loss, ' best loss:', bestValLoss)
+
+                    if (t - 1) % 10 == 0:
+                        state = model.state_dict()
+                        mean_dict = dict()
+                        max_dict = dict()
+                        min_dict = dict()
+                        var_dict = dict()
+                        for group in state:
+                            mean = torch.mean(state[group])
+                            max = torch.max(state[group])
+                            min = torch.min(state[group])
+                            var = torch.var(state[group])
+                            mean_dict[group] = mean
+                            max_dict[group] = max
+                            min_dict[group] = min
+                            var_dict[group] = var
+
+                        writer.add_scalars('data/mean', mean_dict, t)
+                        writer.add_scalars('data/max', max_dict, t)
+                        writer.add_scalars('data/min', min_dict, t)
+                        writer.add_scalars('data/var', var_dict, t)
+
+                    if self.plot_im:
+                        fig = plt.figure()
+
+                        # Set up sub-plotting if the model has an STN module
+                        try:
+                            assert(model.stn)
+                            plt.subplot(121)
+                        except:
+                            pass
 
-            t = t + 1
-            i = 0
-            j = train_param.batch_size
+                        try:
+                            plt.imshow(np.reshape(input_data_validate_b.data[0].cpu().numpy(), (model.image_size[0], model.image_size[1])),
+                                       cmap='gray', extent=[0, model.image_size[0], model.image_size[1], 0])
+                        except:
+                            try:
+                                plt.imshow(np.reshape(input_data_validate_b.data[0].cpu().numpy(), (model.image_size, model.image_size)),
+                                           cmap='gray', extent=[0, model.image_size, model.image_size, 0])
+                            except:
+                                raise
+
+                        actual, predicted = output_data_validate_b.data[0:2], y_val.data[0:2]
+                        if gram_loss:
+                            # parameters to trajectories
+                            actual, predicted = actual[:, :-1].mm(model.param_grad.t()), predicted.mm(model.param_grad.t())
+                        plt.plot(actual[0].cpu().numpy(), actual[1].cpu().numpy(), '-b', label='actual')
+                        plt.plot(predicted[0].cpu().numpy(), predicted[1].cpu().numpy(), '-r', label='predicted')
+                        plt.legend()
+                        try:
+                            plt.xlim([0, model.image_size[0]])
+                            plt.ylim([model.image_size[1], 0])
+                        except:
+                            try:
+                                plt.xlim([0, model.image_size])
+                                plt.ylim([model.image_size, 0])
+                            except:
+                                raise
+
+                        # Try plotting spatial transformer network (STN) output
+                        # if model contains an STN module (e.g. STIMEDNet)
+                        try:
+                            assert(model.stn)
+                            plt.subplot(122)
+                            stn_val_image, stn_val_theta = model.stn(input_data_validate_b[0].reshape(-1,model.image_size[2],model.image_size[0],model.image_size[1]))
+                            plt.imshow(np.reshape(stn_val_image.data[0].cpu().numpy(), (model.grid_size[0], model.grid_size[1])), cmap='gray', extent=[0, model.grid_size[0], model.grid_size[1], 0])
+                        except:
+                            pass
+
+                        fig.canvas.draw()
+                        matrix = np.fromstring(fig.canvas.tostring_rgb(), dtype=np.uint8, sep='')
+
+                        mat= matrix.reshape(fig.canvas.get_width_height()[::-1] + (3,))
+
+                        writer.add_image('image' + str(t), mat)
+                        self.plot_im = False
+
+                        # torch.save(model.state_dict(), path + '/net_parameters' + str(t))
+
+                if (t - 1) % train_param.test_interval == 0:
+                    model.tau_buckets = bucket_test
+                    y_test = model(input_data_test)
+                    test_loss = distributed.mean_loss(criterion(y_test, output_data_test[:, :]), len(y_test))
+                    writer.add_scalar('data/test_loss', math.log(test_loss), t)
+
+                '''if (t-1) % 1500 == 0:
+                    optimizer.reset = True
+                    print('reset optimizer')
+                '''
+                # stop and reset together with the other processes
+                stop, self.resetting_optimizer = distributed.agree(not self.train, self.resetting_optimizer)
+                self.train = not stop
+
+                if self.resetting_optimizer:
+                    optimizer.reset = True
+
+                if val_count == 7 or (t - 1) % 500==0:
+                    train_param.stop_criterion = "reset optimizer"
+                    optimizer.reset = True
+
+                # End condition
+                if inf_k * t > inf_k * train_param.epochs:
+                    self.train = False
+                    train_param.stop_criterion = "max epochs reached"
+
+                if val_count > train_param.val_fail:
+                    self.train = False
+                    train_param.stop_criterion = "max validation fail reached"
+
+                '''
+                writer.add_scalar('data/test_lr', lr, t)
+
+                writer.add_scalar('data/loss_lr', self.loss.data[0], lr)
+
+                lr = 1.1**(t/40)-1
+                print(lr)
+                for param_group in optimizer.param_groups:
+                    param_group['lr'] = lr
+                '''
+
+            train_param.real_epochs = t
+            train_param.min_train_loss = self.loss.data[0]
+            train_param.min_val_loss = bestValLoss
+            train_param.min_test_loss = test_loss.item()
+            train_param.elapsed_time = time_d.total_seconds()
+            train_param.val_count = val_count
+            k = (self.loss - oldLoss) / train_param.log_interval
+            train_param.min_grad = k.data[0]
+            train_param.stop_criterion = train_param.stop_criterion + self.user_stop
+
+            file.write('\n' + str(optimizer))
+            file.write('\n' + str(criterion))
+            file.write('\n saving_epochs = ' + str(saving_epochs))
+            file.write(train_param.write_out_after())
+            writer.close()
+
+            if self._launch_tensorboard:
+                print('Terminating tensorboard with process id: {}'.format(tensorboard_process.pid))
+                tensorboard_process.terminate()
+
+            print('Training finished\n')
+        finally:
+            for name, value in restore.items():
+                setattr(model, name, value)
+        return best_nn_parameters
 
-            # scheduler.step()
-            # if t%t_init == 0:
-            #    scheduler.last_epoch = -1
+    def train_stream(self, model, dataset, path, train_param, file,
+                     optimizer_type='SCG', learning_rate=None, momentum=None,
+                     lr_decay=None, weight_decay=None, workers=4, prefetch_factor=4):
+        """
+        teaches the network on a dataset that does not fit into memory
 
-            # writer.add_scalar('data/learning_rate', scheduler.get_lr()[0], t)
+        dataset -> shard_loader.ShardedDataset, with 'trajectories' targets the
+                   model is trained like in train_dmp, with 'outputs' targets
+                   like in train
+        workers -> DataLoader worker processes that read and prefetch batches
+        prefetch_factor -> batches every worker reads ahead
 
-            self.loss = Variable(torch.Tensor([0]))
-            if t==1:
-                permutations = torch.randperm(len(input_data_train))
-                if model.isCuda():
-                    permutations = permutations.cuda()
-                    self.loss = self.loss.cuda()
-            if model.isCuda():
+        The split is drawn like in split_dataset and kept in self.indeks, the
+        batches are read from the memory-mapped shards while the model trains
+        and validation and test losses are averaged over their batches.
+        """
+        if distributed.world_size() > 1:
+            raise ValueError('train_stream does not train data-parallel, use train or train_dmp')
+        starting_time = datetime.now()
+        train_param.data_samples = len(dataset)
+        val_count = 0
+        old_time_d = 0
+        oldLoss = 0
+        saving_epochs = 0
+        test_loss = float('nan')
 
-                self.loss = self.loss.cuda()
-            input_data_train = input_data_train[permutations]
-            per = torch.stack([permutations*2,permutations*2+1]).transpose(1,0).contiguous().view(1,-1).squeeze()
+        file.write(train_param.write_out())
+        print('Starting training')
+        print(train_param.write_out())
 
-            output_data_train = output_data_train[per]
-            ena = []
+        writer = SummaryWriter(path + '/log')
 
-            while j <= len(input_data_train):
-                self.train_one_step(model, input_data_train[i:j], output_data_train[i*2:j*2, :], learning_rate, criterion,
-                                    optimizer)
-                i = j
-                j += train_param.batch_size
+        # Divide data, by index only
+        if self.indeks != []:
+            indeks = np.asarray(self.indeks)
+        else:
+            r = len(dataset)
+            trl = round(r*train_param.training_ratio)
+            tel = round(r*train_param.test_ratio)
+            indeks = np.zeros(r, dtype=np.int8)
+            indeks[trl:trl + tel] = 1
+            indeks[trl + tel:] = 2
+            np.random.shuffle(indeks)
+            self.indeks = indeks
+        train_loader, test_loader, validate_loader = [
+            dataset.loader(np.flatnonzero(indeks == split), train_param.batch_size, shuffle=split == 0,
+                           workers=workers, prefetch_factor=prefetch_factor, pin_memory=train_param.cuda)
+            for split in (0, 1, 2)]
 
-                '''for group in optimizer.param_groups:
-                    i = 0
-                    for p in group['params']:
-                        i = i+1
-                        if i ==15:
+        if train_param.cuda:
+            torch.cuda.set_device(train_param.device)
+            model = model.cuda()
+        device = next(model.parameters()).device
+
+        def targets(y):
+            if dataset.targets == 'trajectories':
+                # [B x Dof x T] to the rows of the DMPIntegrator output
+                return y.view(-1, y.shape[-1])
+            return y[:, 1:55]
+
+        def mean_loss(loader):
+            loss = 0.0
+            count = 0
+            with torch.no_grad():
+                for x, y in loader:
+                    x, y = x.to(device, non_blocking=True), y.to(device, non_blocking=True)
+                    loss += criterion(model(x), targets(y)).item() * len(x)
+                    count += len(x)
+            return loss / count
+
+        criterion = torch.nn.MSELoss(size_average=True)
+        optimizer = self._create_optimizer(model, optimizer_type, learning_rate, momentum, lr_decay, weight_decay)
+
+        bestValLoss = mean_loss(validate_loader)
+        best_nn_parameters = copy.deepcopy(model.state_dict())
 
-                            r1 = p.data[0][0]'''
+        # Infinite epochs
+        if train_param.epochs == -1:
+            inf_k = 0
+        else:
+            inf_k = 1
 
-            if i < len(input_data_train):
-                self.train_one_step(model, input_data_train[i:], output_data_train[i*2:, :], learning_rate, criterion,
-                                    optimizer)
+        self.train = True
+        t = 0
+        while self.train:
+            t = t + 1
+            self.loss = torch.zeros(1, device=device)
+            for x, y in train_loader:
+                x, y = x.to(device, non_blocking=True), y.to(device, non_blocking=True)
+                self.train_one_step(model, x, targets(y), learning_rate, criterion, optimizer)
 
             if (t - 1) % train_param.log_interval == 0:
-
-                self.loss = self.loss * train_param.batch_size / len(input_data_train)
+                self.loss = self.loss / len(train_loader)
                 if t == 1:
                     oldLoss = self.loss
 
-                print('Epoch: ', t, ' loss: ', self.loss.data[0])
+                print('Epoch: ', t, ' loss: ', self.loss.item())
                 time_d = datetime.now() - starting_time
                 writer.add_scalar('data/time', t, time_d.total_seconds())
                 writer.add_scalar('data/training_loss', math.log(self.loss), t)
@@ -949,115 +1189,27 @@ class Trainer:
                 oldLoss = self.loss
 
             if (t - 1) % train_param.validation_interval == 0:
-                y_val = model(input_data_validate)
-
-                val_loss = criterion(y_val, output_data_validate[:, :])
-
+                val_loss = mean_loss(validate_loader)
                 writer.add_scalar('data/val_loss', math.log(val_loss), t)
                 if val_loss < bestValLoss:
                     bestValLoss = val_loss
                     best_nn_parameters = copy.deepcopy(model.state_dict())
                     saving_epochs = t
                     torch.save(model.state_dict(), path + '/net_parameters')
-
-                if val_loss > bestValLoss:  # oldValLoss:
-                    val_count = val_count + 1
-
-                else:
-
                     val_count = 0
-
-                oldValLoss = val_loss
+                else:
+                    val_count = val_count + 1
                 writer.add_scalar('data/val_count', val_count, t)
                 print('Validation: ', t, ' loss: ', val_loss, ' best loss:', bestValLoss)
 
-                if (t - 1) % 10 == 0:
-                    state = model.state_dict()
-                    mean_dict = dict()
-                    max_dict = dict()
-                    min_dict = dict()
-                    var_dict = dict()
-                    for group in state:
-                        mean = torch.mean(state[group])
-                        max = torch.max(state[group])
-                        min = torch.min(state[group])
-                        var = torch.var(state[group])
-                        mean_dict[group] = mean
-                        max_dict[group] = max
-                        min_dict[group] = min
-                        var_dict[group] = var
-
-                    writer.add_scalars('data/mean', mean_dict, t)
-                    writer.add_scalars('data/max', max_dict, t)
-                    writer.add_scalars('data/min', min_dict, t)
-                    writer.add_scalars('data/var', var_dict, t)
-
-                if self.plot_im:
-                    fig = plt.figure()
-
-                    # Set up sub-plotting if the model has an STN module
-                    try:
-                        assert(model.stn)
-                        plt.subplot(121)
-                    except:
-                        pass
-
-                    try:
-                        plt.imshow(np.reshape(input_data_validate.data[0].cpu().numpy(), (model.image_size[0], model.image_size[1])),
-                                   cmap='gray', extent=[0, model.image_size[0], model.image_size[1], 0])
-                    except:
-                        try:
-                            plt.imshow(np.reshape(input_data_validate.data[0].cpu().numpy(), (model.image_size, model.image_size)),
-                                       cmap='gray', extent=[0, model.image_size, model.image_size, 0])
-                        except:
-                            raise
-
-                    plt.plot(output_data_validate.data[0].cpu().numpy(), output_data_validate.data[1].cpu().numpy(), '-b', label='actual')
-                    plt.plot(y_val.data[0].cpu().numpy(), y_val.data[1].cpu().numpy(), '-r', label='predicted')
-                    plt.legend()
-                    try:
-                        plt.xlim([0, model.image_size[0]])
-                        plt.ylim([model.image_size[1], 0])
-                    except:
-                        try:
-                            plt.xlim([0, model.image_size])
-                            plt.ylim([model.image_size, 0])
-                        except:
-                            raise
-
-                    # Try plotting spatial transformer network (STN) output
-                    # if model contains an STN module (e.g. STIMEDNet)
-                    try:
-                        assert(model.stn)
-                        plt.subplot(122)
-                        stn_val_image, stn_val_theta = model.stn(input_data_validate[0].reshape(-1,model.image_size[2],model.image_size[0],model.image_size[1]))
-                        plt.imshow(np.reshape(stn_val_image.data[0].cpu().numpy(), (model.grid_size[0], model.grid_size[1])), cmap='gray', extent=[0, model.grid_size[0], model.grid_size[1], 0])
-                    except:
-                        pass
-
-                    fig.canvas.draw()
-                    matrix = np.fromstring(fig.canvas.tostring_rgb(), dtype=np.uint8, sep='')
-
-                    mat= matrix.reshape(fig.canvas.get_width_height()[::-1] + (3,))
-
-                    writer.add_image('image' + str(t), mat)
-                    self.plot_im = False
-
-                    # torch.save(model.state_dict(), path + '/net_parameters' + str(t))
-
             if (t - 1) % train_param.test_interval == 0:
-                y_test = model(input_data_test)
-                test_loss = criterion(y_test, output_data_test[:, :])
+                test_loss = mean_loss(test_loader)
                 writer.add_scalar('data/test_loss', math.log(test_loss), t)
 
-            '''if (t-1) % 1500 == 0:
-                optimizer.reset = True
-                print('reset optimizer')
-            '''
             if self.resetting_optimizer:
                 optimizer.reset = True
 
-            if val_count == 7 or (t - 1) % 500==0:
+            if val_count == 7 or (t - 1) % 500 == 0:
                 train_param.stop_criterion = "reset optimizer"
                 optimizer.reset = True
 
@@ -1070,25 +1222,13 @@ class Trainer:
                 self.train = False
                 train_param.stop_criterion = "max validation fail reached"
 
-            '''
-            writer.add_scalar('data/test_lr', lr, t)
-
-            writer.add_scalar('data/loss_lr', self.loss.data[0], lr)
-
-            lr = 1.1**(t/40)-1
-            print(lr)
-            for param_group in optimizer.param_groups:
-                param_group['lr'] = lr
-            '''
-
         train_param.real_epochs = t
-        train_param.min_train_loss = self.loss.data[0]
+        train_param.min_train_loss = self.loss.item()
         train_param.min_val_loss = bestValLoss
-        train_param.min_test_loss = test_loss.data[0]
-        train_param.elapsed_time = time_d.total_seconds()
+        train_param.min_test_loss = test_loss
+        train_param.elapsed_time = (datetime.now() - starting_time).total_seconds()
         train_param.val_count = val_count
-        k = (self.loss - oldLoss) / train_param.log_interval
-        train_param.min_grad = k.data[0]
+        train_param.min_grad = ((self.loss - oldLoss) / train_param.log_interval).item()
         train_param.stop_criterion = train_param.stop_criterion + self.user_stop
 
         file.write('\n' + str(optimizer))
@@ -1097,18 +1237,105 @@ class Trainer:
         file.write(train_param.write_out_after())
         writer.close()
 
-        if self._launch_tensorboard:
-            print('Terminating tensorboard with process id: {}'.format(tensorboard_process.pid))
-            tensorboard_process.terminate()
-
         print('Training finished\n')
 
         return best_nn_parameters
 
+    def _create_optimizer(self, model, optimizer_type='SCG', learning_rate=None, momentum=None, lr_decay=None,
+                          weight_decay=None):
+        """The optimizer of the training methods, SCG by default."""
+        if optimizer_type.lower() == 'customadam':
+            if learning_rate:
+                optimizer = Adam(model.parameters(), lr=learning_rate, amsgrad=True)
+            else:
+                optimizer = Adam(model.parameters(), amsgrad=True)
+        elif optimizer_type.lower() == 'adam':
+            if learning_rate and weight_decay:
+                optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate, weight_decay=weight_decay, eps=0.001)
+            elif learning_rate:
+                optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate, eps=0.001)
+            else:
+                optimizer = torch.optim.Adam(model.parameters(), eps=0.001)
+        elif optimizer_type.lower() == 'sgd':
+            if learning_rate and momentum:
+                optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate, momentum=momentum)
+            elif learning_rate:
+                optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate)
+            elif momentum:
+                optimizer = torch.optim.SGD(model.parameters(), momentum=momentum)
+            else:
+                optimizer = torch.optim.SGD(model.parameters())
+        elif optimizer_type.lower() == 'adagrad':
+            if learning_rate and lr_decay and weight_decay:
+                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate, lr_decay=lr_decay, weight_decay=weight_decay)
+            elif learning_rate and lr_decay:
+                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate, lr_decay=lr_decay)
+            elif learning_rate and weight_decay:
+                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
+            elif learning_rate:
+                optimizer = torch.optim.Adagrad(model.parameters(), lr=learning_rate)
+            elif lr_decay and weight_decay:
+                optimizer = torch.optim.Adagrad(model.parameters(), lr_decay=lr_decay, weight_decay=weight_decay)
+            elif lr_decay:
+                optimizer = torch.optim.Adagrad(model.parameters(), lr_decay=lr_decay)
+            elif lr_decay:
+                optimizer = torch.optim.Adagrad(model.parameters(), lr_decay=lr_decay)
+            else:
+                optimizer = torch.optim.Adagrad(model.parameters())
+        elif optimizer_type.lower() == 'rmsprop':
+            optimizer = torch.optim.RMSprop(model.parameters())
+        else:
+            optimizer = SCG(filter(lambda p: p.requires_grad, model.parameters()))
+        return optimizer
+
+    def _data_parallel(self, train_param, file):
+        """
+        Prepares data-parallel training in the processes of distributed.launch,
+        returns the description file of this process.
+
+        Only rank 0 writes the description file, the log and the parameters,
+        shows the GUI and plots.
+        """
+        self.rank = distributed.rank()
+        if distributed.world_size() == 1:
+            return file
+        if train_param.cuda:
+            raise ValueError('data-parallel training runs on CPU processes, set train_param.cuda = False')
+        if self.rank != 0:
+            self._launch_gui = False
+            self._launch_tensorboard = False
+            self.plot_freq = 0
+            file = distributed.NullWriter()
+        return file
+
+    def _time_samples(self, model, y, time_samples, random_time_samples):
+        """Select the time steps of the next training step, returns the matching targets."""
+        if not time_samples:
+            return y
+        time_indices = distributed.broadcast(time_subset(y.shape[1], time_samples, random_time_samples))
+        model.time_indices = time_indices.to(y.device)
+        return y[:, model.time_indices]
+
+    def _bucket_batches(self, buckets, batch_size):
+        """Sample indices in shuffled batches that each hold a single tau bucket."""
+        batches = []
+        for k in torch.unique(buckets).tolist():
+            members = (buckets == k).nonzero()[:, 0]
+            batches.extend(members[torch.randperm(len(members)).to(members.device)].split(batch_size))
+        batches = [batches[b] for b in torch.randperm(len(batches)).tolist()]
+        if distributed.world_size() > 1:
+            # the batches of rank 0
+            sizes = distributed.broadcast(torch.tensor([len(batch) for batch in batches]))
+            batches = list(distributed.broadcast(torch.cat(batches)).split(sizes.tolist()))
+        return batches
+
     def train_one_step(self, model, x, y, learning_rate, criterion, optimizer):
         def wrap():
             # loss=0
             optimizer.zero_grad()
+            if len(x) == 0:
+                # an empty shard of a last batch smaller than the number of processes
+                return distributed.all_reduce_gradients(model.parameters(), torch.zeros(()), 0)
             y_pred = model(x)
             # print("*************y的形状{}***********".format(len(y)))
             # print("*************y的形状{}***********".format(y.shape))
@@ -1118,7 +1345,8 @@ class Trainer:
             #         loss += criterion(y_pred[i], y[i])
             loss=criterion(y_pred,y)
             loss.backward()
-            return loss
+            # the loss and gradients of the whole batch in data-parallel training
+            return distributed.all_reduce_gradients(model.parameters(), loss, len(y))
 
         '''
         y_pred = model(x) # output from the network
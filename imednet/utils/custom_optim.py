@@ -291,7 +291,7 @@ class SCG(Optimizer):
 
                 loss_wk = closure()
 
-            if delta_k < 0.25 and p_k_norm_2.data[0]!=0:
+            if delta_k < 0.25 and p_k_norm_2.item()!=0:
                 lamda_k = lamda_k + (tau_k*(1-delta_k)/p_k_norm_2) #*4
 
             group['success'] = success
@@ -0,0 +1,291 @@
+"""
+Process-wide cache of DMP basis functions.
+
+The centres and widths of the Gaussian kernels only depend on (N, a_x) and
+their activations along the canonical phase only on (N, a_x, tau, dt), so
+they are computed once and shared by dmp_class, dmp_batch and the DMP layers.
+Operators that are expensive to build (e.g. the rollout Jacobian of
+DMPParameters) are also kept on disk across processes, see OperatorCache.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class BasisCache(object):
+    def __init__(self, maxsize=256):
+        """Bounded LRU cache of basis functions.
+
+        # Arguments
+            maxsize: maximum number of cached entries
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        value = build()
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def centres(self, N, a_x):
+        """Kernel centres and widths.
+
+        # Returns
+            c: [N] centres along the phase
+            sigma2: [N] squared kernel widths
+        """
+        def build():
+            c = np.exp(-a_x * np.linspace(0, 1, N))
+            sigma2 = np.power((np.diff(c) / 2), 2)
+            sigma2 = np.append(sigma2, sigma2[-1])
+            return _read_only(c), _read_only(sigma2)
+
+        return self._get(('centres', int(N), float(a_x)), build)
+
+    def phase(self, N, a_x, tau, dt):
+        """Canonical phase and normalized kernel activations along it.
+
+        The phase is integrated with the same Euler step as DMP.joint and
+        integrate, for round(tau/dt)+1 time steps.
+
+        # Returns
+            x: [T] phase at every time step
+            psi: [T x N] kernel activations normalized to sum to one
+        """
+        def build():
+            c, sigma2 = self.centres(N, a_x)
+            x = _phase_vector(a_x, tau, dt)
+            psi = np.exp(-0.5 * np.power((x[:, None] - c), 2) / sigma2)
+            psi = psi / np.sum(psi, axis=1, keepdims=True)
+            return _read_only(x), _read_only(psi)
+
+        return self._get(('phase', int(N), float(a_x), float(tau), float(dt)), build)
+
+    def support(self, N, a_x, tolerance):
+        """Smallest kernel window that keeps the truncation error below tolerance.
+
+        Only the kernels within half_width of the centre nearest to the phase
+        are evaluated (see active_kernels). The window is chosen so that the
+        normalized activation of the omitted kernels is at most tolerance for
+        every phase in [exp(-1.1*a_x), 1], which bounds the error of the
+        forcing term by 2*tolerance*x*max|w|.
+
+        # Returns
+            half_width: number of kernels kept on each side of the nearest one
+            bound: largest omitted activation mass over the phase range
+        """
+        def build():
+            c, sigma2 = self.centres(N, a_x)
+            x = np.exp(np.linspace(0, -1.1 * a_x, 20001))
+            psi = np.exp(-0.5 * np.power((x[:, None] - c), 2) / sigma2)
+            psi = psi / np.sum(psi, axis=1, keepdims=True)
+            for half_width in range(N):
+                kept = np.take_along_axis(psi, active_kernels(x, N, a_x, half_width), axis=1)
+                bound = np.max(1 - np.sum(kept, axis=1))
+                if bound <= tolerance:
+                    return half_width, max(bound, 0.0)
+            return N, 0.0
+
+        return self._get(('support', int(N), float(a_x), float(tolerance)), build)
+
+    def truncated_phase(self, N, a_x, tau, dt, tolerance):
+        """Like phase, but only for the kernels active at every time step.
+
+        # Returns
+            x: [T] phase at every time step
+            index: [T x K] indices of the active kernels
+            psi: [T x K] their activations normalized to sum to one
+        """
+        def build():
+            c, sigma2 = self.centres(N, a_x)
+            half_width, _ = self.support(N, a_x, tolerance)
+            x = _phase_vector(a_x, tau, dt)
+            index = active_kernels(x, N, a_x, half_width)
+            psi = np.exp(-0.5 * np.power((x[:, None] - c[index]), 2) / sigma2[index])
+            psi = psi / np.sum(psi, axis=1, keepdims=True)
+            return _read_only(x), _read_only(index), _read_only(psi)
+
+        return self._get(('truncated_phase', int(N), float(a_x), float(tau), float(dt), float(tolerance)), build)
+
+    def projection(self, N, a_x, samples, regularization=0.0):
+        """Regularized pseudo-inverse of the fitting basis on a normalized grid.
+
+        For trajectories resampled to samples uniformly spaced points the
+        phase exp(-a_x*t/tau) only depends on the sample index, so the basis
+        matrix of DMP.track is the same for all of them (including the
+        dropped basis row of the last sample and the 1e-8 threshold).
+
+        # Returns
+            [N x samples] matrix mapping target forcing terms to weights;
+            with regularization = 0 this is the pseudo-inverse used by track
+        """
+        def build():
+            c, sigma2 = self.centres(N, a_x)
+            x = np.exp(-a_x * np.linspace(0, 1, samples))
+            psi = np.exp(-0.5 * np.power((x[:, None] - c), 2) / sigma2)
+            psi = psi * (x / np.sum(psi, axis=1))[:, None]
+            psi[psi < 1.0e-8] = 0
+            psi[-1] = 0
+            if regularization > 0:
+                P = np.linalg.solve(np.dot(psi.T, psi) + regularization * np.eye(N), psi.T)
+            else:
+                P = np.linalg.pinv(psi)
+            return _read_only(P)
+
+        return self._get(('projection', int(N), float(a_x), int(samples), float(regularization)), build)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+class OperatorCache(object):
+    def __init__(self, directory=None):
+        """Content-addressed cache of precomputed arrays.
+
+        Without a directory the arrays are only kept in memory for this
+        process. With one, every array is also stored as
+        <name>-<sha1 of name and key>.npy and later loaded memory-mapped
+        (copy-on-write), so many processes share the pages. Failing reads
+        or writes (e.g. a read-only directory) just rebuild into memory.
+
+        # Arguments
+            directory: cache directory, by default $IMEDNET_CACHE_DIR; unset
+                or empty keeps the arrays in memory only
+        """
+        if directory is None:
+            directory = os.environ.get('IMEDNET_CACHE_DIR') or None
+        self.directory = directory
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def path(self, name, key):
+        digest = hashlib.sha1(repr((name,) + tuple(key)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory or '', '{}-{}.npy'.format(name, digest))
+
+    def get(self, name, key, build, memory=True):
+        """The array stored for (name, key), built and stored on a miss.
+
+        # Arguments
+            name: kind of array, part of the file name
+            key: tuple of the values the array depends on
+            build: function computing the array
+            memory: keep the array in memory for later calls; large arrays,
+                e.g. datasets, pass False and are only memory-mapped from
+                the directory (a built array that could not be stored is
+                returned and not kept)
+
+        # Returns
+            the array; arrays kept in memory are shared by all callers and
+            read-only, copy them to modify them
+        """
+        path = self.path(name, key)
+        if memory:
+            with self._lock:
+                if path in self._loaded:
+                    return self._loaded[path]
+
+        value = None
+        if self.directory:
+            try:
+                value = np.load(path, mmap_mode='c')
+            except (IOError, OSError, ValueError):
+                pass
+        if value is None:
+            value = np.ascontiguousarray(build())
+            if self.directory and self._save(path, value) and not memory:
+                # the pages of the file instead of the built copy
+                value = np.load(path, mmap_mode='c')
+
+        if memory:
+            value.setflags(write=False)
+            with self._lock:
+                self._loaded[path] = value
+        return value
+
+    def _save(self, path, value):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # write to a temporary file first so readers never see a partial array
+            fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.npy')
+        except (IOError, OSError):
+            return False
+        saved = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, value)
+            os.replace(temporary, path)
+            saved = True
+        except (IOError, OSError):
+            pass
+        finally:
+            # no partial temporary files left behind, e.g. on a full disk
+            if not saved:
+                try:
+                    os.unlink(temporary)
+                except OSError:
+                    pass
+        return saved
+
+    def clear(self):
+        """Forget the loaded arrays (the files stay on disk)."""
+        with self._lock:
+            self._loaded.clear()
+
+
+def active_kernels(x, N, a_x, half_width):
+    """Indices of the 2*half_width+1 kernels around the centre nearest to x.
+
+    Near the ends of the phase the window is shifted to stay inside [0, N).
+
+    # Returns
+        [... x K] integer array for phases x of any shape
+    """
+    K = min(2 * half_width + 1, N)
+    nearest = np.rint(-(N - 1) * np.log(x) / a_x)
+    start = np.clip(nearest - half_width, 0, N - K).astype(int)
+    return start[..., None] + np.arange(K)
+
+
+def _phase_vector(a_x, tau, dt):
+    time_steps = int(np.round(tau / dt)) + 1
+    x = np.zeros(time_steps)
+    x[0] = 1
+    for i in range(1, time_steps):
+        x[i] = x[i - 1] + ((-a_x * x[i - 1]) / tau) * dt
+    return x
+
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+basis_cache = BasisCache()
+operator_cache = OperatorCache()
@@ -0,0 +1,385 @@
+"""
+Batched DMP fitting and integration in joint coordinates.
+
+Works on whole sets of trajectories at once instead of one
+dmp_class.DMP object per trajectory.
+"""
+import numpy as np
+
+from imednet.utils.dmp_basis import basis_cache, active_kernels
+
+
+def pad_trajectories(trajectories, lengths=None):
+    """Stack ragged trajectories into one zero padded array.
+
+    # Arguments
+        trajectories: list of [L_i x D] arrays or an already padded [B x L x D] array
+        lengths: number of valid rows of each trajectory when a padded array
+            is given (defaults to the full length)
+
+    # Returns
+        padded: [B x L x D] array
+        lengths: [B] array of valid lengths
+    """
+    if isinstance(trajectories, np.ndarray) and trajectories.dtype != object and trajectories.ndim == 3:
+        padded = trajectories.astype(float)
+        if lengths is None:
+            lengths = np.full(padded.shape[0], padded.shape[1])
+        return padded, np.asarray(lengths, dtype=int)
+
+    trajectories = [np.asarray(trj, dtype=float) for trj in trajectories]
+    lengths = np.array([trj.shape[0] for trj in trajectories], dtype=int)
+    padded = np.zeros((len(trajectories), lengths.max(), trajectories[0].shape[1]))
+    for i, trj in enumerate(trajectories):
+        padded[i, :lengths[i]] = trj
+    return padded, lengths
+
+
+def _length_mask(lengths, trj_len):
+    return np.arange(trj_len)[None, :] < np.asarray(lengths)[:, None]
+
+
+def derivatives(trajectories, lengths=None):
+    """Finite difference velocities and accelerations of [x, y, ..., t] trajectories.
+
+    Uses the same differences as Trainer.create_dmps: the last two samples of
+    every trajectory are dropped so that position, velocity and acceleration
+    have equal lengths.
+
+    # Arguments
+        trajectories: ragged list or padded [B x L x (D+1)] array, time in the last column
+        lengths: valid lengths of a padded array
+
+    # Returns
+        t: [B x (L-2)] sample times
+        y: [B x (L-2) x D] positions
+        yd: [B x (L-2) x D] velocities
+        ydd: [B x (L-2) x D] accelerations
+        lengths: [B] valid lengths of the returned arrays
+    """
+    padded, lengths = pad_trajectories(trajectories, lengths)
+    t = padded[:, :, -1]
+    pos = padded[:, :, :-1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dt = np.diff(t, axis=1)[:, :, None]
+        vel = np.diff(pos, axis=1) / dt
+        acc = np.diff(vel, axis=1) / dt[:, :-1]
+
+    lengths = lengths - 2
+    mask = _length_mask(lengths, t.shape[1] - 2)
+    t = np.where(mask, t[:, :-2], 0)
+    y = np.where(mask[:, :, None], pos[:, :-2], 0)
+    yd = np.where(mask[:, :, None], vel[:, :-1], 0)
+    ydd = np.where(mask[:, :, None], acc, 0)
+    return t, y, yd, ydd, lengths
+
+
+def _kernels(x, c, sigma2, N, a_x, tolerance=None):
+    """[... x N] unnormalized kernel activations at the phases x.
+
+    With a tolerance only the kernels of the window chosen by
+    BasisCache.support are evaluated, the others are left at zero.
+    """
+    if tolerance is None:
+        return np.exp(-0.5 * np.power(x[..., None] - c, 2) / sigma2)
+    half_width, _ = basis_cache.support(N, a_x, tolerance)
+    index = active_kernels(x, N, a_x, half_width)
+    psi = np.zeros(x.shape + (N,))
+    np.put_along_axis(psi, index, np.exp(-0.5 * np.power(x[..., None] - c[index], 2) / sigma2[index]), axis=-1)
+    return psi
+
+
+def track(t, y, yd, ydd, lengths, N, a_x=2, a_z=48, tolerance=None):
+    """Compute DMP parameters of a whole batch of trajectories, see DMP.track.
+
+    # Arguments
+        t: [B x L] or [B x L x dof] sample times
+        y: [B x L x dof] positions
+        yd: [B x L x dof] velocities
+        ydd: [B x L x dof] accelerations
+        lengths: [B] valid lengths, rows past them are ignored
+        N: number of basis functions
+        tolerance: only evaluate the kernels near the phase, with the
+            truncation error bound of dmp_basis.BasisCache.support
+
+    # Returns
+        tau, y0, dy0, goal: [B x dof] arrays
+        w: [B x N x dof] weights
+    """
+    epsilon = 1.0e-8
+    B, trj_len, dof = y.shape
+    if t.ndim == 2:
+        t = np.repeat(t[:, :, None], dof, axis=2)
+    lengths = np.asarray(lengths, dtype=int)
+    last = lengths - 1
+    batch = np.arange(B)
+
+    tau = t[batch, last]
+    goal = y[batch, last]
+    y0 = y[:, 0].copy()
+    dy0 = yd[:, 0].copy()
+
+    c, sigma2 = basis_cache.centres(N, a_x)
+
+    # [B x dof x L x N] regression matrices; like DMP.track the last valid
+    # sample does not get a basis row.
+    with np.errstate(invalid='ignore', over='ignore', divide='ignore'):
+        ft = np.power(tau, 2)[:, None] * ydd - a_z * (a_z / 4 * (goal[:, None] - y) - tau[:, None] * yd)
+        ft = np.where(_length_mask(lengths, trj_len)[:, :, None], ft, 0)
+
+        x = np.exp((-a_x / tau[:, None]) * t).transpose(0, 2, 1)
+        psi = _kernels(x, c, sigma2, N, a_x, tolerance)
+        psi = psi * (x / np.sum(psi, axis=-1))[..., None]
+        psi[psi < epsilon] = 0
+    psi = psi * _length_mask(last, trj_len)[:, None, :, None]
+
+    # Broken trajectories (e.g. repeated time stamps) get NaN weights instead
+    # of failing the whole batch.
+    bad = ~(np.isfinite(psi).all(axis=(1, 2, 3)) & np.isfinite(ft).all(axis=(1, 2)))
+    psi[bad] = 0
+    ft[bad] = 0
+
+    w = np.matmul(np.linalg.pinv(psi), ft.transpose(0, 2, 1)[..., None])[..., 0]
+    w[bad] = np.nan
+    return tau, y0, dy0, goal, w.transpose(0, 2, 1)
+
+
+def fit_trajectories(trajectories, N, lengths=None, a_x=2, a_z=48, tolerance=None):
+    """Fit DMPs to a set of raw [x, y, ..., t] trajectories in one call.
+
+    Equivalent to running Trainer.create_dmps and collecting tau, y0, dy0,
+    goal and w of every DMP.
+
+    # Arguments
+        trajectories: ragged list or padded [B x L x (D+1)] array, time in the last column
+        N: number of basis functions
+        lengths: valid lengths of a padded array
+        tolerance: truncated kernel evaluation, see track
+
+    # Returns
+        tau, y0, dy0, goal: [B x D] arrays
+        w: [B x N x D] weights
+    """
+    t, y, yd, ydd, lengths = derivatives(trajectories, lengths)
+    return track(t, y, yd, ydd, lengths, N, a_x=a_x, a_z=a_z, tolerance=tolerance)
+
+
+def fit_resampled(trajectories, N, samples, lengths=None, a_x=2, a_z=48, regularization=0.0):
+    """Fit DMPs to a whole dataset with one matrix product.
+
+    tau, y0, dy0 and goal are taken from the trajectories as in
+    fit_trajectories, but the target forcing terms are linearly resampled
+    onto samples points spread uniformly over [0, tau]. On that grid the
+    phase and thus the basis matrix is the same for every trajectory, so
+    all weights are the cached projection of
+    dmp_basis.BasisCache.projection applied to all targets at once. Time
+    stamps are expected to start at zero.
+
+    # Arguments
+        trajectories: ragged list or padded [B x L x (D+1)] array, time in the last column
+        N: number of basis functions
+        samples: number of points of the common grid
+        lengths: valid lengths of a padded array
+        regularization: ridge term of the projection, 0 for the plain
+            pseudo-inverse of DMP.track
+
+    # Returns
+        tau, y0, dy0, goal: [B x D] arrays
+        w: [B x N x D] weights
+    """
+    t, y, yd, ydd, lengths = derivatives(trajectories, lengths)
+    B, _, dof = y.shape
+    last = lengths - 1
+    batch = np.arange(B)
+
+    tau = t[batch, last]
+    goal = y[batch, last]
+    y0 = y[:, 0].copy()
+    dy0 = yd[:, 0].copy()
+
+    with np.errstate(invalid='ignore', over='ignore'):
+        ft = np.power(tau, 2)[:, None, None] * ydd - a_z * (a_z / 4 * (goal[:, None] - y) - tau[:, None, None] * yd)
+
+    grid = np.linspace(0, 1, samples)
+    targets = np.zeros((samples, B, dof))
+    bad = ~np.isfinite(ft).all(axis=(1, 2))
+    for b in np.where(~bad)[0]:
+        for d in range(dof):
+            targets[:, b, d] = np.interp(grid * tau[b], t[b, :lengths[b]], ft[b, :lengths[b], d])
+
+    P = basis_cache.projection(N, a_x, samples, regularization)
+    w = np.dot(P, targets.reshape(samples, B * dof)).reshape(N, B, dof).transpose(1, 0, 2)
+    w[bad] = np.nan
+    return np.repeat(tau[:, None], dof, axis=1), y0, dy0, goal, w
+
+
+def resampling_residual(trajectories, N, samples, lengths=None, a_x=2, a_z=48, regularization=0.0, dt=0.01):
+    """Compare fit_resampled with fitting every trajectory on its own time stamps.
+
+    # Returns
+        weights: [B] max|w - w_track| / max|w_track| of every trajectory
+        rollout: [B] largest position difference of the two rolled out DMPs
+            relative to the span of the track rollout
+    """
+    rollouts = []
+    fits = [fit_trajectories(trajectories, N, lengths=lengths, a_x=a_x, a_z=a_z),
+            fit_resampled(trajectories, N, samples, lengths=lengths, a_x=a_x, a_z=a_z,
+                          regularization=regularization)]
+    for tau, y0, dy0, goal, w in fits:
+        rollouts.append(joint(tau, y0, goal, w, dt, dy0=dy0, a_x=a_x, a_z=a_z)[1])
+
+    w_track, w_grid = fits[0][4], fits[1][4]
+    weights = np.abs(w_grid - w_track).max(axis=(1, 2)) / np.abs(w_track).max(axis=(1, 2))
+
+    # Both rollouts hold their final state, so compare them up to the shorter one
+    T = min(rollouts[0].shape[1], rollouts[1].shape[1])
+    span = np.ptp(rollouts[0], axis=1).max(axis=1)
+    rollout = np.abs(rollouts[1][:, :T] - rollouts[0][:, :T]).max(axis=(1, 2)) / span
+    return weights, rollout
+
+
+INTEGRATORS = ('euler', 'semi-implicit', 'rk4')
+
+
+def joint(tau, y0, goal, w, dt, dy0=None, a_x=2, a_z=48, integrator='euler', exact_phase=False,
+          tolerance=None):
+    """Integrate a whole batch of DMPs in joint coordinates, see DMP.joint.
+
+    Every DMP gets its own number of time steps round(max(tau)/dt)+1, the
+    returned arrays are padded to the longest one by holding the final state.
+
+    # Arguments
+        tau, y0, goal: [B x dof] arrays
+        w: [B x N x dof] weights
+        dt: time step
+        dy0: [B x dof] initial velocities (defaults to zero)
+        integrator: 'euler' (same as DMP.joint), 'semi-implicit' (spring
+            and damper implicit, forcing term explicit; stable for any dt,
+            where Euler diverges above dt = 4*tau/a_z) or 'rk4'
+        exact_phase: use the analytic phase x(t) = exp(-a_x*t/tau) instead of
+            integrating it
+        tolerance: only evaluate the kernels near the phase; the forcing
+            term then deviates by at most 2*tolerance*max|w|, see
+            dmp_basis.BasisCache.support
+
+    # Returns
+        t, Y, dY, ddY: [B x T x dof] time, position, velocity and acceleration
+        time_steps: [B] number of valid time steps of each DMP
+    """
+    if integrator not in INTEGRATORS:
+        raise ValueError('Unknown integrator: {}'.format(integrator))
+
+    tau = np.asarray(tau, dtype=float)
+    w = np.asarray(w, dtype=float).transpose(0, 2, 1)
+    B, dof = tau.shape
+    N = w.shape[2]
+    if dy0 is None:
+        dy0 = np.zeros((B, dof))
+
+    c, sigma2 = basis_cache.centres(N, a_x)
+    if tolerance is not None:
+        half_width, _ = basis_cache.support(N, a_x, tolerance)
+
+    time_steps = np.round(np.max(tau, axis=1) / dt).astype(int) + 1
+    T = time_steps.max()
+    step = tau / time_steps[:, None]
+
+    t = np.zeros((B, T, dof))
+    Y = np.zeros((B, T, dof))
+    dY = np.zeros((B, T, dof))
+    ddY = np.zeros((B, T, dof))
+
+    y = Y[:, 0] = np.asarray(y0, dtype=float)
+    z = dY[:, 0] = np.asarray(dy0, dtype=float) * tau
+    x = np.ones((B, dof))
+    goal = np.asarray(goal, dtype=float)
+
+    def forcing(t, x):
+        if exact_phase:
+            x = np.exp(-a_x * t / tau)
+        if tolerance is None:
+            psi = np.exp(-0.5 * np.power((x[..., None] - c), 2) / sigma2)
+            return np.sum((w * x[..., None]) * psi, axis=-1) / np.sum(psi, axis=-1)
+        index = active_kernels(x, N, a_x, half_width)
+        psi = np.exp(-0.5 * np.power((x[..., None] - c[index]), 2) / sigma2[index])
+        return np.sum((np.take_along_axis(w, index, axis=-1) * x[..., None]) * psi, axis=-1) / np.sum(psi, axis=-1)
+
+    def derivatives(t, x, y, z):
+        fx = forcing(t, x)
+        dx = (-a_x * x) / tau
+        dz = a_z * (a_z / 4 * (goal - y) - z) + fx
+        dy = z
+
+        dz = dz / tau
+        dy = dy / tau
+        return dx, dy, dz
+
+    for i in range(1, T):
+        live = (i < time_steps)[:, None]
+        t_i = t[:, i - 1]
+
+        if integrator == 'euler':
+            dx, dy, dz = derivatives(t_i, x, y, z)
+            x_new = x + dx * step
+            y_new = y + dy * step
+            z_new = z + dz * step
+        elif integrator == 'semi-implicit':
+            # the spring and damper terms at the new state, the forcing
+            # term and the phase at the old one:
+            # z_new = z + h*(a_z*(a_z/4*(goal - y - h*z_new) - z_new) + fx)
+            h = step / tau
+            fx = forcing(t_i, x)
+            z_new = (z + h * (a_z * a_z / 4 * (goal - y) + fx)) / np.power(1 + h * a_z / 2, 2)
+            dz = (z_new - z) / step
+            dy = z_new / tau
+            y_new = y + dy * step
+            x_new = x - a_x * x * h
+        else:
+            dx, dy, dz = derivatives(t_i, x, y, z)
+            h = step / 2
+            k2 = derivatives(t_i + h, x + dx * h, y + dy * h, z + dz * h)
+            k3 = derivatives(t_i + h, x + k2[0] * h, y + k2[1] * h, z + k2[2] * h)
+            k4 = derivatives(t_i + step, x + k3[0] * step, y + k3[1] * step, z + k3[2] * step)
+            x_new = x + (dx + 2 * k2[0] + 2 * k3[0] + k4[0]) * step / 6
+            y_new = y + (dy + 2 * k2[1] + 2 * k3[1] + k4[1]) * step / 6
+            z_new = z + (dz + 2 * k2[2] + 2 * k3[2] + k4[2]) * step / 6
+            dy = z_new / tau
+
+        x = np.where(live, x_new, x)
+        y = np.where(live, y_new, y)
+        z = np.where(live, z_new, z)
+
+        Y[:, i] = y
+        dY[:, i] = np.where(live, dy, 0)
+        ddY[:, i - 1] = np.where(live, dz / tau, 0)
+        t[:, i] = t[:, i - 1] + np.where(live, step, 0)
+
+    return t, Y, dY, ddY, time_steps
+
+
+def joint_dmps(dmps, integrator='euler', exact_phase=False, tolerance=None, cache=None):
+    """Integrate a list of dmp_class.DMP objects in one batch.
+
+    Stores t, Y, dY and ddY on every DMP, exactly like calling joint() on
+    each of them. With a dmp_cache.RolloutCache only the DMPs it does not
+    hold are integrated.
+    """
+    tau = np.array([dmp.tau for dmp in dmps])
+    y0 = np.array([dmp.y0 for dmp in dmps])
+    dy0 = np.array([dmp.dy0 for dmp in dmps])
+    goal = np.array([dmp.goal for dmp in dmps])
+    w = np.array([dmp.w for dmp in dmps])
+
+    rollout = joint if cache is None else cache.batch_joint
+    t, Y, dY, ddY, time_steps = rollout(tau, y0, goal, w, dmps[0].dt, dy0,
+                                        a_x=dmps[0].a_x, a_z=dmps[0].a_z,
+                                        integrator=integrator, exact_phase=exact_phase,
+                                        tolerance=tolerance)
+    for i, dmp in enumerate(dmps):
+        n = time_steps[i]
+        dmp.t = t[i, :n]
+        dmp.Y = Y[i, :n]
+        dmp.dY = dY[i, :n]
+        dmp.ddY = ddY[i, :n]
+    return dmps
@@ -0,0 +1,190 @@
+"""
+Tau buckets for training the DMP layers on data of mixed duration.
+
+The precomputed rollout operator of DMPParameters holds for its one tau.
+Samples of another duration are snapped to the nearest of a few bucket
+durations, each with its own [T x (N+2)] operator over the horizon of the
+data tensor (rows with a shorter tau settle at their goal, rows with a
+longer one are cut off, as in the 'tau' forward mode), so a batch of one
+bucket is still integrated with a single matrix multiply. The error of the
+snapping is measured on the actual [y0, goal, w] rows against the exact
+per-sample rollout of dmp_sensitivity, and buckets are split until it is
+below a tolerance.
+"""
+import numpy as np
+import torch
+
+from imednet.utils.dmp_basis import operator_cache
+from imednet.utils.dmp_sensitivity import sensitivity_rollout
+
+
+def horizon_operator(parameters, tau):
+    """
+    Rollout operator of one tau over the horizon of a data tensor.
+
+    # Arguments
+        parameters: DMPParameters.data_tensor
+        tau: duration
+
+    # Returns
+        [T x (N+2)] float64 array G with G p the trajectory of the
+        [y0, goal, w] row p, T the time_steps of the data tensor
+    """
+    N = int(parameters[1].item())
+    key = (N, float(tau), parameters[3].item(), parameters[4].item(), parameters[5].item(),
+           int(parameters[2].item()))
+
+    def build():
+        # impulse responses, the rollout is linear in [y0, goal, w] for fixed tau
+        unit = torch.eye(N + 2, dtype=torch.float64)
+        Y, _ = sensitivity_rollout(parameters.double(), unit, unit.new_full((N + 2,), float(tau)))
+        return Y.t().contiguous().numpy()
+
+    return operator_cache.get('dmp_horizon_operator', key, build)
+
+
+def bucket_rollout(inputs_np, parameters, operators, buckets):
+    """
+    Trajectories of a batch of DMPs with the operator of their tau bucket.
+
+    # Arguments
+        inputs_np: [B x Dof*(N+2)] unscaled network outputs
+        parameters: DMPParameters.data_tensor
+        operators: [K x T x (N+2)] TauBuckets.operators
+        buckets: [B] bucket of every sample, see TauBuckets.assign
+
+    # Returns
+        [Dof*B x T] trajectories in the layout of the integration kernel
+    """
+    dof = int(parameters[0].item())
+    n = int(parameters[1].item()) + 2
+    dmp_parameters = inputs_np.view(-1, n, dof).transpose(2, 1).contiguous().view(-1, n)
+    return _per_bucket(dmp_parameters, buckets.repeat_interleave(dof), lambda k: operators[k].t(),
+                       operators.shape[1])
+
+
+def bucket_backward(grad_outputs, operators, buckets, dof):
+    """Gradients of the [y0, goal, w] rows of bucket_rollout from those of its trajectories."""
+    return _per_bucket(grad_outputs, buckets.repeat_interleave(dof), lambda k: operators[k],
+                       operators.shape[2])
+
+
+def _per_bucket(rows, row_buckets, operator, columns):
+    """rows times the operator of their bucket, one matrix multiply per bucket."""
+    present = torch.unique(row_buckets).tolist()
+    if len(present) == 1:
+        return rows.mm(operator(present[0]))
+    out = rows.new_empty((rows.shape[0], columns))
+    for k in present:
+        index = (row_buckets == k).nonzero()[:, 0]
+        out[index] = rows[index].mm(operator(k))
+    return out
+
+
+class TauBuckets(object):
+    def __init__(self, parameters, boundaries):
+        """
+        Tau buckets and their rollout operators.
+
+        Every bucket [boundaries[k], boundaries[k+1]] is integrated with the
+        tau at its centre; durations outside the boundaries go to the first
+        or last bucket.
+
+        # Arguments
+            parameters: DMPParameters.data_tensor of the model
+            boundaries: increasing bucket boundaries, see tau_boundaries
+        """
+        self.parameters = parameters
+        self.boundaries = np.asarray(boundaries, dtype=np.float64)
+        if self.boundaries.ndim != 1 or len(self.boundaries) < 2 or np.any(np.diff(self.boundaries) <= 0):
+            raise ValueError('boundaries must be at least two increasing durations')
+        self.centres = (self.boundaries[1:] + self.boundaries[:-1]) / 2
+        self.operators = torch.from_numpy(np.stack([horizon_operator(parameters, tau)
+                                                    for tau in self.centres])).float()
+
+    def __len__(self):
+        return len(self.centres)
+
+    def assign(self, tau):
+        """[B] LongTensor of the bucket of every duration."""
+        tau = np.asarray(torch.as_tensor(tau).cpu(), dtype=np.float64).reshape(-1)
+        return torch.from_numpy(np.searchsorted(self.boundaries[1:-1], tau, side='right'))
+
+    def rollout_error(self, dmp_parameters, tau, chunk_size=512):
+        """
+        Largest error of every row from snapping its tau to the bucket centre.
+
+        # Arguments
+            dmp_parameters: [rows x (N+2)] [y0, goal, w] rows
+            tau: [rows] durations
+
+        # Returns
+            [rows] float64 array of max_t |exact rollout - bucket rollout|
+        """
+        dmp_parameters = torch.as_tensor(dmp_parameters, dtype=torch.float64)
+        tau = torch.as_tensor(np.asarray(tau, dtype=np.float64).reshape(-1))
+        buckets = self.assign(tau)
+        operators = self.operators.double()
+        data = self.parameters.double()
+        error = np.empty(len(tau))
+        for i in range(0, len(tau), chunk_size):
+            rows = dmp_parameters[i:i+chunk_size]
+            exact, _ = sensitivity_rollout(data, rows, tau[i:i+chunk_size])
+            snapped = torch.bmm(operators[buckets[i:i+chunk_size]], rows[:, :, None])[:, :, 0]
+            error[i:i+chunk_size] = (exact - snapped).abs().max(1)[0].numpy()
+        return error
+
+    def bucket_errors(self, dmp_parameters, tau):
+        """[K] largest rollout_error in every bucket, zero for empty buckets."""
+        error = self.rollout_error(dmp_parameters, tau)
+        errors = np.zeros(len(self))
+        np.maximum.at(errors, self.assign(tau).numpy(), error)
+        return errors
+
+    def refine(self, dmp_parameters, tau, tolerance, max_buckets=64):
+        """
+        Split buckets in half until the rollout error is below tolerance.
+
+        # Arguments
+            dmp_parameters: [rows x (N+2)] [y0, goal, w] rows of the data
+            tau: [rows] their durations
+            tolerance: largest allowed max_t error of any row
+            max_buckets: stop splitting at this many buckets
+
+        # Returns
+            TauBuckets with the refined boundaries and its bucket_errors
+        """
+        buckets = self
+        errors = buckets.bucket_errors(dmp_parameters, tau)
+        while np.any(errors > tolerance) and len(buckets) < max_buckets:
+            split = np.where(errors > tolerance)[0][:max_buckets - len(buckets)]
+            boundaries = np.sort(np.concatenate((buckets.boundaries, buckets.centres[split])))
+            buckets = TauBuckets(self.parameters, boundaries)
+            errors = buckets.bucket_errors(dmp_parameters, tau)
+        return buckets, errors
+
+
+def tau_boundaries(tau, count):
+    """count buckets of equal width over the range of the durations tau."""
+    tau = np.asarray(tau, dtype=np.float64)
+    low, high = tau.min(), tau.max()
+    if high == low:
+        high = low + 1e-6
+    return np.linspace(low, high, count + 1)
+
+
+def dmp_rows(outputs, dof=2):
+    """
+    [y0, goal, w] rows and durations of unscaled [tau, y0, goal, w] DMP parameters.
+
+    # Arguments
+        outputs: [B x (1+Dof*(N+2))] unscaled MatLoader outputs
+
+    # Returns
+        [Dof*B x (N+2)] rows in the row order of the DMPIntegrator output and
+        the [Dof*B] duration of every row
+    """
+    outputs = np.asarray(outputs, dtype=np.float64)
+    n = (outputs.shape[1] - 1) // dof
+    rows = outputs[:, 1:].reshape(-1, n, dof).transpose(0, 2, 1).reshape(-1, n)
+    return rows, np.repeat(outputs[:, 0], dof)
@@ -0,0 +1,159 @@
+"""
+Memoized DMP rollouts.
+
+Evaluation, plotting and re-planning often roll out the same or nearly the
+same DMP parameters again (e.g. the validation sample plotted every few
+epochs or identical predictions for duplicate images). RolloutCache keeps
+the rollouts of DMP.joint and dmp_batch.joint keyed by a hash of the
+quantized [tau, y0, dy0, goal, w] vector, so parameter vectors that agree
+up to the quantization step share one rollout.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from imednet.utils import dmp_batch
+
+
+class RolloutCache(object):
+    def __init__(self, maxsize=1024, maxbytes=64 * 2**20, quantization=1e-6):
+        """Bounded LRU cache of DMP rollouts.
+
+        # Arguments
+            maxsize: maximum number of cached rollouts
+            maxbytes: maximum total size of the cached arrays, None for no limit
+            quantization: parameters are rounded to multiples of this step
+                before hashing, None or 0 hashes the exact values
+        """
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.quantization = quantization
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, tau, y0, dy0, goal, w, dt, a_x=2, a_z=48, integrator='euler', exact_phase=False,
+            tolerance=None):
+        """Hash of the quantized parameters and the rollout settings of one DMP."""
+        vector = np.concatenate([np.ravel(np.asarray(v, dtype=np.float64)) for v in (tau, y0, dy0, goal, w)])
+        if self.quantization:
+            vector = np.round(vector / self.quantization).astype(np.int64)
+        settings = (np.shape(w), float(dt), float(a_x), float(a_z), integrator, bool(exact_phase), tolerance)
+        digest = hashlib.sha1(repr(settings).encode('utf-8'))
+        digest.update(vector.tobytes())
+        return digest.hexdigest()
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        return None
+
+    def _store(self, key, value):
+        value = tuple(_read_only(np.array(v)) for v in value)
+        size = sum(v.nbytes for v in value)
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = value
+            self.nbytes += size
+            while self._entries and (len(self._entries) > self.maxsize or
+                                     (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= sum(v.nbytes for v in evicted)
+                self.evictions += 1
+
+    def joint(self, dmp, integrator='euler', exact_phase=False, tolerance=None):
+        """DMP.joint of a dmp_class.DMP, sets t, Y, dY and ddY from the cache on a hit.
+
+        The DMP gets its own writable copies, the cached arrays stay read-only.
+        """
+        key = self.key(dmp.tau, dmp.y0, dmp.dy0, dmp.goal, dmp.w, dmp.dt, dmp.a_x, dmp.a_z,
+                       integrator, exact_phase, tolerance)
+        value = self._lookup(key)
+        if value is None:
+            dmp.joint(integrator, exact_phase, tolerance)
+            self._store(key, (dmp.t, dmp.Y, dmp.dY, dmp.ddY))
+        else:
+            dmp.t, dmp.Y, dmp.dY, dmp.ddY = (np.array(v) for v in value)
+
+    def batch_joint(self, tau, y0, goal, w, dt, dy0=None, a_x=2, a_z=48, integrator='euler',
+                    exact_phase=False, tolerance=None):
+        """dmp_batch.joint with every DMP looked up in the cache.
+
+        The DMPs that miss are rolled out in a single dmp_batch.joint call,
+        repeated parameter vectors of the batch only once. Same arguments
+        and returns as dmp_batch.joint.
+        """
+        tau = np.asarray(tau, dtype=float)
+        y0 = np.asarray(y0, dtype=float)
+        goal = np.asarray(goal, dtype=float)
+        w = np.asarray(w, dtype=float)
+        B, dof = tau.shape
+        dy0 = np.zeros((B, dof)) if dy0 is None else np.asarray(dy0, dtype=float)
+
+        keys = [self.key(tau[i], y0[i], dy0[i], goal[i], w[i], dt, a_x, a_z, integrator, exact_phase, tolerance)
+                for i in range(B)]
+        rollouts = [self._lookup(k) for k in keys]
+        # the first DMP of every missing key, the repeats take its rollout
+        first = OrderedDict()
+        for i in range(B):
+            if rollouts[i] is None:
+                first.setdefault(keys[i], i)
+        missing = list(first.values())
+        if missing:
+            t, Y, dY, ddY, time_steps = dmp_batch.joint(tau[missing], y0[missing], goal[missing], w[missing], dt,
+                                                        dy0[missing], a_x=a_x, a_z=a_z, integrator=integrator,
+                                                        exact_phase=exact_phase, tolerance=tolerance)
+            for j, i in enumerate(missing):
+                n = time_steps[j]
+                rollouts[i] = (t[j, :n], Y[j, :n], dY[j, :n], ddY[j, :n])
+                self._store(keys[i], rollouts[i])
+            for i in range(B):
+                if rollouts[i] is None:
+                    rollouts[i] = rollouts[first[keys[i]]]
+
+        # pad to the longest rollout by holding the final state, like dmp_batch.joint
+        time_steps = np.array([r[0].shape[0] for r in rollouts])
+        T = time_steps.max()
+        t = np.zeros((B, T, dof))
+        Y = np.zeros((B, T, dof))
+        dY = np.zeros((B, T, dof))
+        ddY = np.zeros((B, T, dof))
+        for i, (t_i, Y_i, dY_i, ddY_i) in enumerate(rollouts):
+            n = time_steps[i]
+            t[i, :n], Y[i, :n], dY[i, :n], ddY[i, :n] = t_i, Y_i, dY_i, ddY_i
+            t[i, n:] = t_i[-1]
+            Y[i, n:] = Y_i[-1]
+        return t, Y, dY, ddY, time_steps
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.nbytes = 0
+
+    def info(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+                'size': len(self._entries), 'maxsize': self.maxsize,
+                'nbytes': self.nbytes, 'maxbytes': self.maxbytes}
+
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+rollout_cache = RolloutCache()
@@ -3,6 +3,9 @@ DMP integration in Cartesian or joint coordinates.
 """
 import numpy as np
 
+from imednet.utils.dmp_basis import basis_cache
+from imednet.utils import dmp_batch
+
 class DMP(object):
     def __init__(self, N, dt):
         """Init, define number of basis function and time step for integration
@@ -25,9 +28,7 @@ class DMP(object):
         self.dt = dt
 
     def precalculate(self, N, dof, dt):
-        self.c = np.exp(-self.a_x * np.linspace(0, 1, self.N))
-        sigma2 = np.power((np.diff(self.c)/2), 2)
-        self.sigma2 = np.append(sigma2, sigma2[-1])
+        self.c, self.sigma2 = basis_cache.centres(self.N, self.a_x)
 
         self.tau = np.zeros(dof)
         self.goal = np.zeros(dof)
@@ -55,9 +56,7 @@ class DMP(object):
 
         np.copyto(self.w, w)
 
-        self.c = np.exp(-self.a_x*np.linspace(0, 1, self.N))
-        sigma2 = np.power((np.diff(self.c)/2), 2)
-        self.sigma2 = np.append(sigma2, sigma2[-1])
+        self.c, self.sigma2 = basis_cache.centres(self.N, self.a_x)
 
 
     def track(self,t,y,yd,ydd):
@@ -108,9 +107,7 @@ class DMP(object):
 
         self.w=np.zeros([self.N,dof])
 
-        self.c=np.exp(-self.a_x*np.linspace(0,1,self.N))
-        sigma2=np.power((np.diff(self.c)/2),2)
-        self.sigma2=np.append(sigma2,sigma2[-1])
+        self.c, self.sigma2 = basis_cache.centres(self.N, self.a_x)
 
         ft=np.array([np.power(self.tau,2)]*self.t_or.shape[0])*ydd- self.a_z * (self.a_z/4  * (np.array([self.goal]*self.t_or.shape[0]) - y) - np.array([self.tau]*self.t_or.shape[0]) * yd);
 
@@ -134,11 +131,15 @@ class DMP(object):
 
             self.w[:,j] = np.linalg.lstsq(np.transpose(A), ft[:,j])[0]
 
-    def joint(self):
+    def joint(self, integrator='euler', exact_phase=False, tolerance=None, cache=None):
         """Integrate joints.
 
         # Arguments
-            N:
+            integrator: 'euler', 'semi-implicit' or 'rk4', see dmp_batch.joint
+            exact_phase: use the analytic phase exp(-a_x*t/tau)
+            tolerance: only evaluate the kernels near the phase, see
+                dmp_basis.BasisCache.support
+            cache: dmp_cache.RolloutCache to look the rollout up in
 
         # Returns
 
@@ -148,6 +149,13 @@ class DMP(object):
 
         ```
         """
+        if cache is not None:
+            cache.joint(self, integrator, exact_phase, tolerance)
+            return
+        if integrator != 'euler' or exact_phase:
+            dmp_batch.joint_dmps([self], integrator, exact_phase, tolerance)
+            return
+
         time_steps = int(np.round(np.max(self.tau)/self.dt))+1
 
         dt = self.tau/time_steps
@@ -160,21 +168,23 @@ class DMP(object):
         for j in range(0,self.w.shape[1]):
             y = self.Y[0,j] = self.y0[j]
             z = self.dY[0,j] = self.dy0[j]*self.tau[j]
-            x = 1
+
+            # forcing term along the whole canonical phase
+            if tolerance is None:
+                x, psi = basis_cache.phase(self.N, self.a_x, self.tau[j], dt[j])
+                fx = x[:time_steps-1] * np.dot(psi[:time_steps-1], self.w[:,j])
+            else:
+                x, index, psi = basis_cache.truncated_phase(self.N, self.a_x, self.tau[j], dt[j], tolerance)
+                fx = x[:time_steps-1] * np.sum(psi[:time_steps-1] * self.w[index[:time_steps-1],j], axis=1)
 
             for i in range(1,time_steps):
                 #state = self.DMP_integrate(state, dt )
-                psi = np.exp(-0.5*np.power((x-self.c),2)/self.sigma2)
-                fx = np.sum((self.w[:,j]*x)*psi) / np.sum(psi)
-
-                dx = (-self.a_x*x)/self.tau[j]
-                dz = self.a_z * (self.a_z/4 * (self.goal[j] - y) - z) + fx
+                dz = self.a_z * (self.a_z/4 * (self.goal[j] - y) - z) + fx[i-1]
                 dy = z
 
                 dz = dz/self.tau[j]
                 dy = dy/self.tau[j]
 
-                x = x + dx*dt[j]
                 y = y + dy*dt[j]
                 z = z + dz*dt[j]
 
@@ -240,3 +250,308 @@ class DMP(object):
     #     plt.title('Aceleration')
     #
     #     plt.show()
+
+
+class DMPStepper(object):
+    def __init__(self, dmp, dt=None):
+        """Stream the setpoints of a DMP one control tick at a time.
+
+        The state (x, y, z) and all intermediate values live in buffers
+        allocated here, so step() does not allocate. Goal and tau can be
+        changed while the motion is running.
+
+        # Arguments
+            dmp: DMP with tau, y0, dy0, goal and w set (e.g. by values or track)
+            dt: control period (defaults to dmp.dt)
+
+        # Examples
+        ```
+        stepper = DMPStepper(dmp, dt=0.002)
+        while not stepper.done:
+            send_setpoint(stepper.step())
+        ```
+        """
+        self.a_z = dmp.a_z
+        self.a_x = dmp.a_x
+        self.dt = dmp.dt if dt is None else dt
+
+        dof = len(dmp.goal)
+        self.tau = np.array(dmp.tau, dtype=float)
+        self.goal = np.array(dmp.goal, dtype=float)
+        self.y0 = np.array(dmp.y0, dtype=float)
+        self.dy0 = np.array(dmp.dy0, dtype=float)
+        self.w = np.ascontiguousarray(np.transpose(dmp.w), dtype=float)
+
+        c, sigma2 = basis_cache.centres(dmp.N, dmp.a_x)
+        self._c = np.tile(c, (dof, 1))
+        self._inv_sigma2 = np.tile(-0.5/sigma2, (dof, 1))
+
+        self.t = 0.0
+        self.x = np.ones(dof)
+        self.y = np.zeros(dof)
+        self.z = np.zeros(dof)
+        self.dy = np.zeros(dof)
+        self.ddy = np.zeros(dof)
+
+        self._psi = np.zeros((dof, dmp.N))
+        self._wpsi = np.zeros((dof, dmp.N))
+        self._sum_psi = np.zeros(dof)
+        self._fx = np.zeros(dof)
+        self._dz = np.zeros(dof)
+        self._tmp = np.zeros(dof)
+
+        self.reset()
+
+    def reset(self):
+        """Go back to the start of the motion."""
+        self.t = 0.0
+        self.x.fill(1)
+        np.copyto(self.y, self.y0)
+        np.multiply(self.dy0, self.tau, out=self.z)
+        np.copyto(self.dy, self.dy0)
+        self.ddy.fill(0)
+
+    def set_goal(self, goal):
+        np.copyto(self.goal, goal)
+
+    def set_tau(self, tau):
+        """Change the duration mid-motion, keeping the current velocity."""
+        np.divide(self.z, self.tau, out=self.z)
+        np.copyto(self.tau, tau)
+        np.multiply(self.z, self.tau, out=self.z)
+
+    @property
+    def done(self):
+        return self.t >= np.max(self.tau)
+
+    def step(self, k=1):
+        """Advance k control ticks.
+
+        # Returns
+            position after the last tick; the returned array is the internal
+            buffer and is overwritten by the next call (velocity and
+            acceleration are in self.dy and self.ddy)
+        """
+        psi = self._psi
+        dz = self._dz
+        tmp = self._tmp
+        dt = self.dt
+
+        for _ in range(k):
+            # psi = exp(-0.5*(x-c)^2/sigma2)
+            np.subtract(self.x[:, None], self._c, out=psi)
+            np.multiply(psi, psi, out=psi)
+            np.multiply(psi, self._inv_sigma2, out=psi)
+            np.exp(psi, out=psi)
+
+            # fx = x*sum(w*psi)/sum(psi)
+            np.multiply(self.w, psi, out=self._wpsi)
+            np.sum(self._wpsi, axis=1, out=self._fx)
+            np.sum(psi, axis=1, out=self._sum_psi)
+            np.divide(self._fx, self._sum_psi, out=self._fx)
+            np.multiply(self._fx, self.x, out=self._fx)
+
+            # dz = (a_z*(a_z/4*(goal-y)-z)+fx)/tau, dy = z/tau
+            np.subtract(self.goal, self.y, out=dz)
+            np.multiply(dz, self.a_z/4, out=dz)
+            np.subtract(dz, self.z, out=dz)
+            np.multiply(dz, self.a_z, out=dz)
+            np.add(dz, self._fx, out=dz)
+            np.divide(dz, self.tau, out=dz)
+            np.divide(self.z, self.tau, out=self.dy)
+            np.divide(dz, self.tau, out=self.ddy)
+
+            # x += -a_x*x/tau*dt
+            np.multiply(self.x, -self.a_x*dt, out=tmp)
+            np.divide(tmp, self.tau, out=tmp)
+            np.add(self.x, tmp, out=self.x)
+
+            # y += dy*dt, z += dz*dt
+            np.multiply(self.dy, dt, out=tmp)
+            np.add(self.y, tmp, out=self.y)
+            np.multiply(dz, dt, out=tmp)
+            np.add(self.z, tmp, out=self.z)
+
+            self.t += dt
+
+        return self.y
+
+
+class DMPFitter(object):
+    def __init__(self, N, dt, tau, dof, regularization=1e-8):
+        """Fit the weights of a DMP while its demonstration is being recorded.
+
+        Recursive least squares over the basis activations of DMP.track: every
+        add() costs O(N^2) and the current weights are available at any time.
+        Velocities and accelerations are the finite differences of
+        dmp_batch.derivatives, so a sample enters the fit two samples after
+        it was recorded.
+
+        The phase depends on the duration, so tau has to be known when the
+        recording starts; the result equals DMP.track on the whole recording
+        when tau is the duration track finds (the time of the third-last
+        sample). The goal enters the forcing targets linearly and is kept as
+        a separate right-hand side, so it can still change until the end.
+
+        # Arguments
+            N: number of basis functions
+            dt: time step of the fitted DMP
+            tau: duration of the demonstration
+            dof: degrees of freedom
+            regularization: ridge term of the least squares fit (the initial
+                inverse covariance is I/regularization)
+
+        # Examples
+        ```
+        fitter = DMPFitter(25, 0.01, 3.0, 2)
+        for t, y in samples:
+            fitter.add(t, y)
+            preview = fitter.weights()
+        dmp = fitter.dmp()
+        ```
+        """
+        self.a_z = 48
+        self.a_x = 2
+        self.N = N
+        self.dt = dt
+        self.tau = float(tau)
+        self.dof = dof
+        self.c, self.sigma2 = basis_cache.centres(N, self.a_x)
+
+        self.y0 = None
+        self.dy0 = None
+        self.goal = None
+        self._samples = []
+        self._pending = None
+
+        # inverse covariance and weights for the dof targets and the goal term
+        self._P = np.eye(N) / regularization
+        self._W = np.zeros((N, dof + 1))
+
+    def add(self, t, y):
+        """Add the sample y [dof] recorded at time t."""
+        self._samples.append((float(t), np.array(y, dtype=float)))
+        if len(self._samples) < 3:
+            return
+        (t0, p0), (t1, p1), (t2, p2) = self._samples
+        del self._samples[0]
+
+        yd = (p1 - p0) / (t1 - t0)
+        ydd = ((p2 - p1) / (t2 - t1) - yd) / (t1 - t0)
+        if self.y0 is None:
+            self.y0 = p0
+            self.dy0 = yd
+
+        # like DMP.track the newest sample does not get a basis row, it only
+        # sets the goal
+        if self._pending is not None:
+            self._update(*self._pending)
+        self._pending = (t0, p0, yd, ydd)
+        self.goal = p0
+
+    def _update(self, t, y, yd, ydd):
+        x = np.exp(-self.a_x / self.tau * t)
+        psi = np.exp(-0.5 * np.power(x - self.c, 2) / self.sigma2)
+        psi = psi * (x / np.sum(psi))
+        psi[psi < 1.0e-8] = 0
+
+        # ft = tau^2*ydd - a_z*(a_z/4*(goal - y) - tau*yd), without the goal term
+        target = np.append(self.tau**2 * ydd + self.a_z**2 / 4 * y + self.a_z * self.tau * yd, 1.0)
+
+        P_psi = self._P.dot(psi)
+        gain = P_psi / (1.0 + psi.dot(P_psi))
+        self._W += np.outer(gain, target - psi.dot(self._W))
+        self._P -= np.outer(gain, P_psi)
+
+    def weights(self, goal=None):
+        """[N x dof] weights of the samples so far, for the latest or the given goal."""
+        goal = self.goal if goal is None else np.asarray(goal, dtype=float)
+        if goal is None:
+            return np.zeros((self.N, self.dof))
+        return self._W[:, :self.dof] - self.a_z**2 / 4 * np.outer(self._W[:, self.dof], goal)
+
+    def dmp(self):
+        """DMP of the samples so far, as DMP.track would give for the whole recording."""
+        dmp = DMP(self.N, self.dt)
+        dmp.values(self.N, self.dt, self.tau * np.ones(self.dof), self.y0, self.dy0, self.goal, self.weights())
+        return dmp
+
+
+class DMPSet(object):
+    """Parameters of many DMPs stored as contiguous arrays.
+
+    Replaces arrays of DMP objects: tau, y0, dy0 and goal are [B x dof]
+    arrays and w is a [B x N x dof] array, optionally in float32.
+    Trajectories are not stored, they are rolled out on request.
+    """
+    __slots__ = ('N', 'dt', 'a_x', 'a_z', 'tau', 'y0', 'dy0', 'goal', 'w')
+
+    def __init__(self, N, dt, tau, y0, dy0, goal, w, dtype=np.float64):
+        self.N = N
+        self.dt = dt
+        self.a_z = 48
+        self.a_x = 2
+        self.tau = np.ascontiguousarray(tau, dtype=dtype)
+        self.y0 = np.ascontiguousarray(y0, dtype=dtype)
+        self.dy0 = np.ascontiguousarray(dy0, dtype=dtype)
+        self.goal = np.ascontiguousarray(goal, dtype=dtype)
+        self.w = np.ascontiguousarray(w, dtype=dtype)
+
+    @classmethod
+    def from_trajectories(cls, trajectories, N, dt, dtype=np.float64, samples=None):
+        """Fit DMPs to raw [x, y, ..., t] trajectories, see dmp_batch.fit_trajectories.
+
+        With samples given the weights are fitted on a common grid of that
+        many points instead, see dmp_batch.fit_resampled.
+        """
+        if samples is None:
+            tau, y0, dy0, goal, w = dmp_batch.fit_trajectories(trajectories, N)
+        else:
+            tau, y0, dy0, goal, w = dmp_batch.fit_resampled(trajectories, N, samples)
+        return cls(N, dt, tau, y0, dy0, goal, w, dtype=dtype)
+
+    @classmethod
+    def from_dmps(cls, dmps, dtype=np.float64):
+        return cls(dmps[0].N, dmps[0].dt,
+                   [dmp.tau for dmp in dmps], [dmp.y0 for dmp in dmps], [dmp.dy0 for dmp in dmps],
+                   [dmp.goal for dmp in dmps], [dmp.w for dmp in dmps], dtype=dtype)
+
+    def __len__(self):
+        return self.tau.shape[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        """A DMP object for an integer index, a DMPSet for slices and index arrays."""
+        if isinstance(index, (int, np.integer)):
+            dmp = DMP(self.N, self.dt)
+            dmp.values(self.N, self.dt, self.tau[index], self.y0[index], self.dy0[index],
+                       self.goal[index], self.w[index])
+            return dmp
+        return DMPSet(self.N, self.dt, self.tau[index], self.y0[index], self.dy0[index],
+                      self.goal[index], self.w[index], dtype=self.w.dtype)
+
+    def parameters(self):
+        """[B x (1+4*dof+N*dof)] array in the form [tau, y0, dy0, goal, w]."""
+        return np.concatenate((self.tau[:, :1], self.y0, self.dy0, self.goal,
+                               self.w.reshape(len(self), -1)), axis=1)
+
+    def joint(self, index=None, integrator='euler', exact_phase=False, tolerance=None, cache=None):
+        """Roll out the selected DMPs, see dmp_batch.joint.
+
+        # Arguments
+            index: DMPs to roll out (defaults to all of them)
+            cache: dmp_cache.RolloutCache to look the rollouts up in
+
+        # Returns
+            t, Y, dY, ddY: [B x T x dof] arrays
+            time_steps: [B] number of valid time steps of each DMP
+        """
+        dmps = self if index is None else self[np.atleast_1d(index)]
+        rollout = dmp_batch.joint if cache is None else cache.batch_joint
+        return rollout(dmps.tau, dmps.y0, dmps.goal, dmps.w, self.dt, dmps.dy0,
+                       a_x=self.a_x, a_z=self.a_z,
+                       integrator=integrator, exact_phase=exact_phase,
+                       tolerance=tolerance)
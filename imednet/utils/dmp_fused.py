@@ -0,0 +1,86 @@
+"""
+TorchScript DMP rollout kernel.
+
+Does the same Euler integration as integrate in the DMP layers, but as one
+scripted kernel (phase, basis, forcing terms and the integration loop)
+whose sizes (N, DOF, time steps, dt, a_x, a_z) come from the DMPParameters
+data tensor instead of being compiled into the source. Runs on whatever
+device the inputs are on; on the CPU the batch is split over
+torch.jit.fork tasks, which run in parallel on the inter-op thread pool.
+"""
+from typing import List
+
+import torch
+
+
+@torch.jit.script
+def _rollout(dmp_parameters, c, sigma2, time_steps: int, dt: float, tau: float, a_x: float, a_z: float):
+    y = dmp_parameters[:, 0]
+    goal = dmp_parameters[:, 1]
+    w = dmp_parameters[:, 2:]
+    z = torch.zeros_like(y)
+
+    # Euler phase in double precision as in basis_cache.phase
+    x = torch.empty(time_steps - 1, dtype=torch.float64)
+    x_i = 1.0
+    for i in range(time_steps - 1):
+        x[i] = x_i
+        x_i = x_i - a_x * x_i / tau * dt
+    x = x.to(dmp_parameters)
+
+    # forcing terms of all steps and rows with one matrix multiply
+    psi = torch.exp(-0.5 * (x[:, None] - c) * (x[:, None] - c) / sigma2)
+    psi = psi * (x / psi.sum(1))[:, None]
+    fx = torch.mm(psi, w.t())
+
+    # time major, so that every step writes one contiguous row
+    Y = torch.empty((time_steps, dmp_parameters.shape[0]), dtype=dmp_parameters.dtype,
+                    device=dmp_parameters.device)
+    Y[0] = y
+    for i in range(time_steps - 1):
+        dz = (a_z * (a_z / 4 * (goal - y) - z) + fx[i]) / tau
+        y = y + z / tau * dt
+        z = z + dz * dt
+        Y[i + 1] = y
+    return Y.t().contiguous()
+
+
+@torch.jit.script
+def _parallel_rollout(dmp_parameters, c, sigma2, time_steps: int, dt: float, tau: float, a_x: float, a_z: float,
+                      tasks: int):
+    futures: List[torch.jit.Future[torch.Tensor]] = []
+    for chunk in dmp_parameters.chunk(tasks):
+        futures.append(torch.jit.fork(_rollout, chunk, c, sigma2, time_steps, dt, tau, a_x, a_z))
+    return torch.cat([torch.jit.wait(future) for future in futures], 0)
+
+
+def fused_rollout(parameters, dmp_parameters, tau=None, tasks=None):
+    """
+    Trajectories of a batch of DMPs with the scripted kernel.
+
+    # Arguments
+        parameters: DMPParameters.data_tensor [Dof, N, time_steps, dt, a_x, a_z, c, sigma2]
+        dmp_parameters: [rows x (N+2)] tensor of [y0, goal, w] rows
+        tau: duration, (time_steps-1)*dt by default
+        tasks: number of parallel tasks on the CPU, torch.get_num_interop_threads()
+            by default
+
+    # Returns
+        [rows x time_steps] trajectories
+    """
+    N = int(parameters[1].item())
+    time_steps = int(parameters[2].item())
+    dt = parameters[3].item()
+    if tau is None:
+        tau = (time_steps - 1) * dt
+    c = parameters[6:6+N].to(dmp_parameters)
+    sigma2 = parameters[6+N:6+2*N].to(dmp_parameters)
+
+    if tasks is None:
+        tasks = 1 if dmp_parameters.is_cuda else torch.get_num_interop_threads()
+    tasks = max(1, min(tasks, dmp_parameters.shape[0]))
+    if tasks == 1:
+        return _rollout(dmp_parameters, c, sigma2, time_steps, dt, float(tau),
+                        parameters[4].item(), parameters[5].item())
+    return _parallel_rollout(dmp_parameters, c, sigma2, time_steps, dt, float(tau),
+                             parameters[4].item(), parameters[5].item(), tasks)
@@ -2,6 +2,12 @@ import torch
 from torch.autograd import Function
 import numpy as np
 
+from imednet.utils.dmp_basis import basis_cache, operator_cache
+from imednet.utils.dmp_fused import fused_rollout
+from imednet.utils.dmp_sensitivity import tau_forward, tau_backward
+from imednet.utils.dmp_buckets import bucket_rollout, bucket_backward
+from imednet.utils.dmp_layer_no_cuda import impulse_responses
+
 import pycuda.autoinit
 
 from pycuda.compiler import SourceModule
@@ -12,30 +18,34 @@ mod = SourceModule("""
 #include <math.h>
 
 
-__global__ void multiply_them(float *traj, float *dmp_parameters, float *c, float *sigma2, int n)
+__global__ void multiply_them(float *traj, float *dmp_parameters, float *c, float *sigma2, int n,
+                              int dofs, int N, int time_steps, float dt, float tau, float a_x, float a_z)
 {
-  const int idx_in = ((blockIdx.x * blockDim.x)+threadIdx.x)*54;
-  const int idx_out =((blockIdx.x * blockDim.x)+threadIdx.x)*301*2;
+  // one DMP of [y0, goal, w] with the DOF interleaved per thread, one row of
+  // time_steps points per DOF in the output
+  const int idx_in = ((blockIdx.x * blockDim.x)+threadIdx.x)*dofs*(N+2);
+  const int idx_out =((blockIdx.x * blockDim.x)+threadIdx.x)*time_steps*dofs;
 
 
   if(idx_in<n)
   {
       float x , dx;
-      float fx,sum_psi, psi,a,y,z=0;
+      float fx,sum_psi, psi,a,y,z;
 
-      for(int dof=0;dof<2;dof++)
+      for(int dof=0;dof<dofs;dof++)
       {
         x = 1.0;
+        z = 0.0;
         y=dmp_parameters[idx_in+dof];
-        traj[idx_out+dof*301]=y;
-        for(int i=0;i<300;i++)
+        traj[idx_out+dof*time_steps]=y;
+        for(int i=0;i<time_steps-1;i++)
           {
             fx = sum_psi = 0.0;
 
-            for(int j=0;j<25;j++)
+            for(int j=0;j<N;j++)
             {
                 psi =exp(-0.5*((x-c[j])*(x-c[j])/sigma2[j]));
-                fx = fx +(dmp_parameters[idx_in+4+j*2+dof]*psi);
+                fx = fx +(dmp_parameters[idx_in+2*dofs+j*dofs+dof]*psi);
                 sum_psi = sum_psi + psi;
 
             }
@@ -44,19 +54,19 @@ __global__ void multiply_them(float *traj, float *dmp_parameters, float *c, floa
 
             //a = alpha_z*(beta_z*(goal-y)-z)+fx
 
-            a = 48*(12*(dmp_parameters[idx_in+2+dof]-y)-z)+fx;
-            z = z + 0.01*a/3.0;
-            y = y +0.01*z/3.0;
+            a = a_z*(a_z/4*(dmp_parameters[idx_in+dofs+dof]-y)-z)+fx;
+            z = z + dt*a/tau;
+            y = y +dt*z/tau;
 
             //dx = -alpha_x*x/tau
 
-            dx = -2.0*x/3.0;
+            dx = -a_x*x/tau;
 
             //x = x+dx*dt
-            x = x+dx*0.01;
+            x = x+dx*dt;
 
             //printf(" %d ",x);
-            traj[1+i+idx_out+dof*301] = y;
+            traj[1+i+idx_out+dof*time_steps] = y;
         }
       }
   }
@@ -79,11 +89,20 @@ class Holder(pycuda.driver.PointerHolderBase):
 class DMPIntegrator(Function):
 
     @staticmethod
-    def forward(ctx, inputs, parameters, param_gradients, scaling):
+    def forward(ctx, inputs, parameters, param_gradients, scaling, mode=None, time_indices=None,
+                buckets=None):
         ctx.param = parameters
         ctx.grad = param_gradients
+        ctx.mode = mode
+
+        if mode == 'tau':
+            # per-sample tau, scaling is DMPParameters.tau_scale_tensor
+            Y, ctx.jacobian, ctx.scale = tau_forward(inputs, parameters, scaling)
+            return inputs.new(Y)
 
-        division = 2*(int(parameters[1].item())+2)
+        dof = int(parameters[0].item())
+        n = int(parameters[1].item()) + 2
+        division = dof*n
         inputs_np = scaling[0:division] * (inputs - scaling[-1]) + scaling[division:division*2]
         ctx.scale = scaling[0:division]
 
@@ -93,7 +112,35 @@ class DMPIntegrator(Function):
         #X = integrate(parameters,w, inputs_np[:,range(0,int(parameters[0].item()))].view(int(parameters[0].item())*inputs.shape[0],), torch.zeros(inputs.shape[0]*int(parameters[0].item())).cuda(),
                #       inputs_np[:,range(int(parameters[0].item()),int(parameters[0].item())*2)].view(int(parameters[0].item())*inputs.shape[0],), 3)
 
-        Y = torch.cuda.FloatTensor(2*inputs_np.shape[0], int(parameters[2].item())).fill_(0)
+        if mode == 'buckets':
+            # durations snapped to tau buckets, param_gradients are the
+            # [K x T x (N+2)] TauBuckets.operators and buckets the bucket of every sample
+            if time_indices is not None:
+                param_gradients = param_gradients[:, time_indices]
+            ctx.grad = param_gradients
+            ctx.buckets = buckets
+            return inputs.new(bucket_rollout(inputs_np, parameters, param_gradients, buckets))
+
+        if time_indices is not None:
+            # only the rows of the rollout operator at the requested time steps,
+            # the backward pass then uses the same rows
+            if mode not in (None, 'operator'):
+                raise ValueError("time_indices need the default or the 'operator' forward mode")
+            param_gradients = param_gradients[time_indices]
+            ctx.grad = param_gradients
+            mode = 'operator'
+
+        if mode == 'operator':
+            return inputs.new(operator_rollout(inputs_np, parameters, param_gradients))
+
+        tau = (int(parameters[2].item()) - 1) * parameters[3].item()
+
+        if mode == 'fused':
+            # scripted kernel sized from the data tensor
+            dmp_parameters = inputs_np.view(-1, n, dof).transpose(2, 1).contiguous().view(-1, n)
+            return inputs.new(fused_rollout(parameters, dmp_parameters, tau))
+
+        Y = torch.cuda.FloatTensor(dof*inputs_np.shape[0], int(parameters[2].item())).fill_(0)
 
         n=inputs_np.shape[0]*inputs_np.shape[1]
         n=np.int32(n)
@@ -106,6 +153,13 @@ class DMPIntegrator(Function):
             Holder(parameters[6:(6+int(parameters[1].item()))]),  # c
             Holder(parameters[(6+int(parameters[1].item())):(6+int(parameters[1].item())*2)]),  # sigma_2
             n,
+            np.int32(dof),
+            np.int32(parameters[1].item()),
+            np.int32(parameters[2].item()),
+            np.float32(parameters[3].item()),  # dt
+            np.float32(tau),
+            np.float32(parameters[4].item()),  # a_x
+            np.float32(parameters[5].item()),  # a_z
             block=(1024, 1, 1), grid=(k, 1))
 
         return inputs.new(Y)
@@ -114,21 +168,45 @@ class DMPIntegrator(Function):
     def backward(ctx, grad_outputs):
         parameters = ctx.param
 
+        if ctx.mode == 'tau':
+            point_grads = tau_backward(grad_outputs, ctx.jacobian, ctx.scale, int(parameters[0].item()))
+            return grad_outputs.new(point_grads), None, None, None, None, None, None
+
         grad = ctx.grad
         scale = ctx.scale
 
-        point_grads = torch.mm(grad_outputs,grad).view(-1,2,27).transpose(2,1).contiguous().view(1,-1,54).squeeze()
+        dof = int(parameters[0].item())
+        n = int(parameters[1].item()) + 2
+        if ctx.mode == 'buckets':
+            row_grads = bucket_backward(grad_outputs, grad, ctx.buckets, dof)
+        else:
+            row_grads = torch.mm(grad_outputs,grad)
+        point_grads = row_grads.view(-1,dof,n).transpose(2,1).contiguous().view(-1,dof*n)
 
         # point_grads = 10*point_grads*scale*parameters[3].item()
         point_grads = point_grads * scale
 
-        return grad_outputs.new(point_grads), None, None, None
+        return grad_outputs.new(point_grads), None, None, None, None, None, None
+
+
+def operator_rollout(inputs_np, parameters, param_gradients):
+    """
+    Trajectories of a batch of DMPs as one matrix multiply.
+
+    For fixed tau and dt the Euler rollout is linear in (y0, goal, w), so
+    every trajectory is param_gradients (the [T x (N+2)] impulse responses
+    of DMPParameters) applied to its parameters. Returns the same
+    [Dof*B x T] layout as the integration kernel.
+    """
+    dof = int(parameters[0].item())
+    n = int(parameters[1].item()) + 2
+    dmp_parameters = inputs_np.view(-1, n, dof).transpose(2, 1).contiguous().view(-1, n)
+    return torch.mm(dmp_parameters, param_gradients.t())
 
 
-def integrate(data, w, y0, dy0, goal, tau):
+def integrate(data, w, y0, dy0, goal, tau, tolerance=None):
     y = y0
     z = dy0 * tau
-    x = 1
 
     if w.is_cuda:
         # Y = torch.zeros((w.shape[0],int(data[2].item()))).cuda()
@@ -138,20 +216,24 @@ def integrate(data, w, y0, dy0, goal, tau):
 
     Y[:, 0] = y
 
-    for i in range(0, int(data[2].item())-1):
-        psi = torch.exp(-0.5 * torch.pow((x - data[6:(6+int(data[1].item()))]), 2) / data[(6+int(data[1].item())):(6+int(data[1].item())*2)])
-
-        # fx = torch.sum((w[3,:] * x) * psi) / torch.sum(psi)
-        fx = torch.mv(w*x, psi) / torch.sum(psi)
+    # forcing terms of all time steps at once from the cached basis
+    if tolerance is None:
+        x, psi = basis_cache.phase(int(data[1].item()), data[4].item(), float(tau), data[3].item())
+        psi = torch.from_numpy(x[:, None] * psi).float().to(w.device)
+        fx = torch.mm(w, psi.t())
+    else:
+        # only the kernels near the phase, see BasisCache.support
+        x, index, psi = basis_cache.truncated_phase(int(data[1].item()), data[4].item(), float(tau), data[3].item(), tolerance)
+        psi = torch.from_numpy(x[:, None] * psi).float().to(w.device)
+        fx = torch.sum(w[:, torch.from_numpy(index).to(w.device)] * psi, 2)
 
-        dx = (-data[4].item() * x) / tau
-        dz = data[5].item() * (data[5].item() / 4 * (goal - y) - z) + fx
+    for i in range(0, int(data[2].item())-1):
+        dz = data[5].item() * (data[5].item() / 4 * (goal - y) - z) + fx[:, i]
         dy = z
 
         dz = dz / tau
         dy = dy / tau
 
-        x = x + dx * data[3].item()
         y = y + dy * data[3].item()
         z = z + dz * data[3].item()
 
@@ -165,12 +247,9 @@ class DMPParameters():
         self.a_z = 48
         self.a_x = 2
         self.N = N
-        c = np.exp(-self.a_x * np.linspace(0, 1, self.N))
-
-        sigma2 = np.power((np.diff(c) / 2), 2)
-        sigma2 = np.append(sigma2, sigma2[-1])
-        self.c = torch.from_numpy(c).float()
-        self.sigma2 = torch.from_numpy(sigma2).float()
+        c, sigma2 = basis_cache.centres(self.N, self.a_x)
+        self.c = torch.tensor(c).float()
+        self.sigma2 = torch.tensor(sigma2).float()
         self.tau = tau
         self.dt = dt
         self.time_steps = int(np.round(self.tau / self.dt))+1
@@ -185,14 +264,15 @@ class DMPParameters():
         self.x_max = torch.from_numpy(scale.x_max).float()
         self.x_min = torch.from_numpy(scale.x_min).float()
 
-        self.K = (self.x_max[1:55] - self.x_min[1:55]) / (self.y_max - self.y_min)
+        division = 1 + self.Dof*(self.N + 2)
+        self.K = (self.x_max[1:division] - self.x_min[1:division]) / (self.y_max - self.y_min)
 
-        scale_tensor = torch.cat((self.K,self.x_min[1:55],self.x_max[1:55],torch.tensor([self.y_max,self.y_min]).float()),0)
+        scale_tensor = torch.cat((self.K,self.x_min[1:division],self.x_max[1:division],torch.tensor([self.y_max,self.y_min]).float()),0)
 
         self.scale_tensor = scale_tensor
-        # precomputation
-        grad = torch.zeros((301, 27))
-
+        # including the tau column, for the 'tau' forward mode of DMPIntegrator
+        self.tau_scale_tensor = torch.cat(((self.x_max[0:division] - self.x_min[0:division]) / (self.y_max - self.y_min),
+                                           self.x_min[0:division],self.x_max[0:division],torch.tensor([self.y_max,self.y_min]).float()),0)
         self.data = {'time_steps':self.time_steps,'c':self.c,'sigma2':self.sigma2,'a_z':self.a_z,'a_x':self.a_x,'dt':self.dt,'Y':self.Y}
         dmp_data = torch.tensor([self.Dof,self.N,self.time_steps,self.dt,self.a_x,self.a_z])
         data_tensor = torch.cat((dmp_data,self.c,self.sigma2),0)
@@ -200,25 +280,13 @@ class DMPParameters():
         data_tensor.dy0 = self.dy0
         data_tensor.tau = self.tau
 
-        # for j in range(0, self.Dof):
-            # weights
-
-        for i in range(0, self.N):
-            weights = torch.zeros((1,self.N))
-            weights[0,i] = 1
-            grad[:, i  + 2 ] = integrate(data_tensor, weights, 0, 0, 0, self.tau)
-            # grad[:, i * self.Dof + 4 + j] = integrate(data_tensor, weights, 0, 0, 0, self.tau)
-
-        # start_point
-        weights = torch.zeros((1,self.N))
-        # grad[:, j] = integrate(data_tensor, weights, 1, 0, 0, self.tau)
-        grad[:, 0] = integrate(data_tensor, weights, 1, 0, 0, self.tau)
-
-        # goal
-
-        weights = torch.zeros((1,self.N))
-        # grad[:, j + self.Dof] = integrate(data_tensor, weights, 0, 0, 1, self.tau)
-        grad[:, 1] = integrate(data_tensor, weights, 0, 0, 1, self.tau)
+        # precomputation: the rollout Jacobian of one DOF, built once per
+        # process, or loaded from $IMEDNET_CACHE_DIR when another process
+        # already built it; every DMPParameters gets its own copy of the
+        # shared, read-only cached array
+        key = (self.N, float(self.tau), float(self.dt), self.a_x, self.a_z)
+        grad = torch.tensor(operator_cache.get('dmp_operator', key,
+                                               lambda: impulse_responses(data_tensor, self.tau).numpy()))
 
         '''
         self.c = self.c.cuda()
@@ -229,5 +297,5 @@ class DMPParameters():
         self.data_tensor = data_tensor
         self.grad_tensor = grad
 
-        self.point_grads = torch.zeros(54)
+        self.point_grads = torch.zeros(self.Dof*(self.N + 2))
         self.X = np.zeros((self.time_steps, self.Dof))
@@ -1,6 +1,12 @@
 import torch
 from torch.autograd import Function
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from imednet.utils.dmp_basis import basis_cache, operator_cache
+from imednet.utils.dmp_fused import fused_rollout
+from imednet.utils.dmp_sensitivity import tau_forward, tau_backward
+from imednet.utils.dmp_buckets import bucket_rollout, bucket_backward
 
 
 
@@ -8,49 +14,147 @@ import numpy as np
 
 
 class DMPIntegrator(Function):
+    """
+    CPU version of the DMP integration layer of dmp_layer.
+
+    Same inputs, outputs and gradients as the pycuda kernel, but for any
+    number of basis functions, DOF and time steps as given by the
+    DMPParameters data tensor: a [B x Dof*(N+2)] batch of scaled network
+    outputs is integrated into [Dof*B x T] trajectories (row 2b+dof for two
+    DOF). The batch is split over torch.get_num_threads() threads. With
+    time_indices (see time_subset) only those columns are computed, from
+    the matching rows of the rollout operator. The 'buckets' mode takes the
+    operators of dmp_buckets.TauBuckets as param_gradients and integrates
+    every sample with the one of its tau bucket.
+    """
 
     @staticmethod
-    def forward(ctx, inputs, parameters, param_gradients, scaling):
+    def forward(ctx, inputs, parameters, param_gradients, scaling, mode=None, time_indices=None,
+                buckets=None):
         ctx.param = parameters
         ctx.grad = param_gradients
+        ctx.mode = mode
+
+        if mode == 'tau':
+            # per-sample tau, scaling is DMPParameters.tau_scale_tensor
+            Y, ctx.jacobian, ctx.scale = tau_forward(inputs, parameters, scaling)
+            return inputs.new(Y)
 
-        division = 2*(int(parameters[1].item())+2)
+        dof = int(parameters[0].item())
+        n = int(parameters[1].item()) + 2
+        division = dof*n
         inputs_np = scaling[0:division] * (inputs - scaling[-1]) + scaling[division:division*2]
         ctx.scale = scaling[0:division]
 
-        w = torch.cat((inputs_np[:,range(2*int(parameters[0].item()),(2*int(parameters[0].item()) + int(parameters[1].item())*int(parameters[0].item()))-1,2)],
-                      inputs_np[:,range(1+2*int(parameters[0].item()),(2*int(parameters[0].item()) + int(parameters[1].item())*int(parameters[0].item())),2)]),1).view(-1,25)
-
-        X = integrate(parameters,w, inputs_np[:,range(0,int(parameters[0].item()))].view(int(parameters[0].item())*inputs.shape[0],), torch.zeros(inputs.shape[0]*int(parameters[0].item())).cuda(),
-                     inputs_np[:,range(int(parameters[0].item()),int(parameters[0].item())*2)].view(int(parameters[0].item())*inputs.shape[0],), 3)
-
+        if mode == 'buckets':
+            # durations snapped to tau buckets, param_gradients are the
+            # [K x T x (N+2)] TauBuckets.operators and buckets the bucket of every sample
+            if time_indices is not None:
+                param_gradients = param_gradients[:, time_indices]
+            ctx.grad = param_gradients
+            ctx.buckets = buckets
+            return inputs.new(bucket_rollout(inputs_np, parameters, param_gradients, buckets))
 
+        if time_indices is not None:
+            # only the rows of the rollout operator at the requested time steps,
+            # the backward pass then uses the same rows
+            if mode not in (None, 'operator'):
+                raise ValueError("time_indices need the default or the 'operator' forward mode")
+            param_gradients = param_gradients[time_indices]
+            ctx.grad = param_gradients
+            mode = 'operator'
 
+        if mode == 'operator':
+            return inputs.new(operator_rollout(inputs_np, parameters, param_gradients))
 
+        # [y0, goal, w] of every DOF in the row order of the kernel output
+        dmp_parameters = inputs_np.view(-1, n, dof).transpose(2, 1).contiguous().view(-1, n)
+        tau = (int(parameters[2].item()) - 1) * parameters[3].item()
 
+        if mode == 'fused':
+            return inputs.new(fused_rollout(parameters, dmp_parameters, tau))
 
-
-        return inputs.new(X)
+        return inputs.new(parallel_integrate(parameters, dmp_parameters, tau))
 
     @staticmethod
     def backward(ctx, grad_outputs):
         parameters = ctx.param
 
+        if ctx.mode == 'tau':
+            point_grads = tau_backward(grad_outputs, ctx.jacobian, ctx.scale, int(parameters[0].item()))
+            return grad_outputs.new(point_grads), None, None, None, None, None, None
+
         grad = ctx.grad
         scale = ctx.scale
 
-        point_grads = torch.mm(grad_outputs,grad).view(-1,2,27).transpose(2,1).contiguous().view(1,-1,54).squeeze()
+        dof = int(parameters[0].item())
+        n = int(parameters[1].item()) + 2
+        if ctx.mode == 'buckets':
+            row_grads = bucket_backward(grad_outputs, grad, ctx.buckets, dof)
+        else:
+            row_grads = torch.mm(grad_outputs,grad)
+        point_grads = row_grads.view(-1,dof,n).transpose(2,1).contiguous().view(-1,dof*n)
 
         # point_grads = 10*point_grads*scale*parameters[3].item()
         point_grads = point_grads * scale
 
-        return grad_outputs.new(point_grads), None, None, None
+        return grad_outputs.new(point_grads), None, None, None, None, None, None
+
+
+def parallel_integrate(parameters, dmp_parameters, tau, threads=None):
+    """
+    Euler rollout of a batch of [y0, goal, w] rows on several threads.
+
+    The rows are split into one chunk per thread and every chunk is run
+    through integrate; torch releases the GIL inside its operations, so
+    the chunks are integrated concurrently. Returns [rows x T] trajectories.
+    """
+    if threads is None:
+        threads = torch.get_num_threads()
+    chunks = dmp_parameters.split(max(1, int(np.ceil(dmp_parameters.shape[0] / float(threads)))))
+
+    def rollout(chunk):
+        return integrate(parameters, chunk[:, 2:], chunk[:, 0], 0, chunk[:, 1], tau)
+
+    if len(chunks) == 1:
+        return rollout(chunks[0])
+    with ThreadPoolExecutor(len(chunks)) as pool:
+        return torch.cat(list(pool.map(rollout, chunks)), 0)
+
+
+def operator_rollout(inputs_np, parameters, param_gradients):
+    """
+    Trajectories of a batch of DMPs as one matrix multiply.
+
+    For fixed tau and dt the Euler rollout is linear in (y0, goal, w), so
+    every trajectory is param_gradients (the [T x (N+2)] impulse responses
+    of DMPParameters) applied to its parameters. Returns the same
+    [Dof*B x T] layout as the integration kernel.
+    """
+    dof = int(parameters[0].item())
+    n = int(parameters[1].item()) + 2
+    dmp_parameters = inputs_np.view(-1, n, dof).transpose(2, 1).contiguous().view(-1, n)
+    return torch.mm(dmp_parameters, param_gradients.t())
+
 
+def time_subset(time_steps, K, random=False, generator=None):
+    """
+    K sorted time indices of a rollout for the time_indices of DMPIntegrator.
 
-def integrate(data, w, y0, dy0, goal, tau):
+    The first and the last time step are always included, the others are
+    evenly spaced or, with random=True, drawn without replacement.
+    """
+    if K >= time_steps:
+        return torch.arange(time_steps)
+    if not random:
+        return torch.linspace(0, time_steps - 1, K).round().long()
+    inner = torch.randperm(time_steps - 2, generator=generator)[:K - 2] + 1
+    return torch.cat((torch.tensor([0]), inner.sort()[0], torch.tensor([time_steps - 1])))
+
+
+def integrate(data, w, y0, dy0, goal, tau, tolerance=None):
     y = y0
     z = dy0 * tau
-    x = 1
 
     if w.is_cuda:
         # Y = torch.zeros((w.shape[0],int(data[2].item()))).cuda()
@@ -60,20 +164,24 @@ def integrate(data, w, y0, dy0, goal, tau):
 
     Y[:, 0] = y
 
-    for i in range(0, int(data[2].item())-1):
-        psi = torch.exp(-0.5 * torch.pow((x - data[6:(6+int(data[1].item()))]), 2) / data[(6+int(data[1].item())):(6+int(data[1].item())*2)])
-
-        # fx = torch.sum((w[3,:] * x) * psi) / torch.sum(psi)
-        fx = torch.mv(w*x, psi) / torch.sum(psi)
+    # forcing terms of all time steps at once from the cached basis
+    if tolerance is None:
+        x, psi = basis_cache.phase(int(data[1].item()), data[4].item(), float(tau), data[3].item())
+        psi = torch.from_numpy(x[:, None] * psi).float().to(w.device)
+        fx = torch.mm(w, psi.t())
+    else:
+        # only the kernels near the phase, see BasisCache.support
+        x, index, psi = basis_cache.truncated_phase(int(data[1].item()), data[4].item(), float(tau), data[3].item(), tolerance)
+        psi = torch.from_numpy(x[:, None] * psi).float().to(w.device)
+        fx = torch.sum(w[:, torch.from_numpy(index).to(w.device)] * psi, 2)
 
-        dx = (-data[4].item() * x) / tau
-        dz = data[5].item() * (data[5].item() / 4 * (goal - y) - z) + fx
+    for i in range(0, int(data[2].item())-1):
+        dz = data[5].item() * (data[5].item() / 4 * (goal - y) - z) + fx[:, i]
         dy = z
 
         dz = dz / tau
         dy = dy / tau
 
-        x = x + dx * data[3].item()
         y = y + dy * data[3].item()
         z = z + dz * data[3].item()
 
@@ -82,17 +190,27 @@ def integrate(data, w, y0, dy0, goal, tau):
     return Y
 
 
+def impulse_responses(data, tau):
+    """
+    Trajectories for a unit y0, a unit goal and every unit weight.
+
+    All N+2 impulse responses come from one batched call of integrate;
+    as the Euler rollout is linear in (y0, goal, w) they form its
+    [T x (N+2)] Jacobian.
+    """
+    N = int(data[1].item())
+    unit = torch.eye(N + 2)
+    return integrate(data, unit[:, 2:], unit[:, 0], 0, unit[:, 1], tau).t().contiguous()
+
+
 class DMPParameters():
     def __init__(self, N, tau, dt, Dof, scale):
         self.a_z = 48
         self.a_x = 2
         self.N = N
-        c = np.exp(-self.a_x * np.linspace(0, 1, self.N))
-
-        sigma2 = np.power((np.diff(c) / 2), 2)
-        sigma2 = np.append(sigma2, sigma2[-1])
-        self.c = torch.from_numpy(c).float()
-        self.sigma2 = torch.from_numpy(sigma2).float()
+        c, sigma2 = basis_cache.centres(self.N, self.a_x)
+        self.c = torch.tensor(c).float()
+        self.sigma2 = torch.tensor(sigma2).float()
         self.tau = tau
         self.dt = dt
         self.time_steps = int(np.round(self.tau / self.dt))+1
@@ -107,14 +225,15 @@ class DMPParameters():
         self.x_max = torch.from_numpy(scale.x_max).float()
         self.x_min = torch.from_numpy(scale.x_min).float()
 
-        self.K = (self.x_max[1:55] - self.x_min[1:55]) / (self.y_max - self.y_min)
+        division = 1 + self.Dof*(self.N + 2)
+        self.K = (self.x_max[1:division] - self.x_min[1:division]) / (self.y_max - self.y_min)
 
-        scale_tensor = torch.cat((self.K,self.x_min[1:55],self.x_max[1:55],torch.tensor([self.y_max,self.y_min]).float()),0)
+        scale_tensor = torch.cat((self.K,self.x_min[1:division],self.x_max[1:division],torch.tensor([self.y_max,self.y_min]).float()),0)
 
         self.scale_tensor = scale_tensor
-        # precomputation
-        grad = torch.zeros((301, 27))
-
+        # including the tau column, for the 'tau' forward mode of DMPIntegrator
+        self.tau_scale_tensor = torch.cat(((self.x_max[0:division] - self.x_min[0:division]) / (self.y_max - self.y_min),
+                                           self.x_min[0:division],self.x_max[0:division],torch.tensor([self.y_max,self.y_min]).float()),0)
         self.data = {'time_steps':self.time_steps,'c':self.c,'sigma2':self.sigma2,'a_z':self.a_z,'a_x':self.a_x,'dt':self.dt,'Y':self.Y}
         dmp_data = torch.tensor([self.Dof,self.N,self.time_steps,self.dt,self.a_x,self.a_z])
         data_tensor = torch.cat((dmp_data,self.c,self.sigma2),0)
@@ -122,25 +241,13 @@ class DMPParameters():
         data_tensor.dy0 = self.dy0
         data_tensor.tau = self.tau
 
-        # for j in range(0, self.Dof):
-            # weights
-
-        for i in range(0, self.N):
-            weights = torch.zeros((1,self.N))
-            weights[0,i] = 1
-            grad[:, i  + 2 ] = integrate(data_tensor, weights, 0, 0, 0, self.tau)
-            # grad[:, i * self.Dof + 4 + j] = integrate(data_tensor, weights, 0, 0, 0, self.tau)
-
-        # start_point
-        weights = torch.zeros((1,self.N))
-        # grad[:, j] = integrate(data_tensor, weights, 1, 0, 0, self.tau)
-        grad[:, 0] = integrate(data_tensor, weights, 1, 0, 0, self.tau)
-
-        # goal
-
-        weights = torch.zeros((1,self.N))
-        # grad[:, j + self.Dof] = integrate(data_tensor, weights, 0, 0, 1, self.tau)
-        grad[:, 1] = integrate(data_tensor, weights, 0, 0, 1, self.tau)
+        # precomputation: the rollout Jacobian of one DOF, built once per
+        # process, or loaded from $IMEDNET_CACHE_DIR when another process
+        # already built it; every DMPParameters gets its own copy of the
+        # shared, read-only cached array
+        key = (self.N, float(self.tau), float(self.dt), self.a_x, self.a_z)
+        grad = torch.tensor(operator_cache.get('dmp_operator', key,
+                                               lambda: impulse_responses(data_tensor, self.tau).numpy()))
 
         '''
         self.c = self.c.cuda()
@@ -151,5 +258,5 @@ class DMPParameters():
         self.data_tensor = data_tensor
         self.grad_tensor = grad
 
-        self.point_grads = torch.zeros(54)
+        self.point_grads = torch.zeros(self.Dof*(self.N + 2))
         self.X = np.zeros((self.time_steps, self.Dof))
@@ -0,0 +1,83 @@
+"""
+Trajectory MSE of the DMP layers evaluated in parameter space.
+
+For a fixed tau every output row of DMPIntegrator is G p, with G the
+[T x (N+2)] rollout operator (DMPParameters.grad_tensor) and p the
+[y0, goal, w] parameters of one DOF. Projecting a target trajectory y once
+onto q = argmin |G q - y| with residual e gives
+
+    |G p - y|^2 = (p - q)^T G^T G (p - q) + |e|^2
+
+so the MSE of the integrator output follows from the parameters and the
+(N+2) x (N+2) Gram matrix without building any trajectory.
+"""
+import numpy as np
+import torch
+
+
+def parameter_rows(inputs, parameters, scaling):
+    """
+    Unscaled [y0, goal, w] rows of a batch of network outputs.
+
+    # Arguments
+        inputs: [B x Dof*(N+2)] network outputs, as given to DMPIntegrator
+        parameters: DMPParameters.data_tensor
+        scaling: DMPParameters.scale_tensor
+
+    # Returns
+        [Dof*B x (N+2)] rows in the row order of the DMPIntegrator output
+    """
+    dof = int(parameters[0].item())
+    n = int(parameters[1].item()) + 2
+    division = dof*n
+    inputs_np = scaling[0:division] * (inputs - scaling[-1]) + scaling[division:division*2]
+    return inputs_np.view(-1, n, dof).transpose(2, 1).contiguous().view(-1, n)
+
+
+def project_trajectories(trajectories, grad_tensor):
+    """
+    Targets of GramMSELoss from target trajectories.
+
+    # Arguments
+        trajectories: [rows x T] array or tensor of DMPIntegrator targets
+        grad_tensor: [T x (N+2)] rollout operator
+
+    # Returns
+        [rows x (N+3)] float32 array, the least squares parameters q of
+        every row followed by its squared residual |G q - y|^2
+    """
+    G = np.asarray(torch.as_tensor(grad_tensor).cpu(), dtype=np.float64)
+    Y = np.asarray(torch.as_tensor(trajectories).cpu(), dtype=np.float64)
+    q = np.linalg.lstsq(G, Y.T, rcond=None)[0].T
+    residual = np.sum(np.power(q.dot(G.T) - Y, 2), axis=1)
+    return np.concatenate((q, residual[:, None]), axis=1).astype(np.float32)
+
+
+class GramMSELoss(torch.nn.Module):
+    def __init__(self, grad_tensor):
+        """
+        Mean squared trajectory error of [y0, goal, w] rows.
+
+        Equal to torch.nn.MSELoss between the DMPIntegrator output and the
+        trajectories the targets were projected from.
+
+        # Arguments
+            grad_tensor: [T x (N+2)] rollout operator of DMPParameters
+        """
+        super(GramMSELoss, self).__init__()
+        # kept in float64: targets far outside the operator range project
+        # to large weights along its small singular directions, and the
+        # quadratic form then cancels to a few digits in float32
+        grad = grad_tensor.double()
+        self.register_buffer('gram', grad.t().mm(grad))
+        self.time_steps = grad_tensor.shape[0]
+
+    def forward(self, rows, targets):
+        """
+        # Arguments
+            rows: [rows x (N+2)] predicted parameters, see parameter_rows
+            targets: [rows x (N+3)] projected targets, see project_trajectories
+        """
+        error = rows.double() - targets[:, :-1].double()
+        squared = (error.mm(self.gram) * error).sum() + targets[:, -1].double().sum()
+        return (squared / (rows.shape[0] * self.time_steps)).to(rows.dtype)
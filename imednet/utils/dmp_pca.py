@@ -0,0 +1,111 @@
+"""
+Output head that predicts principal-component coefficients of the DMP weights.
+
+The N*Dof weights of the S-MNIST DMPs are strongly correlated, so a model
+can predict y0, goal and k << N*Dof coefficients of a principal-component
+basis of the training weights instead. The basis, the output scaling and
+the [T x (N+2)] rollout operator of DMPParameters are all linear, so they
+are folded into one [(2*Dof+k) x Dof*T] operator and a bias: the head goes
+from its k coefficients to trajectories with a single matrix multiply.
+"""
+import numpy as np
+import torch
+
+
+class WeightBasis(object):
+    def __init__(self, mean, components, std, explained):
+        """
+        Principal components of unscaled DMP weights.
+
+        # Arguments
+            mean: [N*Dof] mean weights, interleaved by DOF like the outputs
+            components: [N*Dof x k] orthonormal principal directions
+            std: [k] standard deviation of the coefficients
+            explained: [k] fraction of the weight variance of every component
+        """
+        self.mean = mean
+        self.components = components
+        self.std = std
+        self.explained = explained
+
+    @classmethod
+    def from_outputs(cls, outputs, scale, k, dof=2):
+        """
+        Basis of the first k components of scaled [tau, y0, goal, w] outputs.
+
+        # Arguments
+            outputs: [B x (1+Dof*(N+2))] training outputs as given by MatLoader.load_data
+            scale: the Mapping that scaled them
+            k: number of components
+        """
+        outputs = np.asarray(outputs, dtype=np.float64)
+        x_max = np.asarray(scale.x_max, dtype=np.float64)
+        x_min = np.asarray(scale.x_min, dtype=np.float64)
+        unscaled = (x_max - x_min) * (outputs - scale.y_min) / (scale.y_max - scale.y_min) + x_min
+        w = unscaled[:, 1+2*dof:]
+        mean = w.mean(0)
+        _, s, vt = np.linalg.svd(w - mean, full_matrices=False)
+        variance = np.power(s, 2) / max(len(w) - 1, 1)
+        std = np.sqrt(variance[:k])
+        return cls(mean, vt[:k].T, np.where(std > 0, std, 1.0), variance[:k] / variance.sum())
+
+    def __len__(self):
+        return self.components.shape[1]
+
+
+class PCAWeightHead(torch.nn.Module):
+    def __init__(self, basis, dmp_params):
+        """
+        Trajectories from [y0, goal, coefficient] outputs.
+
+        The outputs are y0 and goal scaled like the DMPIntegrator inputs and
+        the principal-component coefficients divided by their standard
+        deviation, followed by a rollout with the operator of dmp_params.
+
+        # Arguments
+            basis: WeightBasis of the training weights
+            dmp_params: DMPParameters of the model
+        """
+        super(PCAWeightHead, self).__init__()
+        dof = dmp_params.Dof
+        G = dmp_params.grad_tensor.double()
+        T = G.shape[0]
+        k = len(basis)
+
+        # unscaled = K*(output - y_min) + x_min for y0 and goal, see DMPParameters.scale_tensor
+        K = dmp_params.K[0:2*dof].double()
+        offset = dmp_params.x_min[1:1+2*dof].double() - K * dmp_params.y_min
+        components = torch.from_numpy(basis.components * basis.std)
+        mean = torch.from_numpy(basis.mean)
+
+        operator = G.new_zeros((2*dof + k, dof, T))
+        bias = G.new_zeros((dof, T))
+        for d in range(dof):
+            operator[d, d] = K[d] * G[:, 0]
+            operator[dof + d, d] = K[dof + d] * G[:, 1]
+            operator[2*dof:, d] = components[d::dof].t().mm(G[:, 2:].t())
+            bias[d] = offset[d] * G[:, 0] + offset[dof + d] * G[:, 1] + G[:, 2:].mv(mean[d::dof])
+
+        self.dof = dof
+        self.register_buffer('operator', operator.view(2*dof + k, dof*T).float())
+        self.register_buffer('bias', bias.view(-1).float())
+
+    @property
+    def size(self):
+        """Number of outputs the layer before the head has to produce."""
+        return self.operator.shape[0]
+
+    def forward(self, x, time_indices=None):
+        """
+        # Arguments
+            x: [B x (2*Dof+k)] outputs
+            time_indices: only these time steps, see DMPIntegrator
+
+        # Returns
+            [Dof*B x T] trajectories in the layout of the DMPIntegrator output
+        """
+        if time_indices is None:
+            return torch.addmm(self.bias, x, self.operator).view(-1, self.bias.shape[0] // self.dof)
+        operator = self.operator.view(self.size, self.dof, -1)[:, :, time_indices]
+        bias = self.bias.view(self.dof, -1)[:, time_indices]
+        return torch.addmm(bias.reshape(-1), x, operator.reshape(self.size, -1)).view(-1, bias.shape[1])
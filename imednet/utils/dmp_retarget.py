@@ -0,0 +1,43 @@
+"""
+Re-targeting of predicted DMPs to new start and goal positions.
+
+For a fixed tau the Euler rollout is linear in [y0, goal, w]: every
+trajectory is G_w w + g_y0 y0 + g_goal goal with the columns of
+DMPParameters.grad_tensor. The weight-driven part G_w w is computed once per
+predicted DMP and shared by all new (y0, goal) pairs, whose contribution is
+a single [.. x 2] by [2 x T] matrix multiply, so no network pass, create_dmp
+or DMP.joint is needed to replay a prediction elsewhere.
+"""
+import torch
+
+
+def retarget(rows, grad_tensor, y0=None, goal=None, dof=2):
+    """
+    Trajectories of predicted DMPs for a batch of new start and goal positions.
+
+    # Arguments
+        rows: [Dof*B x (N+2)] [y0, goal, w] rows of the predicted DMPs in the
+              row order of the DMPIntegrator output, see dmp_loss.parameter_rows
+        grad_tensor: [T x (N+2)] rollout operator of DMPParameters
+        y0: [M x Dof] start positions applied to every DMP or [B x M x Dof]
+            ones per DMP, the predicted start when None
+        goal: goal positions of the same shapes as y0, the predicted goal
+              when None
+
+    # Returns
+        [B x M x Dof x T] re-targeted trajectories
+    """
+    B = rows.shape[0] // dof
+    grad_tensor = grad_tensor.to(rows)
+    shared = rows[:, 2:].mm(grad_tensor[:, 2:].t()).view(B, 1, dof, -1)
+    predicted = rows[:, :2].view(B, 1, dof, 2)
+    starts = predicted[..., 0] if y0 is None else _positions(y0, rows)
+    goals = predicted[..., 1] if goal is None else _positions(goal, rows)
+    ends = torch.stack(torch.broadcast_tensors(starts, goals), -1)
+    return shared + ends.matmul(grad_tensor[:, :2].t())
+
+
+def _positions(positions, rows):
+    """[M x Dof] or [B x M x Dof] positions as a tensor that broadcasts over B."""
+    positions = torch.as_tensor(positions).to(rows)
+    return positions[None] if positions.dim() == 2 else positions
@@ -0,0 +1,127 @@
+"""
+DMP rollout with per-sample tau and forward sensitivities.
+
+The precomputed grad_tensor of DMPParameters is the Jacobian of the Euler
+rollout for its single tau. With a different tau for every sample the
+Jacobian differs per sample, so here it is propagated alongside the
+rollout: every step updates the derivatives of y and z with respect to
+[tau, y0, goal, w] from the same linearized Euler step, which gives the
+exact gradient of the discrete rollout without unrolling autograd through
+all time steps.
+"""
+import torch
+
+
+def sensitivity_rollout(parameters, dmp_parameters, tau):
+    """
+    Euler rollout of [y0, goal, w] rows with their own tau and its Jacobian.
+
+    All rows are integrated for the time_steps and dt of the data tensor, so
+    the horizon is fixed: rows with a shorter tau settle at their goal,
+    rows with a longer one are cut off.
+
+    # Arguments
+        parameters: DMPParameters.data_tensor [Dof, N, time_steps, dt, a_x, a_z, c, sigma2]
+        dmp_parameters: [rows x (N+2)] tensor of [y0, goal, w] rows
+        tau: [rows] durations
+
+    # Returns
+        Y: [rows x time_steps] trajectories
+        J: [rows x time_steps x (N+3)] derivatives of Y with respect to
+           [tau, y0, goal, w]
+    """
+    N = int(parameters[1].item())
+    time_steps = int(parameters[2].item())
+    dt = parameters[3].item()
+    a_x = parameters[4].item()
+    a_z = parameters[5].item()
+    c = parameters[6:6+N].to(dmp_parameters)
+    sigma2 = parameters[6+N:6+2*N].to(dmp_parameters)
+
+    rows = dmp_parameters.shape[0]
+    y = dmp_parameters[:, 0]
+    goal = dmp_parameters[:, 1]
+    w = dmp_parameters[:, 2:]
+    z = torch.zeros_like(y)
+    x = torch.ones_like(y)
+    u = dt / tau
+
+    # d/dtau of x, y, z and d/d[y0, goal, w] of y and z
+    x_tau = torch.zeros_like(y)
+    y_tau = torch.zeros_like(y)
+    z_tau = torch.zeros_like(y)
+    y_theta = dmp_parameters.new_zeros((rows, N + 2))
+    y_theta[:, 0] = 1
+    z_theta = torch.zeros_like(y_theta)
+    goal_theta = torch.zeros_like(y_theta)
+    goal_theta[:, 1] = 1
+
+    Y = dmp_parameters.new_empty((rows, time_steps))
+    J = dmp_parameters.new_empty((rows, time_steps, N + 3))
+    Y[:, 0] = y
+    J[:, 0, 0] = y_tau
+    J[:, 0, 1:] = y_theta
+
+    for i in range(time_steps - 1):
+        psi = torch.exp(-0.5 * (x[:, None] - c) ** 2 / sigma2)
+        phi = psi / psi.sum(1, keepdim=True)
+        basis = x[:, None] * phi
+        fx = (w * basis).sum(1)
+
+        # d fx / d x, with d log(psi_k) / d x = -(x - c_k) / sigma2_k
+        slope = -(x[:, None] - c) / sigma2
+        w_phi = (w * phi).sum(1)
+        fx_x = w_phi + x * ((w * phi * slope).sum(1) - w_phi * (phi * slope).sum(1))
+
+        a = a_z * (a_z / 4 * (goal - y) - z) + fx
+        a_tau = a_z * (-a_z / 4 * y_tau - z_tau) + fx_x * x_tau
+        a_theta = a_z * (a_z / 4 * (goal_theta - y_theta) - z_theta)
+        a_theta[:, 2:] += basis
+
+        # u = dt/tau, so du/dtau = -u/tau
+        y_tau = y_tau + (z_tau - z / tau) * u
+        z_tau = z_tau + (a_tau - a / tau) * u
+        x_tau = x_tau - a_x * (x_tau - x / tau) * u
+        y_theta.addcmul_(z_theta, u[:, None])
+        z_theta.addcmul_(a_theta, u[:, None])
+
+        y = y + z * u
+        z = z + a * u
+        x = x - a_x * x * u
+
+        Y[:, i + 1] = y
+        J[:, i + 1, 0] = y_tau
+        J[:, i + 1, 1:] = y_theta
+
+    return Y, J
+
+
+def tau_forward(inputs, parameters, scaling):
+    """
+    The 'tau' forward mode of the DMP layers.
+
+    inputs are [B x (1+Dof*(N+2))] network outputs [tau, y0, goal, w] and
+    scaling the DMPParameters.tau_scale_tensor that maps them back.
+
+    # Returns
+        Y: [Dof*B x time_steps] trajectories in the layout of the kernel
+        J: [Dof*B x time_steps x (N+3)] their Jacobian, see sensitivity_rollout
+        scale: derivative of the unscaled inputs with respect to the inputs
+    """
+    dof = int(parameters[0].item())
+    n = int(parameters[1].item()) + 2
+    division = 1 + dof*n
+    inputs_np = scaling[0:division] * (inputs - scaling[-1]) + scaling[division:division*2]
+
+    tau = inputs_np[:, 0].repeat_interleave(dof)
+    dmp_parameters = inputs_np[:, 1:].contiguous().view(-1, n, dof).transpose(2, 1).contiguous().view(-1, n)
+    Y, J = sensitivity_rollout(parameters, dmp_parameters, tau)
+    return Y, J, scaling[0:division]
+
+
+def tau_backward(grad_outputs, J, scale, dof):
+    """Gradients of the inputs of tau_forward from those of its trajectories."""
+    grads = torch.bmm(grad_outputs[:, None, :], J)[:, 0].view(-1, dof, J.shape[2])
+    tau_grads = grads[:, :, 0].sum(1, keepdim=True)
+    point_grads = grads[:, :, 1:].transpose(2, 1).contiguous().view(grads.shape[0], -1)
+    return torch.cat((tau_grads, point_grads), 1) * scale
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Check and time data-parallel training on CPU processes.
+
+Trains a DMPEncoderDecoderNet with Trainer.train_dmp (or an
+EncoderDecoderNet with Trainer.train) on synthetic S-MNIST sized data, once
+in this process and then data-parallel with imednet.trainers.distributed
+.launch on several numbers of processes. Every run starts from the same
+parameters, split and shuffling. All processes have to end with exactly
+the same parameters, and the training loss and parameters are compared to
+the single process; they differ by the float32 rounding of the all-reduced
+gradients, which Adam and SCG carry on from step to step.
+"""
+from __future__ import print_function
+
+import io
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import torch
+import torch.distributed as dist
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.models.encoder_decoder import DMPEncoderDecoderNet, EncoderDecoderNet, TrainingParameters
+from imednet.trainers.distributed import launch, world_size
+from imednet.trainers.encoder_decoder_trainer import Trainer
+
+
+# Parse arguments
+description = 'Check and time data-parallel training on CPU processes.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--method', type=str, default='train_dmp', choices=['train', 'train_dmp'],
+                    help='Trainer method (default: train_dmp)')
+parser.add_argument('--optimizer', type=str, default='customadam',
+                    help='optimizer (default: customadam)')
+parser.add_argument('--data-size', type=int, default=2000,
+                    help='number of samples (default: 2000)')
+parser.add_argument('--batch-size', type=int, default=140,
+                    help='batch size (default: 140)')
+parser.add_argument('--epochs', type=int, default=3,
+                    help='epochs (default: 3)')
+parser.add_argument('--processes', nargs='+', type=int, default=[2, 4],
+                    help='numbers of processes (default: 2 4)')
+args = parser.parse_args()
+
+rng = np.random.RandomState(0)
+images = rng.randint(0, 256, (args.data_size, 1600)).astype(np.uint8)
+# the split of Trainer.split_dataset, the same in every run
+train_size, test_size = round(0.7 * args.data_size), round(0.15 * args.data_size)
+indeks = rng.permutation(np.repeat([0.0, 1.0, 2.0], [train_size, test_size, args.data_size - train_size - test_size]))
+
+torch.manual_seed(0)
+if args.method == 'train_dmp':
+    scale = Mapping()
+    scale.x_max = np.concatenate(([3.0], 40 * np.ones(4), 500 * np.ones(50)))
+    scale.x_min = -scale.x_max
+    model = DMPEncoderDecoderNet([1600, 200, 54], None, scale)
+    model.register_buffer('DMPp', model.DMPparam.data_tensor)
+    model.register_buffer('scale_t', model.DMPparam.scale_tensor)
+    model.register_buffer('param_grad', model.DMPparam.grad_tensor)
+    outputs = 40 * rng.rand(2 * args.data_size, model.param_grad.shape[0])
+else:
+    model = EncoderDecoderNet([1600, 200, 54])
+    outputs = 2 * rng.rand(args.data_size, 55) - 1
+initial = {k: v.clone() for k, v in model.state_dict().items()}
+
+path = tempfile.mkdtemp()
+try:
+    def train():
+        model.load_state_dict(initial)
+        torch.manual_seed(1)
+        trainer = Trainer()
+        trainer.indeks = indeks.tolist()
+        train_param = TrainingParameters()
+        train_param.cuda = False
+        train_param.epochs = args.epochs - 1
+        train_param.batch_size = args.batch_size
+        start = time.perf_counter()
+        best = getattr(trainer, args.method)(model, images, outputs, path, train_param, io.StringIO(),
+                                             optimizer_type=args.optimizer)
+        elapsed = time.perf_counter() - start
+
+        # the largest difference of the parameters between the processes
+        spread = 0.0
+        if world_size() > 1:
+            high = torch.cat([v.double().reshape(-1) for v in model.state_dict().values()])
+            low = high.clone()
+            dist.all_reduce(high, dist.ReduceOp.MAX)
+            dist.all_reduce(low, dist.ReduceOp.MIN)
+            spread = (high - low).max().item()
+        return best, trainer.loss.item(), spread, elapsed
+
+    print('{} with {}, {} samples, {} threads'.format(args.method, args.optimizer, args.data_size,
+                                                      torch.get_num_threads()))
+    # the first run builds the cached DMP operators, the forked processes inherit them
+    train()
+    reference, reference_loss, _, elapsed = train()
+    results = [(1, elapsed, 0.0, 0.0, 0.0)]
+    for processes in args.processes:
+        best, loss, spread, elapsed = launch(train, processes)
+        difference = max((best[k].double() - reference[k].double()).abs().max().item() for k in reference)
+        results.append((processes, elapsed, spread, abs(loss - reference_loss) / reference_loss, difference))
+
+    print('{:>10} {:>10} {:>8} {:>14} {:>16} {:>22}'.format('processes', 'epoch [s]', 'speedup', 'rank spread',
+                                                            'loss difference', 'parameter difference'))
+    for processes, elapsed, spread, error, difference in results:
+        print('{:>10} {:>10.2f} {:>8.2f} {:>14.1e} {:>16.3e} {:>22.3e}'.format(
+            processes, elapsed / args.epochs, results[0][1] / elapsed, spread, error, difference))
+finally:
+    shutil.rmtree(path, ignore_errors=True)
+
+if max(result[2] for result in results) > 0:
+    print('FAILED: the processes ended with different parameters')
+    sys.exit(1)
+print('OK')
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Epoch time and peak memory of the index-based dataset splits.
+
+Runs the data handling of Trainer.train_dmp on synthetic S-MNIST sized data
+with a linear model: the former list-built split_dataset, per-epoch clones
+of all six split tensors and permuted full copies, against
+imednet.data.dataset_views.split_views with per-batch gathers. Every
+variant runs in a fresh process, the peak memory is the growth of the
+resident set size over the raw data.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import random
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+import torch
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.dataset_views import split_views
+
+
+def legacy_split(images, outputs, indeks):
+    """split_dataset before the index-based views."""
+    de = int(len(outputs) / len(images))
+    x_t, y_t, x_v, y_v, x_te, y_te = [], [], [], [], [], []
+    for i in range(0, len(indeks)):
+        x, y = {0: (x_t, y_t), 1: (x_te, y_te), 2: (x_v, y_v)}[indeks[i]]
+        x.append(images[i])
+        y.append(outputs[i * de])
+        if de > 1:
+            y.append(outputs[i * de + 1])
+    return tuple(torch.from_numpy(np.array(d)).float() for d in (x_t, y_t, x_te, y_te, x_v, y_v))
+
+
+def run(variant, args, queue):
+    torch.set_num_threads(1)
+    rng = np.random.RandomState(0)
+    images = rng.rand(args.data_size, args.image_size)
+    outputs = rng.rand(2 * args.data_size, args.time_steps)
+    indeks = np.append(np.zeros(round(0.7 * args.data_size)), np.ones(round(0.15 * args.data_size)))
+    indeks = np.append(indeks, 2 * np.ones(args.data_size - len(indeks)))
+    random.Random(0).shuffle(indeks)
+    model = torch.nn.Linear(args.image_size, 2 * args.time_steps)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    split = legacy_split if variant == 'legacy' else split_views
+    x_train_b, y_train_b, x_test_b, y_test_b, x_validate_b, y_validate_b = split(images, outputs, indeks)
+    split_time = time.perf_counter() - start
+
+    epoch_times = []
+    for epoch in range(args.epochs):
+        start = time.perf_counter()
+        if variant == 'legacy':
+            x_train, y_train = x_train_b.clone(), y_train_b.clone()
+            x_test, y_test = x_test_b.clone(), y_test_b.clone()
+            x_validate, y_validate = x_validate_b.clone(), y_validate_b.clone()
+            permutations = torch.randperm(len(x_train))
+            per = torch.stack([permutations * 2, permutations * 2 + 1]).transpose(1, 0).contiguous().view(-1)
+            x_train, y_train = x_train[permutations], y_train[per]
+            batches = [(x_train[i:i + args.batch_size], y_train[2 * i:2 * (i + args.batch_size)])
+                       for i in range(0, len(x_train), args.batch_size)]
+        else:
+            x_test, y_test, x_validate, y_validate = x_test_b, y_test_b, x_validate_b, y_validate_b
+            permutations = torch.randperm(len(x_train_b))
+            per = torch.stack([permutations * 2, permutations * 2 + 1]).transpose(1, 0).contiguous().view(-1)
+            batches = ((x_train_b[permutations[i:i + args.batch_size]], y_train_b[per[2 * i:2 * (i + args.batch_size)]])
+                       for i in range(0, len(x_train_b), args.batch_size))
+        with torch.no_grad():
+            for x, y in batches:
+                (model(x).view(-1, args.time_steps) - y).pow(2).mean()
+            (model(x_validate).view(-1, args.time_steps) - y_validate).pow(2).mean()
+            (model(x_test).view(-1, args.time_steps) - y_test).pow(2).mean()
+        epoch_times.append(time.perf_counter() - start)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    queue.put((split_time, np.median(epoch_times), peak / 1024.0,
+               sum(float(d.sum()) for d in (x_train_b, y_train_b, x_test_b, y_test_b, x_validate_b, y_validate_b))))
+
+
+if __name__ == '__main__':
+    # Parse arguments
+    description = 'Epoch time and peak memory of the index-based dataset splits.'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--data-size', type=int, default=20000,
+                        help='number of samples (default: 20000)')
+    parser.add_argument('--image-size', type=int, default=784,
+                        help='pixels per image (default: 784)')
+    parser.add_argument('--time-steps', type=int, default=301,
+                        help='time steps per output row (default: 301)')
+    parser.add_argument('--batch-size', type=int, default=140,
+                        help='batch size (default: 140)')
+    parser.add_argument('--epochs', type=int, default=5,
+                        help='epochs to time (default: 5)')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for variant in ('legacy', 'views'):
+        queue = context.Queue()
+        process = context.Process(target=run, args=(variant, args, queue))
+        process.start()
+        results[variant] = queue.get()
+        process.join()
+
+    data_mb = (args.data_size * (args.image_size + 2 * args.time_steps)) * 8 / 2.0**20
+    print('Raw data: {:.1f} MB float64'.format(data_mb))
+    print('{:>8} {:>12} {:>16} {:>16}'.format('', 'split [s]', 'epoch [ms]', 'peak growth [MB]'))
+    for variant in ('legacy', 'views'):
+        split_time, epoch_time, peak, _ = results[variant]
+        print('{:>8} {:>12.3f} {:>16.1f} {:>16.1f}'.format(variant, split_time, 1e3 * epoch_time, peak))
+    if results['legacy'][3] != results['views'][3]:
+        print('FAILED: the splits hold different data')
+        sys.exit(1)
+    print('OK')
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Check and time the recursive-least-squares DMP fitter.
+
+Streams a recorded demonstration sample by sample into
+imednet.utils.dmp_class.DMPFitter, compares the final weights with
+DMP.track on the whole recording and reports the time per sample against
+the time track needs once the recording has ended.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.utils import dmp_batch
+from imednet.utils.dmp_class import DMP, DMPFitter
+
+# Parse arguments
+description = 'Check and time the recursive-least-squares DMP fitter.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--samples', type=int, default=1000,
+                    help='number of samples of the demonstration (default: 1000)')
+parser.add_argument('--dof', type=int, default=2,
+                    help='degrees of freedom (default: 2)')
+parser.add_argument('--tolerance', type=float, default=1e-4,
+                    help='largest allowed relative weight difference (default: 1e-4)')
+args = parser.parse_args()
+
+N = 25
+rng = np.random.RandomState(0)
+
+# A smooth demonstration with slightly irregular time stamps
+t = np.cumsum(np.r_[0, rng.uniform(0.8, 1.2, args.samples - 1)])
+t = 3 * t / t[-1]
+s = t / t[-1]
+y = sum(rng.randn(args.dof) * np.sin(np.pi * f * s[:, None] + rng.rand(args.dof)) / f for f in range(1, 6))
+trajectory = np.column_stack((10 * y, t))
+
+# DMP.track once the whole recording is there, on the derivatives of Trainer.create_dmps
+start = time.perf_counter()
+t_d, y_d, yd_d, ydd_d, _ = dmp_batch.derivatives([trajectory])
+reference = DMP(N, 0.01)
+reference.track(np.repeat(t_d[0][:, None], args.dof, axis=1), y_d[0], yd_d[0], ydd_d[0])
+track_time = time.perf_counter() - start
+
+# The fitter during the recording, tau being the duration track finds
+fitter = DMPFitter(N, 0.01, t_d[0, -1], args.dof)
+updates = np.zeros(args.samples)
+for i in range(args.samples):
+    start = time.perf_counter()
+    fitter.add(trajectory[i, -1], trajectory[i, :-1])
+    updates[i] = time.perf_counter() - start
+start = time.perf_counter()
+dmp = fitter.dmp()
+finish_time = time.perf_counter() - start
+
+error = np.abs(dmp.w - reference.w).max() / np.abs(reference.w).max()
+print('Relative weight difference to DMP.track: {:.3e}'.format(error))
+print('Goal, y0, dy0 differences: {:.3e} {:.3e} {:.3e}'.format(np.abs(dmp.goal - reference.goal).max(),
+                                                              np.abs(dmp.y0 - reference.y0).max(),
+                                                              np.abs(dmp.dy0 - reference.dy0).max()))
+print('Per sample: {:.1f} us mean, {:.1f} us max'.format(1e6 * updates.mean(), 1e6 * updates.max()))
+print('After the last sample: fitter {:.2f} ms, DMP.track {:.2f} ms'.format(1e3 * finish_time, 1e3 * track_time))
+if error > args.tolerance:
+    print('FAILED: difference above tolerance {}'.format(args.tolerance))
+    sys.exit(1)
+print('OK')
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Check and time the TorchScript DMP rollout kernel.
+
+Compares imednet.utils.dmp_fused.fused_rollout with the Python integrate
+loop of the CPU DMP layer for 2, 3 and 7 DOF (sizes taken from
+DMPParameters) and reports the largest difference and the time per batch
+for different numbers of parallel tasks.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import torch
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils.dmp_fused import fused_rollout
+from imednet.utils.dmp_layer_no_cuda import DMPParameters, integrate
+
+# Parse arguments
+description = 'Check and time the TorchScript DMP rollout kernel.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--batch-size', type=int, default=1024,
+                    help='number of DMPs per batch (default: 1024)')
+parser.add_argument('--basis', type=int, default=25,
+                    help='number of basis functions (default: 25)')
+parser.add_argument('--dof', nargs='+', type=int, default=[2, 3, 7],
+                    help='degrees of freedom to test (default: 2 3 7)')
+parser.add_argument('--tasks', nargs='+', type=int, default=None,
+                    help='parallel tasks to time (default: 1 and torch.get_num_interop_threads())')
+parser.add_argument('--repeats', type=int, default=5,
+                    help='number of timed repetitions (default: 5)')
+parser.add_argument('--tolerance', type=float, default=1e-4,
+                    help='largest allowed relative difference (default: 1e-4)')
+args = parser.parse_args()
+
+def timed(f):
+    # the first calls also let TorchScript optimize the graph
+    for _ in range(3):
+        f()
+    start = time.time()
+    for _ in range(args.repeats):
+        result = f()
+    return result, (time.time() - start)/args.repeats
+
+torch.manual_seed(0)
+N = args.basis
+tau = 3
+failed = False
+for dof in args.dof:
+    scale = Mapping()
+    scale.x_max = np.concatenate(([tau], 30*np.ones(2*dof), 2000*np.ones(N*dof)))
+    scale.x_min = np.concatenate(([tau], -30*np.ones(2*dof), -2000*np.ones(N*dof)))
+    scale.y_max = 1
+    scale.y_min = -1
+    params = DMPParameters(N, tau, 0.01, dof, scale)
+
+    # [y0, goal, w] rows of every DOF as the DMP layers build them
+    division = dof*(N+2)
+    inputs = 2*torch.rand(args.batch_size, division) - 1
+    scaling = params.scale_tensor
+    rows = (scaling[0:division] * (inputs - scaling[-1]) + scaling[division:division*2])
+    rows = rows.view(-1, N+2, dof).transpose(2, 1).contiguous().view(-1, N+2)
+
+    reference, integrate_time = timed(lambda: integrate(params.data_tensor, rows[:, 2:], rows[:, 0], 0, rows[:, 1], tau))
+    print('DOF: {}, {} rows, {} time steps'.format(dof, rows.shape[0], reference.shape[1]))
+    print('  integrate:          {:.5f} s/batch'.format(integrate_time))
+    for tasks in args.tasks or sorted({1, torch.get_num_interop_threads()}):
+        fused, fused_time = timed(lambda: fused_rollout(params.data_tensor, rows, tau, tasks))
+        error = ((fused - reference).abs().max() / reference.abs().max()).item()
+        print('  fused, {} task(s):   {:.5f} s/batch ({:.1f}x), relative difference {:.3e}'.format(
+            tasks, fused_time, integrate_time/fused_time, error))
+        failed = failed or error > args.tolerance
+
+if failed:
+    print('FAILED: difference above tolerance {}'.format(args.tolerance))
+    sys.exit(1)
+print('OK')
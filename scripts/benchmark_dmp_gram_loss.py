@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Check and time the parameter-space trajectory loss.
+
+Compares the loss and gradients of dmp_loss.GramMSELoss on projected targets
+with torch.nn.MSELoss on the DMPIntegrator trajectories (the train_dmp loss)
+for random network outputs and target trajectories, then times both.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import torch
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator, DMPParameters
+from imednet.utils.dmp_loss import GramMSELoss, parameter_rows, project_trajectories
+
+# Parse arguments
+description = 'Check and time the parameter-space trajectory loss.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--batch-size', type=int, default=1024,
+                    help='number of DMPs per batch (default: 1024)')
+parser.add_argument('--noise', type=float, default=0.5,
+                    help='noise added to the targets so they leave the operator range (default: 0.5)')
+parser.add_argument('--tolerance', type=float, default=1e-4,
+                    help='largest allowed relative difference (default: 1e-4)')
+args = parser.parse_args()
+
+N = 25
+dof = 2
+division = dof*(N+2)
+
+# Scaling similar to the S-MNIST datasets
+scale = Mapping()
+scale.x_max = np.concatenate(([3], 30*np.ones(2*dof), 2000*np.ones(N*dof)))
+scale.x_min = np.concatenate(([3], -30*np.ones(2*dof), -2000*np.ones(N*dof)))
+scale.y_max = 1
+scale.y_min = -1
+params = DMPParameters(N, 3, 0.01, dof, scale)
+
+torch.manual_seed(0)
+with torch.no_grad():
+    targets = DMPIntegrator.apply(2*torch.rand(args.batch_size, division) - 1, params.data_tensor,
+                                  params.grad_tensor, params.scale_tensor)
+    targets = targets + args.noise * torch.randn_like(targets)
+projected = torch.from_numpy(project_trajectories(targets, params.grad_tensor))
+outputs = (2*torch.rand(args.batch_size, division) - 1).requires_grad_()
+
+def trajectory_loss():
+    trajectories = DMPIntegrator.apply(outputs, params.data_tensor, params.grad_tensor, params.scale_tensor)
+    return torch.nn.MSELoss()(trajectories, targets)
+
+gram_criterion = GramMSELoss(params.grad_tensor)
+def gram_loss():
+    return gram_criterion(parameter_rows(outputs, params.data_tensor, params.scale_tensor), projected)
+
+def timed(f):
+    start = time.time()
+    loss = f()
+    grad, = torch.autograd.grad(loss, outputs)
+    return loss.item(), grad, time.time() - start
+
+loss, grad, trajectory_time = timed(trajectory_loss)
+gram, gram_grad, gram_time = timed(gram_loss)
+loss_error = abs(gram - loss) / loss
+grad_error = ((gram_grad - grad).abs().max() / grad.abs().max()).item()
+
+print('Batch size: {}, target size {} -> {} values per row'.format(args.batch_size, targets.shape[1],
+                                                                  projected.shape[1]))
+print('MSE of trajectories:  {:.6f} ({:.4f} s)'.format(loss, trajectory_time))
+print('Gram-matrix MSE:      {:.6f} ({:.4f} s)'.format(gram, gram_time))
+print('Relative difference: loss {:.3e}, gradient {:.3e}'.format(loss_error, grad_error))
+if loss_error > args.tolerance or grad_error > args.tolerance:
+    print('FAILED: difference above tolerance {}'.format(args.tolerance))
+    sys.exit(1)
+print('OK')
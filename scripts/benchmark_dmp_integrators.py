@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Compare the accuracy and speed of the DMP rollout integrators.
+
+Rolls out random DMPs with every integrator of imednet.utils.dmp_batch.joint,
+with integrated and analytic phase, for several time steps and reports the
+position error against a fine RK4 reference and the wall time per batch.
+Fails unless RK4 with a 5x larger time step is at least as accurate as
+Euler at --target-dt and the semi-implicit rollout stays bounded at every
+time step.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.utils.dmp_batch import joint, INTEGRATORS
+
+# Parse arguments
+description = 'Compare the accuracy and speed of the DMP rollout integrators.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--batch-size', type=int, default=64,
+                    help='number of random DMPs (default: 64)')
+parser.add_argument('--time-steps', nargs='+', type=float, default=[0.01, 0.02, 0.05, 0.1],
+                    help='time steps to test (default: 0.01 0.02 0.05 0.1)')
+parser.add_argument('--target-dt', type=float, default=0.01,
+                    help='Euler time step RK4 at 5x the step has to match (default: 0.01)')
+parser.add_argument('--reference-dt', type=float, default=1e-4,
+                    help='time step of the reference rollout (default: 1e-4)')
+args = parser.parse_args()
+
+# Random DMPs with S-MNIST like magnitudes
+N = 25
+rng = np.random.RandomState(0)
+tau = np.repeat(rng.uniform(2, 4, (args.batch_size, 1)), 2, axis=1)
+y0 = rng.uniform(5, 35, (args.batch_size, 2))
+goal = rng.uniform(5, 35, (args.batch_size, 2))
+w = rng.normal(0, 1000, (args.batch_size, N, 2))
+
+print('Computing reference rollout with dt = {}...'.format(args.reference_dt))
+t_ref, Y_ref, _, _, n_ref = joint(tau, y0, goal, w, args.reference_dt, integrator='rk4', exact_phase=True)
+span = np.ptp(Y_ref, axis=1).max()
+
+def error(t, Y, time_steps):
+    errors = []
+    for b in range(Y.shape[0]):
+        for d in range(Y.shape[2]):
+            reference = np.interp(t[b, :time_steps[b], d], t_ref[b, :n_ref[b], d], Y_ref[b, :n_ref[b], d])
+            errors.append(np.abs(Y[b, :time_steps[b], d] - reference).max())
+    return np.max(errors) / span
+
+failed = False
+print('{:>14} {:>10} {:>7} {:>12} {:>10}'.format('integrator', 'phase', 'dt', 'rel. error', 'time [s]'))
+for integrator in INTEGRATORS:
+    for exact_phase in [False, True]:
+        for dt in args.time_steps:
+            start = time.time()
+            t, Y, _, _, time_steps = joint(tau, y0, goal, w, dt, integrator=integrator, exact_phase=exact_phase)
+            elapsed = time.time() - start
+            phase = 'exact' if exact_phase else 'integrated'
+            relative = error(t, Y, time_steps)
+            print('{:>14} {:>10} {:>7} {:>12.3e} {:>10.4f}'.format(integrator, phase, dt, relative, elapsed))
+            if integrator == 'semi-implicit' and not relative < 1:
+                print('FAILED: the semi-implicit rollout diverges at dt = {}'.format(dt))
+                failed = True
+
+t, Y, _, _, time_steps = joint(tau, y0, goal, w, args.target_dt)
+euler = error(t, Y, time_steps)
+t, Y, _, _, time_steps = joint(tau, y0, goal, w, 5 * args.target_dt, integrator='rk4')
+rk4 = error(t, Y, time_steps)
+print('Euler at dt = {}: {:.3e}, RK4 at dt = {}: {:.3e}'.format(args.target_dt, euler, 5 * args.target_dt, rk4))
+if rk4 > euler:
+    print('FAILED: RK4 with 5x fewer steps is less accurate than Euler')
+    failed = True
+
+if failed:
+    sys.exit(1)
+print('OK')
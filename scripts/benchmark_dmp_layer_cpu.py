@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Parity check and timing of the CPU DMP integration layer.
+
+Runs the imednet.utils.dmp_layer_no_cuda.DMPIntegrator forward pass for
+several numbers of basis functions, DOF and durations and compares it with
+the operator rollout of the same DMPParameters (and with the pycuda kernel of
+imednet.utils.dmp_layer when it is available), then times it for different
+numbers of threads. tests/test_dmp_layer.py checks the outputs and gradients
+against a step-by-step rollout.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import torch
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator, DMPParameters, operator_rollout, parallel_integrate
+
+try:
+    from imednet.utils import dmp_layer as cuda_layer
+except Exception:
+    cuda_layer = None
+
+# Parse arguments
+description = 'Parity check and timing of the CPU DMP integration layer.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--batch-size', type=int, default=1024,
+                    help='number of DMPs per timed batch (default: 1024)')
+parser.add_argument('--threads', nargs='+', type=int, default=None,
+                    help='thread counts to time (default: 1 and torch.get_num_threads())')
+parser.add_argument('--tolerance', type=float, default=1e-4,
+                    help='largest allowed relative difference (default: 1e-4)')
+args = parser.parse_args()
+
+def dmp_parameters(N, dof, tau):
+    # Scaling similar to the S-MNIST datasets
+    scale = Mapping()
+    scale.x_max = np.concatenate(([tau], 30*np.ones(2*dof), 2000*np.ones(N*dof)))
+    scale.x_min = np.concatenate(([tau], -30*np.ones(2*dof), -2000*np.ones(N*dof)))
+    scale.y_max = 1
+    scale.y_min = -1
+    return DMPParameters(N, tau, 0.01, dof, scale)
+
+def relative(a, b):
+    return ((a - b).abs().max() / b.abs().max()).item()
+
+torch.manual_seed(0)
+failed = False
+print('{:>4} {:>4} {:>5} {:>6} {:>14}'.format('N', 'dof', 'tau', 'steps', 'forward diff'))
+for N, dof, tau in [(25, 2, 3), (10, 3, 2), (50, 1, 1.5), (100, 7, 5)]:
+    params = dmp_parameters(N, dof, tau)
+    division = dof*(N+2)
+    inputs = 2*torch.rand(64, division) - 1
+    outputs = DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.scale_tensor)
+    scaling = params.scale_tensor
+    reference = operator_rollout(scaling[0:division] * (inputs - scaling[-1]) + scaling[division:division*2],
+                                 params.data_tensor, params.grad_tensor)
+
+    forward_error = relative(outputs, reference)
+    print('{:>4} {:>4} {:>5} {:>6} {:>14.3e}'.format(N, dof, tau, outputs.shape[1], forward_error))
+    failed = failed or forward_error > args.tolerance
+
+if cuda_layer is not None and torch.cuda.is_available():
+    # NOTE: the kernel updates y with the new z, so it differs by O(dt)
+    params = dmp_parameters(25, 2, 3)
+    inputs = 2*torch.rand(64, 54) - 1
+    outputs = DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.scale_tensor)
+    kernel = cuda_layer.DMPIntegrator.apply(inputs.cuda(), params.data_tensor.cuda(), params.grad_tensor.cuda(),
+                                            params.scale_tensor.cuda()).cpu()
+    kernel_error = relative(outputs, kernel)
+    print('Relative difference to the CUDA kernel: {:.3e}'.format(kernel_error))
+    failed = failed or kernel_error > 1e-3
+
+params = dmp_parameters(25, 2, 3)
+inputs = 2*torch.rand(args.batch_size, 54) - 1
+scaling = params.scale_tensor
+rows = (scaling[0:54] * (inputs - scaling[-1]) + scaling[54:108]).view(-1, 27, 2).transpose(2, 1).contiguous().view(-1, 27)
+for threads in args.threads or sorted({1, torch.get_num_threads()}):
+    parallel_integrate(params.data_tensor, rows, 3.0, threads)
+    start = time.time()
+    parallel_integrate(params.data_tensor, rows, 3.0, threads)
+    print('Batch of {} on {} thread(s): {:.4f} s'.format(args.batch_size, threads, time.time() - start))
+
+if failed:
+    print('FAILED: difference above tolerance')
+    sys.exit(1)
+print('OK')
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Check and time the 'operator' forward mode of the DMP integration layer.
+
+Compares the single matrix multiply rollout against the step-by-step Euler
+integration (and the CUDA kernel when it is available) on random network
+outputs and reports the largest difference and the time per batch.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import torch
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils.dmp_layer_no_cuda import DMPParameters, integrate, operator_rollout
+
+try:
+    from imednet.utils import dmp_layer as cuda_layer
+except Exception:
+    cuda_layer = None
+
+# Parse arguments
+description = 'Check and time the operator forward mode of the DMP layer.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--batch-size', type=int, default=1024,
+                    help='number of DMPs per batch (default: 1024)')
+parser.add_argument('--repeats', type=int, default=10,
+                    help='number of timed repetitions (default: 10)')
+parser.add_argument('--tolerance', type=float, default=1e-3,
+                    help='largest allowed relative difference (default: 1e-3)')
+args = parser.parse_args()
+
+N = 25
+dof = 2
+
+# Scaling similar to the S-MNIST datasets
+torch.manual_seed(0)
+scale = Mapping()
+scale.x_max = np.concatenate(([3], 30*np.ones(2*dof), 2000*np.ones(N*dof)))
+scale.x_min = np.concatenate(([3], -30*np.ones(2*dof), -2000*np.ones(N*dof)))
+dmp_params = DMPParameters(N, 3, 0.01, dof, scale)
+
+inputs = 2*torch.rand(args.batch_size, (N+2)*dof) - 1
+division = dof*(N+2)
+scaling = dmp_params.scale_tensor
+inputs_np = scaling[0:division] * (inputs - scaling[-1]) + scaling[division:division*2]
+
+# Reference: step-by-step Euler integration of every DOF
+def euler_rollout():
+    params = inputs_np.view(-1, N+2, dof).transpose(2, 1).contiguous().view(-1, N+2)
+    return integrate(dmp_params.data_tensor, params[:, 2:], params[:, 0], 0, params[:, 1], dmp_params.tau)
+
+def timed(f):
+    f()
+    start = time.time()
+    for _ in range(args.repeats):
+        result = f()
+    return result, (time.time() - start)/args.repeats
+
+reference, euler_time = timed(euler_rollout)
+operator, operator_time = timed(lambda: operator_rollout(inputs_np, dmp_params.data_tensor, dmp_params.grad_tensor))
+
+error = ((operator - reference).abs().max() / reference.abs().max()).item()
+print('Batch size: {}'.format(args.batch_size))
+print('Euler integration: {:.6f} s/batch'.format(euler_time))
+print('Operator rollout:  {:.6f} s/batch ({:.1f}x)'.format(operator_time, euler_time/operator_time))
+print('Relative difference to Euler integration: {:.3e}'.format(error))
+failed = error > args.tolerance
+
+if cuda_layer is not None and torch.cuda.is_available():
+    # NOTE: the kernel updates y with the new z, so it differs by O(dt)
+    data = dmp_params.data_tensor.cuda()
+    kernel, kernel_time = timed(lambda: cuda_layer.DMPIntegrator.apply(inputs.cuda(), data, dmp_params.grad_tensor.cuda(),
+                                                                       scaling.cuda()))
+    kernel_error = ((operator - kernel.cpu()).abs().max() / kernel.abs().max()).item()
+    print('CUDA kernel:       {:.6f} s/batch'.format(kernel_time))
+    print('Relative difference to CUDA kernel: {:.3e}'.format(kernel_error))
+    failed = failed or kernel_error > args.tolerance
+
+if failed:
+    print('FAILED: difference above tolerance {}'.format(args.tolerance))
+    sys.exit(1)
+print('OK')
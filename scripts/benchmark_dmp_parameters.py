@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Time the construction of DMPParameters.
+
+Compares building the rollout Jacobian with one integrate call per impulse
+response (as DMPParameters used to), with the batched impulse_responses
+and with loading it from the on-disk operator cache in a fresh process.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import torch
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils import dmp_basis
+from imednet.utils.dmp_layer_no_cuda import DMPParameters, integrate, impulse_responses
+
+# Parse arguments
+description = 'Time the construction of DMPParameters.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--basis', type=int, default=25,
+                    help='number of basis functions (default: 25)')
+parser.add_argument('--tau', type=float, default=3,
+                    help='duration (default: 3)')
+args = parser.parse_args()
+
+N = args.basis
+scale = Mapping()
+scale.x_max = np.concatenate(([args.tau], 30*np.ones(4), 2000*np.ones(2*N)))
+scale.x_min = -scale.x_max
+scale.y_max = 1
+scale.y_min = -1
+
+directory = tempfile.mkdtemp()
+try:
+    dmp_basis.operator_cache.directory = directory
+    start = time.time()
+    params = DMPParameters(N, args.tau, 0.01, 2, scale)
+    build_time = time.time() - start
+
+    start = time.time()
+    grad = torch.zeros(params.grad_tensor.shape)
+    unit = torch.eye(N + 2)
+    for i in range(N + 2):
+        grad[:, i] = integrate(params.data_tensor, unit[i:i+1, 2:], unit[i, 0], 0, unit[i, 1], args.tau)
+    loop_time = time.time() - start
+    error = (grad - impulse_responses(params.data_tensor, args.tau)).abs().max().item()
+
+    # a new process only finds the cached file
+    command = ('import sys, time; sys.path.append({!r}); import numpy as np;'
+               'from imednet.data.smnist_loader import Mapping; from imednet.utils import dmp_basis;'
+               'from imednet.utils.dmp_layer_no_cuda import DMPParameters;'
+               'dmp_basis.operator_cache.directory = {!r}; s = Mapping();'
+               's.x_max = np.concatenate(([{}], 30*np.ones(4), 2000*np.ones({}))); s.x_min = -s.x_max;'
+               's.y_max = 1; s.y_min = -1; start = time.time(); DMPParameters({}, {}, 0.01, 2, s);'
+               'print(time.time() - start)').format(dirname(dirname(realpath(__file__))), directory,
+                                                    args.tau, 2*N, N, args.tau)
+    cached_time = float(subprocess.check_output([sys.executable, '-W', 'ignore', '-c', command]).split()[-1])
+finally:
+    shutil.rmtree(directory)
+
+print('N = {}, {} time steps'.format(N, params.time_steps))
+print('One integrate call per impulse:  {:.4f} s'.format(loop_time))
+print('DMPParameters, batched build:    {:.4f} s'.format(build_time))
+print('DMPParameters, on-disk cache:    {:.4f} s'.format(cached_time))
+print('Largest difference of the batched Jacobian: {:.3e}'.format(error))
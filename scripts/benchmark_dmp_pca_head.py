@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Accuracy and throughput of the principal-component DMP weight head.
+
+Draws digit-like trajectories from a few smooth prototypes, fits DMPs to
+them and rasterizes them into 28x28 images, a stand-in for the S-MNIST data.
+For several numbers of components k it reports the explained weight
+variance, the trajectory error of projecting the test DMPs onto the basis,
+the validation trajectory MSE of a DMPEncoderDecoderNet trained with
+pca_basis (dmp_pca.PCAWeightHead) and the time of a forward and backward
+pass, compared with the full output layer and the 'operator' DMP layer.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import torch
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.models.encoder_decoder import DMPEncoderDecoderNet
+from imednet.utils.dmp_class import DMPSet
+from imednet.utils.dmp_pca import WeightBasis
+
+# Parse arguments
+description = 'Accuracy and throughput of the principal-component DMP weight head.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--components', nargs='+', type=int, default=[2, 4, 8, 16, 32],
+                    help='numbers of components k (default: 2 4 8 16 32)')
+parser.add_argument('--data-size', type=int, default=3000,
+                    help='number of samples, a fifth is used for validation (default: 3000)')
+parser.add_argument('--epochs', type=int, default=30,
+                    help='training epochs per model (default: 30)')
+parser.add_argument('--batch-size', type=int, default=128,
+                    help='batch size (default: 128)')
+args = parser.parse_args()
+
+N = 25
+dof = 2
+tau = 3
+dt = 0.01
+T = int(round(tau / dt)) + 1
+
+# Digit-like trajectories: smooth prototypes under random affine maps and noise
+rng = np.random.RandomState(0)
+s = np.linspace(0, 1, T)
+prototypes = [sum(rng.randn(2, 1) * np.sin(np.pi * (f * s + rng.rand(2, 1))) / f for f in range(1, 5))
+              for _ in range(10)]
+trajectories = []
+for i in range(args.data_size):
+    angle = 0.3 * rng.randn()
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    points = (1 + 0.15 * rng.randn()) * rotation.dot(prototypes[i % 10])
+    points = points + 0.1 * sum(rng.randn(2, 1) * np.sin(np.pi * f * s) / f for f in range(1, 16))
+    points = 14 + 5 * points + rng.randn(2, 1)
+    trajectories.append(np.column_stack((points.T, s * tau)))
+dmps = DMPSet.from_trajectories(trajectories, N, dt)
+
+# Network inputs and targets as MatLoader.load_data and train_dmp see them
+images = np.array([np.histogram2d(t[:, 1], t[:, 0], bins=28, range=[[0, 28], [0, 28]])[0].ravel()
+                   for t in trajectories])
+images = torch.from_numpy(np.minimum(images, 1)).float()
+outputs = np.concatenate((dmps.tau[:, :1], dmps.y0, dmps.goal, dmps.w.reshape(len(dmps), -1)), 1)
+scale = Mapping()
+scale.x_max = np.concatenate((outputs[:, :5].max(0), outputs[:, 5:].max() * np.ones(N * dof)))
+scale.x_min = np.concatenate((outputs[:, :5].min(0), outputs[:, 5:].min() * np.ones(N * dof)))
+scale.x_max[0] = scale.x_min[0] = tau
+span = scale.x_max - scale.x_min
+span[span == 0] = 1
+outputs = 2 * (outputs - scale.x_min) / span - 1
+split = args.data_size - args.data_size // 5
+train_images, validate_images = images[:split], images[split:]
+
+torch.manual_seed(0)
+full = DMPEncoderDecoderNet([784, 200, 2 * N + 4], scale=scale, dmp_forward_mode='operator')
+with torch.no_grad():
+    targets = full.func.apply(torch.from_numpy(outputs[:, 1:]).float(), full.DMPp, full.param_grad, full.scale_t,
+                              'operator')
+train_targets, validate_targets = targets[:2 * split], targets[2 * split:]
+
+def train(model):
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    criterion = torch.nn.MSELoss()
+    for epoch in range(args.epochs):
+        permutation = torch.randperm(split)
+        for i in range(0, split, args.batch_size):
+            batch = permutation[i:i + args.batch_size]
+            rows = torch.stack((2 * batch, 2 * batch + 1), 1).view(-1)
+            optimizer.zero_grad()
+            loss = criterion(model(train_images[batch]), train_targets[rows])
+            loss.backward()
+            optimizer.step()
+    with torch.no_grad():
+        return criterion(model(validate_images), validate_targets).item()
+
+def throughput(model, repeats=20):
+    batch = images[:512]
+    start = time.time()
+    for _ in range(repeats):
+        model.zero_grad()
+        model(batch).sum().backward()
+    return (time.time() - start) / repeats
+
+print('{:>5} {:>10} {:>16} {:>12} {:>14} {:>10}'.format('k', 'explained', 'projection RMSE', 'val. MSE',
+                                                           'fwd+bwd [ms]', 'outputs'))
+for k in args.components:
+    basis = WeightBasis.from_outputs(outputs[:split], scale, k, dof)
+    torch.manual_seed(1)
+    model = DMPEncoderDecoderNet([784, 200, 2 * N + 4], scale=scale, pca_basis=basis)
+
+    # best case: head outputs from the true y0, goal and projected weights
+    coefficients = (outputs[split:, 5:] * span[5:] / 2 + scale.x_min[5:] + span[5:] / 2 - basis.mean).dot(
+        basis.components) / basis.std
+    head_outputs = torch.from_numpy(np.concatenate((outputs[split:, 1:5], coefficients), 1)).float()
+    with torch.no_grad():
+        projection = (model.pca_head(head_outputs) - validate_targets).pow(2).mean().sqrt().item()
+
+    print('{:>5} {:>10.4f} {:>16.4f} {:>12.4f} {:>14.2f} {:>10}'.format(
+        k, basis.explained.sum(), projection, train(model), 1000 * throughput(model), model.pca_head.size))
+
+torch.manual_seed(1)
+full = DMPEncoderDecoderNet([784, 200, 2 * N + 4], scale=scale, dmp_forward_mode='operator')
+print('{:>5} {:>10.4f} {:>16.4f} {:>12.4f} {:>14.2f} {:>10}'.format(
+    N * dof, 1.0, 0.0, train(full), 1000 * throughput(full), 2 * N + 4))
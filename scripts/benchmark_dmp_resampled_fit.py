@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Check and time DMP fitting on a common resampled grid.
+
+Fits random demonstrations once per trajectory with DMP.track, once with the
+batched dmp_batch.fit_trajectories and once with dmp_batch.fit_resampled for
+several grid sizes, and reports the time and the residual of the resampled
+fit against the per-trajectory fit. Finally re-fits the whole set for other
+N and a_z to show the cost of changing them.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.utils.dmp_class import DMP
+from imednet.utils.dmp_batch import joint, derivatives, fit_trajectories, fit_resampled, resampling_residual
+
+# Parse arguments
+description = 'Check and time DMP fitting on a common resampled grid.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--trajectories', type=int, default=1000,
+                    help='number of random demonstrations (default: 1000)')
+parser.add_argument('--samples', nargs='+', type=int, default=[50, 100, 200, 300],
+                    help='grid sizes to test (default: 50 100 200 300)')
+parser.add_argument('--regularization', type=float, default=0.0,
+                    help='ridge term of the projection (default: 0)')
+args = parser.parse_args()
+
+# Demonstrations of different durations, rolled out from random DMPs
+N = 25
+rng = np.random.RandomState(0)
+B = args.trajectories
+tau = np.repeat(rng.uniform(2, 4, (B, 1)), 2, axis=1)
+t, Y, _, _, n = joint(tau, rng.uniform(5, 35, (B, 2)), rng.uniform(5, 35, (B, 2)),
+                      rng.normal(0, 300, (B, N, 2)), 0.01)
+trajectories = [np.column_stack((Y[b, :n[b]], t[b, :n[b], 0])) for b in range(B)]
+print('{} demonstrations with {} to {} samples'.format(B, n.min(), n.max()))
+
+start = time.time()
+t_d, y_d, yd_d, ydd_d, lengths = derivatives(trajectories)
+for b in range(B):
+    dmp = DMP(N, 0.01)
+    dmp.track(t_d[b, :lengths[b], None].repeat(2, axis=1), y_d[b, :lengths[b]], yd_d[b, :lengths[b]],
+              ydd_d[b, :lengths[b]])
+print('DMP.track per trajectory:   {:.3f} s'.format(time.time() - start))
+
+start = time.time()
+fit_trajectories(trajectories, N)
+print('fit_trajectories:           {:.3f} s'.format(time.time() - start))
+
+print('{:>8} {:>10} {:>16} {:>16} {:>16}'.format('samples', 'time [s]', 'median w resid.',
+                                                  'max w resid.', 'max rollout res.'))
+for samples in args.samples:
+    start = time.time()
+    fit_resampled(trajectories, N, samples, regularization=args.regularization)
+    elapsed = time.time() - start
+    weights, rollout = resampling_residual(trajectories, N, samples, regularization=args.regularization)
+    print('{:>8} {:>10.3f} {:>16.3e} {:>16.3e} {:>16.3e}'.format(samples, elapsed, np.median(weights),
+                                                                 weights.max(), rollout.max()))
+
+samples = args.samples[-1]
+for N_refit, a_z in [(25, 48), (50, 48), (100, 48), (25, 30)]:
+    start = time.time()
+    fit_resampled(trajectories, N_refit, samples, a_z=a_z, regularization=args.regularization)
+    print('Re-fit with N = {}, a_z = {}: {:.3f} s'.format(N_refit, a_z, time.time() - start))
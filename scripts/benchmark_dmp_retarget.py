@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Check and time re-targeting of predicted DMPs.
+
+Replays a batch of DMPs, given as scaled network outputs, to a batch of new
+start and goal positions with dmp_retarget.retarget. The trajectories are
+compared with the Euler integration of the DMP layer (integrate) for every
+re-targeted DMP, the time also with DMPSet.joint and a loop of DMP.joint
+calls, the current way of replaying a prediction (they step with
+tau/T instead of dt, so their trajectories differ slightly).
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import torch
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils.dmp_class import DMP, DMPSet
+from imednet.utils.dmp_layer_no_cuda import DMPParameters, integrate
+from imednet.utils.dmp_loss import parameter_rows
+from imednet.utils.dmp_retarget import retarget
+
+# Parse arguments
+description = 'Check and time re-targeting of predicted DMPs.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--batch-size', type=int, default=64,
+                    help='number of predicted DMPs (default: 64)')
+parser.add_argument('--targets', type=int, default=32,
+                    help='number of new (y0, goal) pairs (default: 32)')
+parser.add_argument('--loop-size', type=int, default=100,
+                    help='number of DMP.joint calls timed for the loop (default: 100)')
+parser.add_argument('--tolerance', type=float, default=1e-3,
+                    help='largest allowed difference in the units of y (default: 1e-3)')
+args = parser.parse_args()
+
+N = 25
+dof = 2
+division = dof*(N+2)
+tau = 3
+dt = 0.01
+
+# Scaling similar to the S-MNIST datasets
+scale = Mapping()
+scale.x_max = np.concatenate(([tau], 30*np.ones(2*dof), 500*np.ones(N*dof)))
+scale.x_min = np.concatenate(([tau], -30*np.ones(2*dof), -500*np.ones(N*dof)))
+scale.y_max = 1
+scale.y_min = -1
+params = DMPParameters(N, tau, dt, dof, scale)
+
+torch.manual_seed(0)
+outputs = 2*torch.rand(args.batch_size, division) - 1
+y0 = 30*(2*torch.rand(args.targets, dof) - 1)
+goal = 30*(2*torch.rand(args.targets, dof) - 1)
+
+start = time.time()
+rows = parameter_rows(outputs, params.data_tensor, params.scale_tensor)
+Y = retarget(rows, params.grad_tensor, y0, goal, dof)
+retarget_time = time.time() - start
+
+# The same DMPs with every new start and goal, rolled out as a DMPSet
+rows = rows.double().view(args.batch_size, dof, N+2).numpy()
+B, M = args.batch_size, args.targets
+w = np.repeat(rows[:, :, 2:].transpose(0, 2, 1), M, axis=0)
+dmps = DMPSet(N, dt, tau*np.ones((B*M, dof)), np.tile(y0.double().numpy(), (B, 1)), np.zeros((B*M, dof)),
+              np.tile(goal.double().numpy(), (B, 1)), w)
+start = time.time()
+dmps.joint()
+set_time = time.time() - start
+
+start = time.time()
+for i in range(min(args.loop_size, B*M)):
+    dmp = DMP(N, dt)
+    dmp.values(N, dt, tau, dmps.y0[i], [0, 0], dmps.goal[i], dmps.w[i])
+    dmp.joint()
+loop_time = (time.time() - start) * B*M / min(args.loop_size, B*M)
+
+# Layer integration of every re-targeted DMP, in the row order of the layer
+w = torch.from_numpy(dmps.w).float().transpose(2, 1).contiguous().view(-1, N)
+reference = integrate(params.data_tensor, w, torch.from_numpy(dmps.y0).float().view(-1), 0,
+                      torch.from_numpy(dmps.goal).float().view(-1), tau)
+error = (Y - reference.view(B, M, dof, -1)).abs().max().item()
+print('{} DMPs x {} targets, {} time steps'.format(B, M, Y.shape[-1]))
+print('Largest difference to the layer integration: {:.3e}'.format(error))
+print('  retarget:            {:.4f} s'.format(retarget_time))
+print('  DMPSet.joint:        {:.4f} s'.format(set_time))
+print('  DMP.joint loop (est): {:.4f} s'.format(loop_time))
+if error > args.tolerance:
+    print('FAILED: difference above tolerance {}'.format(args.tolerance))
+    sys.exit(1)
+print('OK')
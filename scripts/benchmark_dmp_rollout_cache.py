@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Check and time the memoized DMP rollouts.
+
+Rolls out a stream of DMP batches in which a fraction of the DMPs repeats
+earlier ones up to a perturbation below the quantization step, with and
+without imednet.utils.dmp_cache.RolloutCache. Reports the hit rate, the
+speedup of DMPSet.joint and DMP.joint and the largest trajectory error the
+quantization introduces.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.utils.dmp_class import DMP, DMPSet
+from imednet.utils.dmp_cache import RolloutCache
+
+# Parse arguments
+description = 'Check and time the memoized DMP rollouts.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--batches', type=int, default=20,
+                    help='number of batches (default: 20)')
+parser.add_argument('--batch-size', type=int, default=128,
+                    help='DMPs per batch (default: 128)')
+parser.add_argument('--repeat', type=float, default=0.75,
+                    help='fraction of the DMPs that repeat earlier ones (default: 0.75)')
+parser.add_argument('--quantization', type=float, default=1e-6,
+                    help='quantization step of the cache keys (default: 1e-6)')
+parser.add_argument('--maxsize', type=int, default=1024,
+                    help='maximum number of cached rollouts (default: 1024)')
+parser.add_argument('--tolerance', type=float, default=1e-3,
+                    help='largest allowed trajectory error (default: 1e-3)')
+args = parser.parse_args()
+
+N = 25
+dof = 2
+rng = np.random.RandomState(0)
+pool = 256
+
+def draw(count):
+    tau = np.repeat(rng.uniform(2.5, 3.5, (count, 1)), dof, axis=1)
+    return (tau, rng.uniform(0, 28, (count, dof)), np.zeros((count, dof)), rng.uniform(0, 28, (count, dof)),
+            rng.uniform(-2000, 2000, (count, N, dof)))
+
+# A pool of DMPs that come back, perturbed by less than the quantization step
+seen = draw(pool)
+batches = []
+for b in range(args.batches):
+    fresh = draw(args.batch_size)
+    repeated = rng.rand(args.batch_size) < args.repeat
+    index = rng.randint(pool, size=args.batch_size)
+    parameters = [np.where(repeated.reshape((-1,) + (1,) * (f.ndim - 1)), s[index], f) for s, f in zip(seen, fresh)]
+    parameters[1] = parameters[1] + 0.1 * args.quantization * rng.uniform(-1, 1, parameters[1].shape)
+    batches.append(DMPSet(N, 0.01, *parameters))
+
+def run(cache):
+    start = time.perf_counter()
+    results = [dmps.joint(cache=cache) for dmps in batches]
+    return time.perf_counter() - start, results
+
+plain_time, plain = run(None)
+cache = RolloutCache(maxsize=args.maxsize, maxbytes=None, quantization=args.quantization)
+cached_time, cached = run(cache)
+info = cache.info()
+
+error = 0.0
+for (t, Y, dY, ddY, n), (t_c, Y_c, dY_c, ddY_c, n_c) in zip(plain, cached):
+    assert np.array_equal(n, n_c) and Y.shape == Y_c.shape
+    error = max(error, np.abs(Y - Y_c).max())
+
+print('Hit rate: {:.3f} ({} hits, {} misses, {} evictions, {:.1f} MB)'.format(
+    info['hit_rate'], info['hits'], info['misses'], info['evictions'], info['nbytes'] / 2.0**20))
+print('DMPSet.joint: {:.1f} ms per batch, cached {:.1f} ms, speedup {:.1f}x'.format(
+    1e3 * plain_time / args.batches, 1e3 * cached_time / args.batches, plain_time / cached_time))
+print('Largest trajectory error from quantization: {:.3e}'.format(error))
+
+# Single DMP.joint calls, the plotting path of the trainer
+dmp = batches[0][0]
+repeats = 50
+start = time.perf_counter()
+for _ in range(repeats):
+    dmp.joint()
+plain_time = (time.perf_counter() - start) / repeats
+Y = dmp.Y
+cache.clear()
+start = time.perf_counter()
+for _ in range(repeats):
+    dmp.joint(cache=cache)
+cached_time = (time.perf_counter() - start) / repeats
+error = max(error, np.abs(Y - dmp.Y).max())
+print('DMP.joint: {:.2f} ms, cached {:.3f} ms, hit rate {:.3f}'.format(
+    1e3 * plain_time, 1e3 * cached_time, cache.info()['hit_rate']))
+
+if error > args.tolerance:
+    print('FAILED: error above tolerance {}'.format(args.tolerance))
+    sys.exit(1)
+print('OK')
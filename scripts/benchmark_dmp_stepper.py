@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Measure the per-tick latency of the streaming DMP stepper.
+
+Checks that stepping a DMP reproduces DMP.joint, then times single ticks and
+k-tick calls of imednet.utils.dmp_class.DMPStepper and reports how much
+memory the stepping allocates.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.utils.dmp_class import DMP, DMPStepper
+
+# Parse arguments
+description = 'Measure the per-tick latency of the streaming DMP stepper.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--rate', type=float, default=1000,
+                    help='control rate in Hz (default: 1000)')
+parser.add_argument('--ticks', type=int, default=20000,
+                    help='number of timed ticks (default: 20000)')
+parser.add_argument('--dof', type=int, default=7,
+                    help='degrees of freedom (default: 7)')
+parser.add_argument('--k', type=int, default=10,
+                    help='ticks per call for the batched measurement (default: 10)')
+args = parser.parse_args()
+
+N = 25
+rng = np.random.RandomState(0)
+dmp = DMP(N, 0.01)
+dmp.values(N, 0.01, 3*np.ones(args.dof), rng.uniform(0, 1, args.dof), np.zeros(args.dof),
+           rng.uniform(0, 1, args.dof), rng.normal(0, 100, (N, args.dof)))
+
+# Stepping with the DMP.joint step must reproduce DMP.joint
+dmp.joint()
+stepper = DMPStepper(dmp, dt=dmp.t[1, 0])
+Y = [stepper.y.copy()] + [stepper.step().copy() for _ in range(dmp.Y.shape[0] - 1)]
+print('Max difference to DMP.joint: {:.3e}'.format(np.abs(np.array(Y) - dmp.Y).max()))
+
+stepper = DMPStepper(dmp, dt=1.0/args.rate)
+latencies = np.zeros(args.ticks)
+for i in range(args.ticks):
+    if stepper.done:
+        stepper.reset()
+    start = time.perf_counter()
+    stepper.step()
+    latencies[i] = time.perf_counter() - start
+latencies *= 1e6
+
+start = time.perf_counter()
+calls = max(1, args.ticks // args.k)
+for i in range(calls):
+    stepper.step(args.k)
+per_tick_k = (time.perf_counter() - start) / (calls * args.k) * 1e6
+
+tracemalloc.start()
+stepper.step(1000)
+current, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+
+print('DOF: {}, control period: {:.0f} us'.format(args.dof, 1e6/args.rate))
+print('step():  mean {:.1f} us, median {:.1f} us, p99 {:.1f} us, max {:.1f} us'.format(
+    latencies.mean(), np.median(latencies), np.percentile(latencies, 99), latencies.max()))
+print('step({}): {:.1f} us per tick'.format(args.k, per_tick_k))
+print('Memory over 1000 ticks: {} bytes retained, {} bytes peak'.format(current, peak))
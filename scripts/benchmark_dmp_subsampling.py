@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Study the convergence of DMP network training on subsampled trajectories.
+
+Trains a small network through the CPU DMP integration layer to reproduce
+trajectories of random DMPs, once on all time steps and once on K evenly
+spaced or randomly drawn time steps per batch (the time_indices of
+DMPIntegrator, as Trainer.train_dmp(time_samples=K) does), and reports the
+full-trajectory validation loss, the time per epoch and the size of the
+layer output per batch.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import torch
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator, DMPParameters, time_subset
+
+# Parse arguments
+description = 'Study the convergence of DMP network training on subsampled trajectories.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--samples', nargs='+', type=int, default=[301, 151, 76, 38, 20, 10, 5],
+                    help='numbers of time steps K to train on (default: 301 151 76 38 20 10 5)')
+parser.add_argument('--epochs', type=int, default=30,
+                    help='training epochs per run (default: 30)')
+parser.add_argument('--batch-size', type=int, default=256,
+                    help='batch size (default: 256)')
+parser.add_argument('--data-size', type=int, default=4096,
+                    help='number of training samples (default: 4096)')
+args = parser.parse_args()
+
+N = 25
+dof = 2
+features = 64
+
+# Scaling similar to the S-MNIST datasets
+scale = Mapping()
+scale.x_max = np.concatenate(([3], 30*np.ones(2*dof), 2000*np.ones(N*dof)))
+scale.x_min = np.concatenate(([3], -30*np.ones(2*dof), -2000*np.ones(N*dof)))
+scale.y_max = 1
+scale.y_min = -1
+params = DMPParameters(N, 3, 0.01, dof, scale)
+
+def rollout(outputs, time_indices=None):
+    return DMPIntegrator.apply(outputs, params.data_tensor, params.grad_tensor, params.scale_tensor,
+                               'operator', time_indices)
+
+# Trajectories of DMPs that are a smooth function of the inputs
+torch.manual_seed(0)
+mapping = torch.randn(features, dof*(N+2)) / np.sqrt(features)
+inputs = torch.randn(args.data_size + 1024, features)
+with torch.no_grad():
+    targets = rollout(torch.tanh(inputs.mm(mapping)))
+train_inputs, validate_inputs = inputs[:args.data_size], inputs[args.data_size:]
+train_targets, validate_targets = targets[:2*args.data_size], targets[2*args.data_size:]
+T = targets.shape[1]
+
+print('{:>5} {:>8} {:>14} {:>12} {:>16}'.format('K', 'sampling', 'val. loss', 'epoch [s]', 'output [bytes]'))
+for K in args.samples:
+    for random in ([False, True] if K < T else [False]):
+        torch.manual_seed(1)
+        model = torch.nn.Sequential(torch.nn.Linear(features, 128), torch.nn.Tanh(),
+                                    torch.nn.Linear(128, dof*(N+2)))
+        optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+        criterion = torch.nn.MSELoss()
+        time_indices = time_subset(T, K)
+
+        start = time.time()
+        for epoch in range(args.epochs):
+            permutation = torch.randperm(args.data_size)
+            for i in range(0, args.data_size, args.batch_size):
+                batch = permutation[i:i+args.batch_size]
+                rows = torch.stack((2*batch, 2*batch+1), 1).view(-1)
+                if random:
+                    time_indices = time_subset(T, K, random=True)
+                optimizer.zero_grad()
+                loss = criterion(rollout(model(train_inputs[batch]), time_indices),
+                                 train_targets[rows][:, time_indices])
+                loss.backward()
+                optimizer.step()
+        epoch_time = (time.time() - start) / args.epochs
+
+        with torch.no_grad():
+            validation_loss = criterion(rollout(model(validate_inputs)), validate_targets).item()
+        print('{:>5} {:>8} {:>14.4f} {:>12.4f} {:>16}'.format(K, 'random' if random else 'fixed',
+                                                               validation_loss, epoch_time,
+                                                               2*args.batch_size*K*4))
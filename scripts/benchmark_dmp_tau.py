@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Check and time the per-sample tau mode of the DMP integration layer.
+
+Checks that the 'tau' forward mode of
+imednet.utils.dmp_layer_no_cuda.DMPIntegrator reproduces the default mode
+when every tau is the one of DMPParameters, runs torch.autograd.gradcheck
+on its forward sensitivities, and compares the time of a forward and
+backward pass with autograd through the unrolled Euler loop.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import torch
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator, DMPParameters
+
+# Parse arguments
+description = 'Check and time the per-sample tau mode of the DMP layer.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--batch-size', type=int, default=256,
+                    help='number of DMPs per timed batch (default: 256)')
+parser.add_argument('--tau', nargs=2, type=float, default=[1, 5],
+                    help='range of the durations (default: 1 5)')
+parser.add_argument('--tolerance', type=float, default=1e-4,
+                    help='largest allowed relative difference (default: 1e-4)')
+args = parser.parse_args()
+
+N = 25
+dof = 2
+division = dof*(N+2)
+
+# Scaling similar to the S-MNIST datasets, horizon of the longest duration
+scale = Mapping()
+scale.x_max = np.concatenate(([args.tau[1]], 30*np.ones(2*dof), 2000*np.ones(N*dof)))
+scale.x_min = np.concatenate(([args.tau[0]], -30*np.ones(2*dof), -2000*np.ones(N*dof)))
+scale.y_max = 1
+scale.y_min = -1
+params = DMPParameters(N, args.tau[1], 0.01, dof, scale)
+
+def relative(a, b):
+    return ((a - b).abs().max() / b.abs().max()).item()
+
+torch.manual_seed(0)
+failed = False
+
+# With every tau at the horizon the default mode must give the same values and gradients
+inputs = (2*torch.rand(64, division) - 1).requires_grad_()
+tau_inputs = torch.cat((torch.ones(64, 1), inputs.detach()), 1).requires_grad_()
+outputs = DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.scale_tensor)
+tau_outputs = DMPIntegrator.apply(tau_inputs, params.data_tensor, params.grad_tensor, params.tau_scale_tensor, 'tau')
+grad_outputs = torch.randn_like(outputs)
+grad, = torch.autograd.grad(outputs, inputs, grad_outputs)
+tau_grad, = torch.autograd.grad(tau_outputs, tau_inputs, grad_outputs)
+forward_error = relative(tau_outputs, outputs)
+backward_error = relative(tau_grad[:, 1:], grad)
+print('Difference to the default mode: forward {:.3e}, backward {:.3e}'.format(forward_error, backward_error))
+failed = failed or forward_error > args.tolerance or backward_error > args.tolerance
+
+# Finite difference check of all gradients, including tau, in double precision
+data = params.data_tensor.double()
+scaling = params.tau_scale_tensor.double()
+inputs = (1.8*torch.rand(2, division + 1, dtype=torch.float64) - 0.9).requires_grad_()
+passed = torch.autograd.gradcheck(lambda x: DMPIntegrator.apply(x, data, None, scaling, 'tau'), (inputs,),
+                                  eps=1e-6, atol=1e-4, rtol=1e-4, raise_exception=False)
+print('gradcheck: {}'.format('passed' if passed else 'FAILED'))
+failed = failed or not passed
+
+# Autograd through the unrolled Euler loop for comparison
+def unrolled(inputs):
+    d = division + 1
+    inputs_np = params.tau_scale_tensor[0:d] * (inputs - params.tau_scale_tensor[-1]) + params.tau_scale_tensor[d:2*d]
+    tau = inputs_np[:, 0].repeat_interleave(dof)
+    rows = inputs_np[:, 1:].contiguous().view(-1, N+2, dof).transpose(2, 1).contiguous().view(-1, N+2)
+    y, goal, w = rows[:, 0], rows[:, 1], rows[:, 2:]
+    z = torch.zeros_like(y)
+    x = torch.ones_like(y)
+    Y = [y]
+    for i in range(params.time_steps - 1):
+        psi = torch.exp(-0.5 * (x[:, None] - params.c) ** 2 / params.sigma2)
+        fx = (w * psi).sum(1) * x / psi.sum(1)
+        dz = (params.a_z * (params.a_z / 4 * (goal - y) - z) + fx) / tau
+        y = y + z / tau * params.dt
+        z = z + dz * params.dt
+        x = x - params.a_x * x / tau * params.dt
+        Y.append(y)
+    return torch.stack(Y, 1)
+
+def timed(f):
+    inputs = (2*torch.rand(args.batch_size, division + 1) - 1).requires_grad_()
+    start = time.time()
+    outputs = f(inputs)
+    outputs.backward(torch.ones_like(outputs))
+    return time.time() - start, inputs.grad
+
+sensitivity_time, sensitivity_grad = timed(lambda x: DMPIntegrator.apply(x, params.data_tensor, None,
+                                                                         params.tau_scale_tensor, 'tau'))
+unrolled_time, _ = timed(unrolled)
+print('Forward and backward of {} DMPs with {} time steps:'.format(args.batch_size, params.time_steps))
+print('  forward sensitivities: {:.3f} s'.format(sensitivity_time))
+print('  unrolled autograd:     {:.3f} s'.format(unrolled_time))
+
+if failed:
+    print('FAILED')
+    sys.exit(1)
+print('OK')
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Check and time tau-bucketed DMP rollouts.
+
+Draws DMPs of mixed duration, snaps their tau to evenly spaced buckets
+(dmp_buckets.TauBuckets), refines the buckets until the rollout error is
+below a tolerance and reports the error per bucket. Then checks the
+'buckets' forward mode of imednet.utils.dmp_layer_no_cuda.DMPIntegrator
+with torch.autograd.gradcheck and compares the time of a forward and
+backward pass of a single-bucket batch with the exact per-sample 'tau' mode.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import torch
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils.dmp_buckets import TauBuckets, tau_boundaries
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator, DMPParameters
+
+# Parse arguments
+description = 'Check and time tau-bucketed DMP rollouts.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--samples', type=int, default=2000,
+                    help='number of DMPs of random duration (default: 2000)')
+parser.add_argument('--tau', nargs=2, type=float, default=[2, 3],
+                    help='range of the durations (default: 2 3)')
+parser.add_argument('--buckets', type=int, default=4,
+                    help='initial number of buckets (default: 4)')
+parser.add_argument('--tolerance', type=float, default=0.5,
+                    help='largest allowed rollout error in the units of y (default: 0.5)')
+parser.add_argument('--batch-size', type=int, default=256,
+                    help='number of DMPs per timed batch (default: 256)')
+args = parser.parse_args()
+
+N = 25
+dof = 2
+division = dof*(N+2)
+
+# Scaling similar to the S-MNIST datasets, horizon of the longest duration
+scale = Mapping()
+scale.x_max = np.concatenate(([args.tau[1]], 30*np.ones(2*dof), 2000*np.ones(N*dof)))
+scale.x_min = np.concatenate(([args.tau[0]], -30*np.ones(2*dof), -2000*np.ones(N*dof)))
+scale.y_max = 1
+scale.y_min = -1
+params = DMPParameters(N, args.tau[1], 0.01, dof, scale)
+
+torch.manual_seed(0)
+np.random.seed(0)
+
+# Unscaled [y0, goal, w] rows and durations of the samples
+inputs = 2*torch.rand(args.samples, division) - 1
+inputs_np = params.scale_tensor[0:division] * (inputs - params.scale_tensor[-1]) + params.scale_tensor[division:2*division]
+rows = inputs_np.view(-1, N+2, dof).transpose(2, 1).contiguous().view(-1, N+2).double()
+tau = np.random.uniform(args.tau[0], args.tau[1], args.samples)
+
+start = time.time()
+buckets = TauBuckets(params.data_tensor, tau_boundaries(tau, args.buckets))
+errors = buckets.bucket_errors(rows, np.repeat(tau, dof))
+print('{} buckets: largest error {:.4f}'.format(len(buckets), errors.max()))
+buckets, errors = buckets.refine(rows, np.repeat(tau, dof), args.tolerance)
+print('Refined to {} buckets in {:.2f} s'.format(len(buckets), time.time() - start))
+print('{:>8} {:>8} {:>8} {:>10}'.format('from', 'to', 'samples', 'max error'))
+counts = np.bincount(buckets.assign(tau).numpy(), minlength=len(buckets))
+for k in range(len(buckets)):
+    print('{:>8.4f} {:>8.4f} {:>8} {:>10.4f}'.format(buckets.boundaries[k], buckets.boundaries[k+1],
+                                                    counts[k], errors[k]))
+failed = errors.max() > args.tolerance
+
+# Finite difference check of the gradients of a batch over several buckets
+data = params.data_tensor.double()
+scaling = params.scale_tensor.double()
+operators = buckets.operators.double()
+sample_buckets = buckets.assign(tau[:4])
+check_inputs = (1.8*torch.rand(4, division, dtype=torch.float64) - 0.9).requires_grad_()
+passed = torch.autograd.gradcheck(lambda x: DMPIntegrator.apply(x, data, operators, scaling, 'buckets', None,
+                                                                sample_buckets),
+                                  (check_inputs,), eps=1e-6, atol=1e-4, rtol=1e-4, raise_exception=False)
+print('gradcheck: {}'.format('passed' if passed else 'FAILED'))
+failed = failed or not passed
+
+# One bucket per batch as Trainer.train_dmp forms them, against the exact per-sample rollout
+def timed(f, inputs):
+    inputs = inputs.clone().requires_grad_()
+    start = time.time()
+    outputs = f(inputs)
+    outputs.backward(torch.ones_like(outputs))
+    return time.time() - start
+
+batch = inputs[:args.batch_size]
+batch_buckets = torch.zeros(args.batch_size, dtype=torch.long)
+tau_batch = torch.cat((torch.ones(args.batch_size, 1), batch), 1)
+bucket_time = timed(lambda x: DMPIntegrator.apply(x, params.data_tensor, buckets.operators, params.scale_tensor,
+                                                  'buckets', None, batch_buckets), batch)
+tau_time = timed(lambda x: DMPIntegrator.apply(x, params.data_tensor, None, params.tau_scale_tensor, 'tau'),
+                 tau_batch)
+print('Forward and backward of {} DMPs with {} time steps:'.format(args.batch_size, params.time_steps))
+print('  bucket operator:        {:.4f} s'.format(bucket_time))
+print('  per-sample tau (exact): {:.4f} s'.format(tau_time))
+
+if failed:
+    print('FAILED')
+    sys.exit(1)
+print('OK')
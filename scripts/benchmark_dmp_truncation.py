@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Check and time the truncated-support evaluation of the DMP basis.
+
+Rolls out and fits random DMPs with the full basis and with only the kernels
+near the phase (see imednet.utils.dmp_basis.BasisCache.support) for several
+numbers of basis functions, and reports the speed-up and the largest forcing
+term and trajectory differences next to the guaranteed bound.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.utils.dmp_basis import basis_cache
+from imednet.utils.dmp_batch import joint, fit_trajectories
+from imednet.utils.dmp_class import DMP
+
+# Parse arguments
+description = 'Check and time the truncated-support evaluation of the DMP basis.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--basis', nargs='+', type=int, default=[25, 50, 100],
+                    help='numbers of basis functions to test (default: 25 50 100)')
+parser.add_argument('--tolerance', type=float, default=1e-6,
+                    help='truncation tolerance (default: 1e-6)')
+parser.add_argument('--batch-size', type=int, default=256,
+                    help='number of random DMPs (default: 256)')
+parser.add_argument('--repeats', type=int, default=3,
+                    help='number of timed repetitions (default: 3)')
+args = parser.parse_args()
+
+dt = 0.01
+rng = np.random.RandomState(0)
+tau = np.repeat(rng.uniform(2, 4, (args.batch_size, 1)), 2, axis=1)
+y0 = rng.uniform(5, 35, (args.batch_size, 2))
+goal = rng.uniform(5, 35, (args.batch_size, 2))
+
+def timed(f):
+    f()
+    start = time.time()
+    for _ in range(args.repeats):
+        result = f()
+    return result, (time.time() - start)/args.repeats
+
+failed = False
+print('tolerance: {}'.format(args.tolerance))
+print('{:>4} {:>4} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}'.format(
+    'N', 'K', 'joint full', 'truncated', 'DMP.joint', 'truncated', 'max |df|', 'bound'))
+for N in args.basis:
+    half_width, _ = basis_cache.support(N, 2, args.tolerance)
+    w = rng.normal(0, 1000, (args.batch_size, N, 2))
+
+    (t, Y, _, _, n), full_time = timed(lambda: joint(tau, y0, goal, w, dt))
+    (_, Y_t, _, _, _), trunc_time = timed(lambda: joint(tau, y0, goal, w, dt, tolerance=args.tolerance))
+
+    # Forcing terms along the phase of every rollout with both bases
+    dfx = np.zeros((args.batch_size, 2))
+    for b in range(args.batch_size):
+        step = tau[b, 0] / n[b]
+        x, psi = basis_cache.phase(N, 2, tau[b, 0], step)
+        _, index, psi_t = basis_cache.truncated_phase(N, 2, tau[b, 0], step, args.tolerance)
+        fx = x[:, None] * np.dot(psi, w[b])
+        fx_t = x[:, None] * np.sum(psi_t[..., None] * w[b][index], axis=1)
+        dfx[b] = np.abs(fx - fx_t).max(axis=0)
+    bound = 2 * args.tolerance * np.abs(w).max(axis=1)
+    failed = failed or np.any(dfx > bound)
+
+    dmp = DMP(N, dt)
+    dmp.values(N, dt, tau[0], y0[0], np.zeros(2), goal[0], w[0])
+    _, dmp_time = timed(dmp.joint)
+    _, dmp_trunc_time = timed(lambda: dmp.joint(tolerance=args.tolerance))
+
+    print('{:>4} {:>4} {:>12.5f} {:>12.5f} {:>12.5f} {:>12.5f} {:>12.3e} {:>12.3e}'.format(
+        N, min(2*half_width+1, N), full_time, trunc_time, dmp_time, dmp_trunc_time,
+        dfx.max(), bound.max()))
+    span = np.ptp(Y, axis=1).max()
+    print('     trajectory difference relative to span: {:.3e}'.format(np.abs(Y - Y_t).max()/span))
+
+    # Fitting the rolled out trajectories again
+    trajectories = [np.column_stack((Y[b, :n[b]], t[b, :n[b], 0])) for b in range(args.batch_size)]
+    (_, _, _, _, w_fit), fit_time = timed(lambda: fit_trajectories(trajectories, N))
+    (_, _, _, _, w_fit_t), fit_trunc_time = timed(lambda: fit_trajectories(trajectories, N, tolerance=args.tolerance))
+    print('     fit: full {:.5f} s, truncated {:.5f} s, relative weight difference {:.3e}'.format(
+        fit_time, fit_trunc_time, np.abs(w_fit - w_fit_t).max()/np.abs(w_fit).max()))
+
+if failed:
+    print('FAILED: forcing term difference above the bound')
+    sys.exit(1)
+print('OK')
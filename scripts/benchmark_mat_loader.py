@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Check and time MatLoader.load_data.
+
+Writes a synthetic S-MNIST .mat file and loads it with the former
+per-sample parsing, with the vectorized parsing and then twice through the
+content-hashed cache in dmp_basis.operator_cache (a cold load that parses
+and stores the arrays, then a warm one that only memory-maps them). All of
+them have to return the same images, outputs, scaling and trajectories.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import scipy.io as sio
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import MatLoader
+from imednet.utils.dmp_basis import operator_cache
+
+
+def legacy_load_data(file, traj_key='trajArray', image_key='imageArray', dmp_params_key='DMPParamsArray'):
+    """MatLoader.load_data with load_original_trajectories before vectorizing it."""
+    data = sio.loadmat(file)['Data']
+    images = []
+    for image in data[image_key][0, 0][0]:
+        images.append(image.astype('float'))
+    images = np.array(images)
+    outputs = []
+    for dmp in data[dmp_params_key][0, 0][0]:
+        learn = np.append(dmp['tau'][0, 0][0, 0], dmp['y0'][0, 0][0])
+        learn = np.append(learn, dmp['goal'][0, 0][0])
+        learn = np.append(learn, dmp['w'][0, 0])
+        outputs.append(learn)
+    outputs = np.array(outputs)
+    x_max = np.array([outputs[:, i].max() for i in range(0, 5)])
+    x_max = np.concatenate((x_max, np.array([outputs[:, 5:].max() for i in range(5, outputs.shape[1])])))
+    x_min = np.array([outputs[:, i].min() for i in range(0, 5)])
+    x_min = np.concatenate((x_min, np.array([outputs[:, 5:].min() for i in range(5, outputs.shape[1])])))
+    scale = x_max - x_min
+    scale[np.where(scale == 0)] = 1
+    outputs = 2 * (outputs - x_min) / scale - 1
+    return images, outputs, (x_min, x_max), [trj for trj in data[traj_key][0, 0][0][:]]
+
+
+def cell(items):
+    array = np.empty((1, len(items)), dtype=object)
+    for i, item in enumerate(items):
+        array[0, i] = item
+    return array
+
+
+# Parse arguments
+description = 'Check and time MatLoader.load_data.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--samples', type=int, default=10000,
+                    help='samples in the .mat file (default: 10000)')
+args = parser.parse_args()
+
+rng = np.random.RandomState(0)
+directory = tempfile.mkdtemp()
+operator_cache.directory = os.path.join(directory, 'cache')
+try:
+    file = os.path.join(directory, 'data.mat')
+    dmps = [{'tau': np.array([[3.0]]), 'w': 500 * rng.randn(25, 2), 'goal': 40 * rng.rand(1, 2),
+             'y0': 40 * rng.rand(1, 2)} for _ in range(args.samples)]
+    sio.savemat(file, {'Data': {'imageArray': cell(list(rng.rand(args.samples, 40, 40))),
+                                'DMPParamsArray': cell(dmps),
+                                'trajArray': cell(list(40 * rng.rand(args.samples, 301, 3)))}})
+    print('{} samples, {:.0f} MB .mat file'.format(args.samples, os.path.getsize(file) / 2.0**20))
+
+    start = time.perf_counter()
+    images, outputs, (x_min, x_max), trajectories = legacy_load_data(file)
+    times = [('legacy', time.perf_counter() - start)]
+    error = 0.0
+    for name, cache in (('vectorized', False), ('cold cache', True), ('warm cache', True)):
+        operator_cache.clear()
+        start = time.perf_counter()
+        loaded = MatLoader.load_data(file, load_original_trajectories=True, cache=cache)
+        times.append((name, time.perf_counter() - start))
+        images_c, outputs_c, scale_c, trajectories_c = loaded
+        assert np.array_equal(images, images_c) and len(trajectories) == len(trajectories_c)
+        assert np.array_equal(x_min, scale_c.x_min) and np.array_equal(x_max, scale_c.x_max)
+        error = max(error, np.abs(outputs - outputs_c).max(),
+                    max(np.abs(t - t_c).max() for t, t_c in zip(trajectories, trajectories_c)))
+
+    for name, seconds in times:
+        print('{:>12}: {:8.3f} s, {:6.1f}x'.format(name, seconds, times[0][1] / seconds))
+    print('Largest difference to the legacy parsing: {:.3e}'.format(error))
+    if error > 0:
+        print('FAILED: the loaded data differs')
+        sys.exit(1)
+    print('OK')
+finally:
+    shutil.rmtree(directory, ignore_errors=True)
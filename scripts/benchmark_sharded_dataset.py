@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Check and time the sharded, memory-mapped dataset.
+
+Writes synthetic .mat files in the 'Data' and the legacy 'slike' layout,
+converts them with imednet.data.shard_loader.convert_mat and compares
+ShardedDataset with MatLoader.load_data. Then streams a larger synthetic
+dataset written with ShardWriter through DataLoaders with several numbers
+of workers and reports samples per second and the growth of the anonymous
+(heap) memory of the training process, which memory-mapped pages do not
+count towards.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import scipy.io as sio
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import MatLoader
+from imednet.data.shard_loader import ShardWriter, ShardedDataset, convert_mat
+
+
+def anonymous_memory():
+    """RssAnon of this process in MB, 0 where /proc is not available."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return 0.0
+
+
+def cell(items):
+    array = np.empty((1, len(items)), dtype=object)
+    for i, item in enumerate(items):
+        array[0, i] = item
+    return array
+
+
+def write_mat(file, count, legacy, rng):
+    images = [rng.randint(0, 256, (40, 40)).astype(np.uint8) for _ in range(count)]
+    dmps = [{'tau': np.array([[3.0]]), 'w': 500 * rng.randn(25, 2), 'goal': 40 * rng.rand(1, 2),
+             'y0': 40 * rng.rand(1, 2)} for _ in range(count)]
+    trajectories = [40 * rng.rand(301, 3) for _ in range(count)]
+    if legacy:
+        sio.savemat(file, {'slike': {'im': cell(images), 'DMP_object': cell(dmps), 'trj': cell(trajectories)}})
+    else:
+        sio.savemat(file, {'Data': {'imageArray': cell(images), 'trans_imageArray': cell(images[::-1]),
+                                    'DMPParamsArray': cell(dmps), 'trajArray': cell(trajectories)}})
+
+
+# Parse arguments
+description = 'Check and time the sharded, memory-mapped dataset.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--samples', type=int, default=500000,
+                    help='samples of the streamed dataset (default: 500000)')
+parser.add_argument('--shard-size', type=int, default=100000,
+                    help='samples per shard (default: 100000)')
+parser.add_argument('--batch-size', type=int, default=140,
+                    help='batch size (default: 140)')
+parser.add_argument('--workers', nargs='+', type=int, default=[0, 2, 4],
+                    help='numbers of DataLoader workers (default: 0 2 4)')
+args = parser.parse_args()
+
+rng = np.random.RandomState(0)
+directory = tempfile.mkdtemp()
+try:
+    # Conversion of both .mat layouts and the trans_* keys
+    error = 0.0
+    for legacy, keys in ((False, {}), (False, {'image_key': 'trans_imageArray'}), (True, {})):
+        file = os.path.join(directory, 'data.mat')
+        write_mat(file, 300, legacy, rng)
+        images, outputs, scale, trajectories = MatLoader.load_data(file, load_original_trajectories=True, **keys)
+        shards = os.path.join(directory, 'converted')
+        shutil.rmtree(shards, ignore_errors=True)
+        convert_mat(file, shards, shard_size=128, load_original_trajectories=True, **keys)
+        for targets, expected in (('outputs', outputs), ('trajectories', np.swapaxes(trajectories, 1, 2)[:, :2])):
+            dataset = ShardedDataset(shards, targets)
+            x, y = dataset[np.arange(len(dataset))]
+            assert np.array_equal(x.numpy(), images) and np.allclose(dataset.scale.x_min, scale.x_min)
+            error = max(error, np.abs(y.numpy() - expected).max() / np.abs(expected).max())
+            x_i, y_i = dataset[len(dataset) - 1]
+            assert np.array_equal(x_i.numpy(), images[-1])
+    print('Largest relative difference to MatLoader.load_data: {:.3e}'.format(error))
+
+    # A larger dataset, written shard by shard without ever being in memory
+    shards = os.path.join(directory, 'streamed')
+    writer = ShardWriter(shards, args.shard_size)
+    chunk = 50000
+    start = time.perf_counter()
+    for i in range(0, args.samples, chunk):
+        n = min(chunk, args.samples - i)
+        writer.append(rng.randint(0, 256, (n, 40, 40)).astype(np.uint8), 100 * rng.randn(n, 55))
+    writer.close()
+    print('Wrote {} samples in {:.1f} s, {:.0f} MB on disk, {:.0f} MB as MatLoader float64 arrays'.format(
+        args.samples, time.perf_counter() - start,
+        sum(os.path.getsize(os.path.join(shards, f)) for f in os.listdir(shards)) / 2.0**20,
+        args.samples * (1600 + 55) * 8 / 2.0**20))
+
+    dataset = ShardedDataset(shards)
+    print('{:>8} {:>14} {:>22}'.format('workers', 'samples/s', 'heap growth [MB]'))
+    for workers in args.workers:
+        before = anonymous_memory()
+        peak = before
+        loader = dataset.loader(batch_size=args.batch_size, workers=workers)
+        start = time.perf_counter()
+        count = 0
+        for x, y in loader:
+            count += len(x)
+            peak = max(peak, anonymous_memory())
+        elapsed = time.perf_counter() - start
+        print('{:>8} {:>14.0f} {:>22.1f}'.format(workers, count / elapsed, peak - before))
+        del loader
+
+    if error > 1e-6:
+        print('FAILED: the converted data differs')
+        sys.exit(1)
+    print('OK')
+finally:
+    shutil.rmtree(directory, ignore_errors=True)
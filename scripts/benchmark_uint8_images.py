@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Check and time uint8 image storage.
+
+Keeps synthetic S-MNIST sized 8-bit images as float64 (the former
+MatLoader.load_data), float32 (the former split views) and uint8, and
+reports their memory, the time of imednet.data.dataset_views.split_views
+and of one epoch of per-batch gathers. Then checks that the models give
+the same outputs for uint8 images normalized by
+encoder_decoder.image_input as for the float images they were given
+before: hand-labeled MNIST images with MNIST_NORMALIZATION and .mat
+images loaded by MatLoader.load_data, which were not normalized.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import scipy.io as sio
+import torch
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.dataset_views import split_views
+from imednet.data.smnist_loader import MatLoader
+from imednet.models.encoder_decoder import EncoderDecoderNet, MNIST_NORMALIZATION
+
+
+def cell(items):
+    array = np.empty((1, len(items)), dtype=object)
+    for i, item in enumerate(items):
+        array[0, i] = item
+    return array
+
+
+# Parse arguments
+description = 'Check and time uint8 image storage.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--data-size', type=int, default=60000,
+                    help='number of images (default: 60000)')
+parser.add_argument('--image-size', type=int, default=40,
+                    help='image width and height (default: 40)')
+parser.add_argument('--batch-size', type=int, default=140,
+                    help='batch size (default: 140)')
+args = parser.parse_args()
+
+torch.set_num_threads(1)
+rng = np.random.RandomState(0)
+pixels = rng.randint(0, 256, (args.data_size, args.image_size, args.image_size))
+outputs = rng.rand(args.data_size, 55)
+indeks = rng.choice(3, args.data_size, p=[0.7, 0.15, 0.15])
+
+print('{:>8} {:>12} {:>12} {:>14}'.format('dtype', 'images [MB]', 'split [ms]', 'gathers [ms]'))
+for dtype in (np.float64, np.float32, np.uint8):
+    images = pixels.astype(dtype)
+    start = time.perf_counter()
+    x_train, y_train = split_views(images, outputs, indeks)[:2]
+    split_time = time.perf_counter() - start
+    start = time.perf_counter()
+    permutation = torch.randperm(len(x_train))
+    for i in range(0, len(x_train), args.batch_size):
+        x = x_train[permutation[i:i + args.batch_size]]
+    epoch_time = time.perf_counter() - start
+    print('{:>8} {:>12.1f} {:>12.1f} {:>14.1f}'.format(np.dtype(dtype).name, images.nbytes / 2.0**20,
+                                                       1000 * split_time, 1000 * epoch_time))
+
+# Hand-labeled MNIST images, normalized to x/128 - 1 by Trainer.get_data_for_network before
+error = 0.0
+images = pixels[:1000, :28, :28].reshape(-1, 784)
+model = EncoderDecoderNet([784, 200, 55])
+expected = model(torch.from_numpy(images).float() / 128 - 1)
+model.image_normalization = MNIST_NORMALIZATION
+error = max(error, (model(torch.from_numpy(images.astype(np.uint8))) - expected).abs().max().item())
+
+# .mat images, given to the models as they are stored
+directory = tempfile.mkdtemp()
+try:
+    file = os.path.join(directory, 'data.mat')
+    dmps = [{'tau': np.array([[3.0]]), 'w': 500 * rng.randn(25, 2), 'goal': 40 * rng.rand(1, 2),
+             'y0': 40 * rng.rand(1, 2)} for _ in range(300)]
+    sio.savemat(file, {'Data': {'imageArray': cell(list(pixels[:300].astype(np.uint8))),
+                                'DMPParamsArray': cell(dmps)}})
+    images = MatLoader.load_data(file, cache=False, uint8=True)[0]
+    assert images.dtype == np.uint8 and np.array_equal(images, pixels[:300])
+    model = EncoderDecoderNet([args.image_size ** 2, 200, 55])
+    expected = model(torch.from_numpy(images.astype('float')).float().reshape(len(images), -1))
+    error = max(error, (model(torch.from_numpy(images).reshape(len(images), -1)) - expected).abs().max().item())
+finally:
+    shutil.rmtree(directory, ignore_errors=True)
+
+print('Largest difference of the model outputs to float images: {:.3e}'.format(error))
+if error > 1e-5:
+    print('FAILED: the model outputs differ')
+    sys.exit(1)
+print('OK')
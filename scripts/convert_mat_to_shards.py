@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Convert .mat image/trajectory data into memory-mapped shards.
+
+Writes the images, DMP parameters and optionally the original trajectories
+of one or more .mat files (the current 'Data' and the legacy 'slike'
+layout) into the shards read by imednet.data.shard_loader.ShardedDataset
+and Trainer.train_stream.
+"""
+from __future__ import print_function
+
+import sys
+import argparse
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.shard_loader import convert_mat
+
+# Parse arguments
+description = 'Convert .mat image/trajectory data into memory-mapped shards.'
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('data_paths', nargs='+', type=str,
+                    help='.mat files to convert into one dataset')
+parser.add_argument('--output-path', type=str, required=True,
+                    help='directory of the shards')
+parser.add_argument('--shard-size', type=int, default=100000,
+                    help='samples per shard (default: 100000)')
+parser.add_argument('--dof', type=int, default=2,
+                    help='number of DOF of the DMPs (default: 2)')
+parser.add_argument('--use-transformed-images', action='store_true', default=False,
+                    help='use transformed images from the loaded dataset')
+parser.add_argument('--use-transformed-trajectories', action='store_true', default=False,
+                    help='use transformed trajectories/DMPs from the loaded dataset')
+parser.add_argument('--no-trajectories', action='store_true', default=False,
+                    help='do not store the original trajectories')
+args = parser.parse_args()
+
+keys = {}
+if args.use_transformed_images:
+    keys['image_key'] = 'trans_imageArray'
+if args.use_transformed_trajectories:
+    keys.update(traj_key='trans_trajArray',
+                dmp_params_key='TransDMPParamsArray',
+                dmp_traj_key='TransDMPTrajArray')
+
+index = convert_mat(args.data_paths, args.output_path, args.shard_size,
+                    load_original_trajectories=not args.no_trajectories, dof=args.dof, **keys)
+print('Wrote {} samples in {} shards to {}'.format(sum(shard['size'] for shard in index['shards']),
+                                                  len(index['shards']), args.output_path))
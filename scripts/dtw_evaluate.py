@@ -124,11 +124,13 @@ dtw_error = np.array([])
 try:
     # Reshape the original trajectory data into vector trajectories.
     test_output_traj_vectors = np.transpose(test_output.reshape(int(test_output.shape[0]/2), 2, test_output.shape[1]), (0,2,1))
+    # Integrate all predicted DMPs in one batch
+    predicted_dmp_params = torch.cat((-torch.ones(model_output.shape[0], 1), model_output.detach().cpu()), 1)
+    predicted_dmps = trainer.create_dmp_set(predicted_dmp_params, model.scale, 0.01, 25)
+    _, predicted_Y, _, _, time_steps = predicted_dmps.joint()
     for i in range(0, test_output_traj_vectors.shape[0]):
-        predicted_dmp_params = torch.cat((torch.tensor([-1]).float().cpu(), model_output[i, :].cpu()), 0)
-        predicted_dmp = trainer.create_dmp(predicted_dmp_params, model.scale, 0.01, 25, True)
-        predicted_dmp.joint()
-        b, b1, b2, b3 = dtw(test_output_traj_vectors[i], predicted_dmp.Y, dist=custom_norm)
+        b, b1, b2, b3 = dtw(test_output_traj_vectors[i], predicted_Y[i, :time_steps[i]], dist=custom_norm)
+        dtw_error = np.append(dtw_error, b)
 except:
     # Try interpreting the output as trajectories
     try:
@@ -19,7 +19,7 @@ import numpy as np
 from os.path import dirname, realpath
 sys.path.append(dirname(dirname(realpath(__file__))))
 
-from imednet.models.encoder_decoder import CNNEncoderDecoderNet, FullCNNEncoderDecoderNet, TrainingParameters
+from imednet.models.encoder_decoder import CNNEncoderDecoderNet, FullCNNEncoderDecoderNet, TrainingParameters, MNIST_NORMALIZATION
 from imednet.data.smnist_loader import MatLoader
 from imednet.data.trajectory_loader import TrajectoryLoader
 from imednet.trainers.encoder_decoder_trainer import Trainer
@@ -140,7 +140,7 @@ if args.load_hand_labeled_mnist_data:
 
     # Load and scale data
     print('Loading and scaling data...')
-    images, outputs, scale = Trainer.get_data_for_network(sample_mnist_images, sample_dmps)
+    images, outputs, scale = Trainer.get_data_for_network(sample_mnist_images, sample_dmps, uint8=True)
     input_size = 784
     # output_size = 2*N + 7
     output_size = 2*N + 6
@@ -157,20 +157,20 @@ else:
                                                             traj_key='trans_trajArray',
                                                             dmp_params_key='TransDMPParamsArray',
                                                             dmp_traj_key='TransDMPTrajArray',
-                                                            load_original_trajectories=True)
+                                                            load_original_trajectories=True, uint8=True)
     elif args.use_transformed_images:
         images, outputs, scale, or_tr = MatLoader.load_data(args.data_path,
                                                             image_key='trans_imageArray',
-                                                            load_original_trajectories=True)
+                                                            load_original_trajectories=True, uint8=True)
     elif args.use_transformed_trajectories:
         images, outputs, scale, or_tr = MatLoader.load_data(args.data_path,
                                                             traj_key='trans_trajArray',
                                                             dmp_params_key='TransDMPParamsArray',
                                                             dmp_traj_key='TransDMPTrajArray',
-                                                            load_original_trajectories=True)
+                                                            load_original_trajectories=True, uint8=True)
     else:
         images, outputs, scale, or_tr = MatLoader.load_data(args.data_path,
-                                                            load_original_trajectories=True)
+                                                            load_original_trajectories=True, uint8=True)
     input_size = images.shape[1] * images.shape[2]
     output_size = 2*N + 4
 
@@ -184,6 +184,10 @@ if args.network_type == 'full':
 else:
     model = CNNEncoderDecoderNet(args.cnn_model_load_path, layer_sizes, scale)
 
+# The hand-labeled MNIST images stay uint8, the model normalizes them
+if args.load_hand_labeled_mnist_data:
+    model.image_normalization = MNIST_NORMALIZATION
+
 # Freeze pretrained CNN weights
 if not args.end_to_end:
     print('Freezing pretrained CNN weights!')
@@ -250,7 +254,8 @@ np.save(os.path.join(args.model_save_path, 'layer_sizes'), np.asarray(layer_size
 # Save data scaling to file
 # TODO: Fix this mess later.
 if args.load_hand_labeled_mnist_data:
-    np.save(os.path.join(args.model_save_path, 'scale'), scale)    
+    np.save(os.path.join(args.model_save_path, 'scale'), scale)
+    np.save(os.path.join(args.model_save_path, 'image_normalization'), np.asarray(MNIST_NORMALIZATION))
 else:
     np.save(os.path.join(args.model_save_path, 'scale_x_min'), scale.x_min)
     np.save(os.path.join(args.model_save_path, 'scale_x_max'), scale.x_max)
@@ -22,9 +22,11 @@ from trajectory_loader import TrajectoryLoader
 
 sys.path.append(dirname(dirname(realpath(__file__))))
 
-from imednet.models.encoder_decoder import DMPEncoderDecoderNet, TrainingParameters
+from imednet.models.encoder_decoder import DMPEncoderDecoderNet, TrainingParameters, MNIST_NORMALIZATION
 from imednet.trainers.encoder_decoder_trainer import Trainer
+from imednet.trainers.distributed import launch
 from imednet.data.smnist_loader import MatLoader
+from imednet.data.shard_loader import ShardedDataset
 
 # Save datetime
 date = datetime.now()
@@ -56,6 +58,10 @@ parser.add_argument('--model-save-path', type=str, default=default_model_save_pa
                     help='model save path (default: "{}")'.format(str(default_model_save_path)))
 parser.add_argument('--model-load-path', type=str, default=None,
                     help='model load path (default: "{}")'.format(str(default_model_load_path)))
+parser.add_argument('--data-shards', type=str, default=None,
+                    help='stream the data from shards written by convert_mat_to_shards.py instead')
+parser.add_argument('--workers', type=int, default=4,
+                    help='DataLoader workers reading the data shards (default: 4)')
 parser.add_argument('--use-transformed-images', action='store_true', default=False,
                     help='use transformed images from the loaded dataset')
 parser.add_argument('--use-transformed-trajectories', action='store_true', default=False,
@@ -68,6 +74,8 @@ parser.add_argument('--plot-freq', type=int, default=0,
                     help='set tensorboard plot visualization frequency (default: 0)')
 parser.add_argument('--device', type=int, default=0,
                     help='select CUDA device (default: 0)')
+parser.add_argument('--processes', type=int, default=1,
+                    help='data-parallel training processes on the CPU cores of this host (default: 1)')
 parser.add_argument('--batch-size', type=int, default=default_batch_size,
                     help='batch size (default: "{}")'.format(str(default_batch_size)))
 parser.add_argument('--optimizer', type=str, default=default_optimizer,
@@ -85,6 +93,8 @@ parser.add_argument('--val-fail', type=int, default=default_val_fail,
 parser.add_argument('--hidden-layer-sizes', nargs='+', default=default_hidden_layer_sizes,
                     help='hidden layer sizes (default: {})'.format(' '.join(default_hidden_layer_sizes)))
 args = parser.parse_args()
+if args.data_shards and args.processes > 1:
+    parser.error('--processes does not apply to --data-shards')
 
 # Append the current date/time to any user-defined model save path
 args.model_save_path = args.model_save_path + ' ' + str(date)
@@ -130,7 +140,7 @@ if args.load_hand_labeled_mnist_data:
 
     # Load and scale data
     print('Loading and scaling data...')
-    images, outputs, scale = Trainer.get_data_for_network(sample_mnist_images, sample_dmps)
+    images, outputs, scale = Trainer.get_data_for_network(sample_mnist_images, sample_dmps, uint8=True)
     input_size = 784
     # output_size = 2*N + 7
     output_size = 2*N + 6
@@ -140,6 +150,12 @@ if args.load_hand_labeled_mnist_data:
     outputs = outputs.numpy()
 
     print('...finished loading hand-labeled MNIST data!')
+elif args.data_shards:
+    dataset = ShardedDataset(args.data_shards, targets='trajectories')
+    scale = dataset.scale
+    image_shape = dataset[0][0].shape
+    input_size = image_shape[0] * image_shape[1]
+    output_size = 2*N + 4
 else:
     if args.use_transformed_images and args.use_transformed_trajectories:
         images, outputs, scale, or_tr = MatLoader.load_data(args.data_path,
@@ -147,20 +163,20 @@ else:
                                                             traj_key='trans_trajArray',
                                                             dmp_params_key='TransDMPParamsArray',
                                                             dmp_traj_key='TransDMPTrajArray',
-                                                            load_original_trajectories=True)
+                                                            load_original_trajectories=True, uint8=True)
     elif args.use_transformed_images:
         images, outputs, scale, or_tr = MatLoader.load_data(args.data_path,
                                                             image_key='trans_imageArray',
-                                                            load_original_trajectories=True)
+                                                            load_original_trajectories=True, uint8=True)
     elif args.use_transformed_trajectories:
         images, outputs, scale, or_tr = MatLoader.load_data(args.data_path,
                                                             traj_key='trans_trajArray',
                                                             dmp_params_key='TransDMPParamsArray',
                                                             dmp_traj_key='TransDMPTrajArray',
-                                                            load_original_trajectories=True)
+                                                            load_original_trajectories=True, uint8=True)
     else:
         images, outputs, scale, or_tr = MatLoader.load_data(args.data_path,
-                                                            load_original_trajectories=True)
+                                                            load_original_trajectories=True, uint8=True)
     input_size = images.shape[1] * images.shape[2]
     output_size = 2*N + 4
 
@@ -175,6 +191,10 @@ model.register_buffer('DMPp', model.DMPparam.data_tensor)
 model.register_buffer('scale_t', model.DMPparam.scale_tensor)
 model.register_buffer('param_grad', model.DMPparam.grad_tensor)
 
+# The hand-labeled MNIST images stay uint8, the model normalizes them
+if args.load_hand_labeled_mnist_data:
+    model.image_normalization = MNIST_NORMALIZATION
+
 # Initialize the model
 if args.model_load_path:
     net_params_path = os.path.join(args.model_load_path, 'net_parameters')
@@ -200,6 +220,9 @@ train_param.training_ratio = 0.7
 train_param.validation_ratio = 0.15
 train_param.test_ratio = 0.15
 train_param.val_fail = 60
+if args.processes > 1:
+    # data-parallel training runs on CPU processes
+    train_param.cuda = False
 trainer = Trainer(launch_tensorboard=args.launch_tensorboard,
                   launch_gui=args.launch_gui,
                   plot_freq=args.plot_freq)
@@ -232,7 +255,8 @@ np.save(os.path.join(args.model_save_path, 'layer_sizes'), np.asarray(layer_size
 # Save data scaling to file
 # TODO: Fix this mess later.
 if args.load_hand_labeled_mnist_data:
-    np.save(os.path.join(args.model_save_path, 'scale'), scale)    
+    np.save(os.path.join(args.model_save_path, 'scale'), scale)
+    np.save(os.path.join(args.model_save_path, 'image_normalization'), np.asarray(MNIST_NORMALIZATION))
 else:
     np.save(os.path.join(args.model_save_path, 'scale_x_min'), scale.x_min)
     np.save(os.path.join(args.model_save_path, 'scale_x_max'), scale.x_max)
@@ -249,23 +273,46 @@ if args.model_load_path:
     net_indeks_path = os.path.join(args.model_load_path, 'net_indeks.npy')
     trainer.indeks = np.load(net_indeks_path)
 
-original_traj = []
-for i in range(0,images.shape[0]):
-    c,c1,c2 = zip(*or_tr[i])
-    original_traj.append(c)
-    original_traj.append(c1)
-
-best_nn_parameters = trainer.train_dmp(model,
-                                       images,
-                                       original_traj,
-                                       args.model_save_path,
-                                       train_param,
-                                       net_description_file,
-                                       optimizer_type=args.optimizer,
-                                       learning_rate=args.learning_rate,
-                                       momentum=args.momentum,
-                                       lr_decay=args.lr_decay,
-                                       weight_decay=args.weight_decay)
+if args.data_shards:
+    best_nn_parameters = trainer.train_stream(model,
+                                              dataset,
+                                              args.model_save_path,
+                                              train_param,
+                                              net_description_file,
+                                              optimizer_type=args.optimizer,
+                                              learning_rate=args.learning_rate,
+                                              momentum=args.momentum,
+                                              lr_decay=args.lr_decay,
+                                              weight_decay=args.weight_decay,
+                                              workers=args.workers)
+else:
+    original_traj = []
+    for i in range(0,images.shape[0]):
+        c,c1,c2 = zip(*or_tr[i])
+        original_traj.append(c)
+        original_traj.append(c1)
+
+    def train():
+        best_nn_parameters = trainer.train_dmp(model,
+                                               images,
+                                               original_traj,
+                                               args.model_save_path,
+                                               train_param,
+                                               net_description_file,
+                                               optimizer_type=args.optimizer,
+                                               learning_rate=args.learning_rate,
+                                               momentum=args.momentum,
+                                               lr_decay=args.lr_decay,
+                                               weight_decay=args.weight_decay)
+        # the forked processes do not flush it when they exit
+        net_description_file.flush()
+        return best_nn_parameters, trainer.indeks
+
+    if args.processes > 1:
+        net_description_file.flush()
+        best_nn_parameters, trainer.indeks = launch(train, args.processes)
+    else:
+        best_nn_parameters, trainer.indeks = train()
 
 # Save model
 np.save(os.path.join(args.model_save_path, 'net_indeks'), trainer.indeks)
@@ -21,6 +21,7 @@ sys.path.append(dirname(dirname(realpath(__file__))))
 
 from imednet.models.encoder_decoder import EncoderDecoderNet, TrainingParameters
 from imednet.trainers.encoder_decoder_trainer import Trainer
+from imednet.trainers.distributed import launch
 from imednet.data.smnist_loader import MatLoader
 
 # Save datetime
@@ -62,6 +63,8 @@ parser.add_argument('--plot-freq', type=int, default=0,
                     help='set tensorboard plot visualization frequency (default: 0)')
 parser.add_argument('--device', type=int, default=0,
                     help='select CUDA device (default: 0)')
+parser.add_argument('--processes', type=int, default=1,
+                    help='data-parallel training processes on the CPU cores of this host (default: 1)')
 parser.add_argument('--batch-size', type=int, default=default_batch_size,
                     help='batch size (default: "{}")'.format(str(default_batch_size)))
 parser.add_argument('--optimizer', type=str, default=default_optimizer,
@@ -91,7 +94,7 @@ net_description_file = open(net_description_save_path, 'w')
 net_description_file.write('Network created: ' + str(date))
 
 # Load data and scale it
-images, outputs, scale, or_tr = MatLoader.load_data(args.data_path)
+images, outputs, scale, or_tr = MatLoader.load_data(args.data_path, uint8=True)
 
 # Set up DMP parameters
 N = 25
@@ -131,6 +134,9 @@ train_param.training_ratio = 0.7
 train_param.validation_ratio = 0.15
 train_param.test_ratio = 0.15
 train_param.val_fail = 60
+if args.processes > 1:
+    # data-parallel training runs on CPU processes
+    train_param.cuda = False
 trainer = Trainer(launch_tensorboard=args.launch_tensorboard,
                   launch_gui=args.launch_gui,
                   plot_freq=args.plot_freq)
@@ -174,17 +180,27 @@ if args.model_load_path:
     trainer.indeks = np.load(net_indeks_path)
 
 # Train
-best_nn_parameters = trainer.train(model,
-                                   images,
-                                   outputs,
-                                   args.model_save_path,
-                                   train_param,
-                                   net_description_file,
-                                   optimizer_type=args.optimizer,
-                                   learning_rate=args.learning_rate,
-                                   momentum=args.momentum,
-                                   lr_decay=args.lr_decay,
-                                   weight_decay=args.weight_decay)
+def train():
+    best_nn_parameters = trainer.train(model,
+                                       images,
+                                       outputs,
+                                       args.model_save_path,
+                                       train_param,
+                                       net_description_file,
+                                       optimizer_type=args.optimizer,
+                                       learning_rate=args.learning_rate,
+                                       momentum=args.momentum,
+                                       lr_decay=args.lr_decay,
+                                       weight_decay=args.weight_decay)
+    # the forked processes do not flush it when they exit
+    net_description_file.flush()
+    return best_nn_parameters, trainer.indeks
+
+if args.processes > 1:
+    net_description_file.flush()
+    best_nn_parameters, trainer.indeks = launch(train, args.processes)
+else:
+    best_nn_parameters, trainer.indeks = train()
 
 # Save model
 np.save(os.path.join(args.model_save_path, 'net_indeks'), trainer.indeks)
@@ -0,0 +1,22 @@
+import sys
+import numpy as np
+import pytest
+
+from os.path import dirname, realpath
+sys.path.append(dirname(dirname(realpath(__file__))))
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils.dmp_layer_no_cuda import DMPParameters
+
+
+@pytest.fixture
+def dmp_parameters():
+    """DMPParameters(N, tau, 0.01, dof) with a scaling similar to the S-MNIST datasets."""
+    def make(N, dof, tau):
+        scale = Mapping()
+        scale.x_max = np.concatenate(([tau], 30*np.ones(2*dof), 2000*np.ones(N*dof)))
+        scale.x_min = np.concatenate(([tau], -30*np.ones(2*dof), -2000*np.ones(N*dof)))
+        scale.y_max = 1
+        scale.y_min = -1
+        return DMPParameters(N, tau, 0.01, dof, scale)
+    return make
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from imednet.utils import dmp_batch
+from imednet.utils.dmp_class import DMP
+
+
+def trajectories(rng, lengths):
+    """Smooth [x, y, t] trajectories of the given lengths with jittered sample times."""
+    result = []
+    for length in lengths:
+        t = np.cumsum(np.r_[0, 0.01 + 0.002 * rng.rand(length - 1)])
+        phase = t / t[-1]
+        xy = np.stack([np.sin((k + 1) * np.pi * phase + rng.rand()) * rng.rand() * 20 + 20 * phase
+                       for k in range(2)], axis=1)
+        result.append(np.column_stack((xy, t)))
+    return result
+
+
+def tracked(trajectory, N):
+    """DMP.track on the finite differences Trainer.create_dmps used."""
+    dmp = DMP(N, 0.01)
+    dt = np.diff(trajectory[:, 2])
+    velocity = np.diff(trajectory[:, :2], axis=0) / dt[:, None]
+    acceleration = np.diff(velocity, axis=0) / dt[:-1, None]
+    time = np.column_stack((trajectory[:, 2], trajectory[:, 2]))[:-2]
+    dmp.track(time, trajectory[:-2, :2], velocity[:-1], acceleration)
+    return dmp
+
+
+def random_dmps(rng, count, N, dof):
+    """DMPs with a different tau for every DOF and DMP, so the rollouts have different lengths."""
+    dmps = []
+    for _ in range(count):
+        dmp = DMP(N, 0.01)
+        dmp.values(N, 0.01, 1 + 2 * rng.rand(dof), 40 * rng.rand(dof), rng.randn(dof), 40 * rng.rand(dof),
+                   500 * rng.randn(N, dof))
+        dmps.append(dmp)
+    return dmps
+
+
+def test_fit_trajectories():
+    rng = np.random.RandomState(0)
+    data = trajectories(rng, rng.randint(150, 320, 8))
+    tau, y0, dy0, goal, w = dmp_batch.fit_trajectories(data, 25)
+    for i, trajectory in enumerate(data):
+        dmp = tracked(trajectory, 25)
+        for expected, actual in ((dmp.tau, tau[i]), (dmp.y0, y0[i]), (dmp.dy0, dy0[i]), (dmp.goal, goal[i])):
+            assert np.array_equal(actual, expected)
+        assert np.abs(w[i] - dmp.w).max() <= 1e-12 * np.abs(dmp.w).max()
+
+
+def test_fit_padded_trajectories():
+    rng = np.random.RandomState(1)
+    data = trajectories(rng, rng.randint(150, 320, 5))
+    padded, lengths = dmp_batch.pad_trajectories(data)
+    ragged = dmp_batch.fit_trajectories(data, 25)
+    for expected, actual in zip(ragged, dmp_batch.fit_trajectories(padded, 25, lengths)):
+        assert np.array_equal(actual, expected)
+
+
+@pytest.mark.parametrize('N,dof', [(25, 2), (10, 3)])
+def test_joint(N, dof):
+    rng = np.random.RandomState(2)
+    dmps = random_dmps(rng, 6, N, dof)
+    tau = np.array([dmp.tau for dmp in dmps])
+    t, Y, dY, ddY, time_steps = dmp_batch.joint(tau, [dmp.y0 for dmp in dmps], [dmp.goal for dmp in dmps],
+                                                [dmp.w for dmp in dmps], 0.01, [dmp.dy0 for dmp in dmps])
+    assert len(set(time_steps)) > 1
+    for i, dmp in enumerate(dmps):
+        dmp.joint()
+        n = time_steps[i]
+        assert n == len(dmp.Y)
+        for expected, actual in ((dmp.t, t[i]), (dmp.Y, Y[i]), (dmp.dY, dY[i]), (dmp.ddY, ddY[i])):
+            assert np.abs(actual[:n] - expected).max() <= 1e-12 * max(np.abs(expected).max(), 1)
+        # the padding holds the final state
+        assert np.array_equal(Y[i, n:], np.broadcast_to(Y[i, n - 1], Y[i, n:].shape))
+        assert not dY[i, n:].any() and not ddY[i, n:].any()
+
+
+def test_joint_dmps():
+    rng = np.random.RandomState(3)
+    dmps = random_dmps(rng, 5, 25, 2)
+    expected = random_dmps(np.random.RandomState(3), 5, 25, 2)
+    dmp_batch.joint_dmps(dmps)
+    for dmp, reference in zip(dmps, expected):
+        reference.joint()
+        for name in ('t', 'Y', 'dY', 'ddY'):
+            actual, wanted = getattr(dmp, name), getattr(reference, name)
+            assert actual.shape == wanted.shape
+            assert np.abs(actual - wanted).max() <= 1e-12 * max(np.abs(wanted).max(), 1)
+
+
+def test_semi_implicit_acceleration():
+    rng = np.random.RandomState(4)
+    dmps = random_dmps(rng, 4, 25, 2)
+    tau = np.array([dmp.tau for dmp in dmps])
+    # Euler diverges above dt = 4*tau/a_z, the semi-implicit integrator does not
+    for dt in (0.01, 0.2):
+        t, Y, dY, ddY, time_steps = dmp_batch.joint(tau, [dmp.y0 for dmp in dmps], [dmp.goal for dmp in dmps],
+                                                    [dmp.w for dmp in dmps], dt, [dmp.dy0 for dmp in dmps],
+                                                    integrator='semi-implicit')
+        for i, n in enumerate(time_steps):
+            # the accelerations are those of the implicit velocity update
+            # (like DMP.joint, dY starts with the scaled velocity z)
+            step = np.diff(t[i, :n], axis=0)
+            assert np.allclose(np.diff(dY[i, 1:n], axis=0), ddY[i, 1:n - 1] * step[1:], rtol=1e-10, atol=1e-9)
+            assert np.all(np.isfinite(Y[i])) and np.abs(Y[i] - dmps[i].goal).max() < 1e3
@@ -0,0 +1,49 @@
+import torch
+
+from imednet.utils.dmp_buckets import TauBuckets, bucket_backward, bucket_rollout
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator, operator_rollout
+
+
+def test_single_bucket_is_the_rollout_operator(dmp_parameters):
+    params = dmp_parameters(25, 2, 3)
+    buckets = TauBuckets(params.data_tensor, [2.9, 3.1])
+    assert buckets.operators.shape == (1,) + params.grad_tensor.shape
+    expected = params.grad_tensor
+    assert (buckets.operators[0] - expected).abs().max() <= 1e-5 * expected.abs().max()
+
+    torch.manual_seed(0)
+    inputs = (2*torch.rand(8, 54) - 1).requires_grad_()
+    sample_buckets = buckets.assign(3 + 0.05*torch.randn(8).clamp(-1, 1))
+    assert not sample_buckets.any()
+    expected = DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.scale_tensor)
+    outputs = DMPIntegrator.apply(inputs, params.data_tensor, buckets.operators, params.scale_tensor, 'buckets',
+                                  None, sample_buckets)
+    assert (outputs - expected).abs().max() <= 1e-4 * expected.abs().max()
+
+    grad_outputs = torch.randn_like(expected)
+    expected_grad, = torch.autograd.grad(expected, inputs, grad_outputs)
+    grad, = torch.autograd.grad(outputs, inputs, grad_outputs)
+    assert (grad - expected_grad).abs().max() <= 1e-4 * expected_grad.abs().max()
+
+
+def test_bucket_rollout_and_backward_per_bucket(dmp_parameters):
+    dof = 2
+    params = dmp_parameters(25, dof, 3)
+    buckets = TauBuckets(params.data_tensor, [1.5, 2, 2.5, 3])
+    torch.manual_seed(1)
+    inputs_np = 100*torch.randn(12, dof*27)
+    tau = 1.5 + 1.5*torch.rand(12)
+    sample_buckets = buckets.assign(tau)
+    assert len(torch.unique(sample_buckets)) == 3
+
+    outputs = bucket_rollout(inputs_np, params.data_tensor, buckets.operators, sample_buckets)
+    grad_outputs = torch.randn_like(outputs)
+    row_grads = bucket_backward(grad_outputs, buckets.operators, sample_buckets, dof)
+    assert outputs.shape == (dof*12, params.time_steps) and row_grads.shape == (dof*12, 27)
+    row_buckets = sample_buckets.repeat_interleave(dof)
+    for k in range(len(buckets)):
+        rows = (row_buckets == k).nonzero()[:, 0]
+        samples = (sample_buckets == k).nonzero()[:, 0]
+        expected = operator_rollout(inputs_np[samples], params.data_tensor, buckets.operators[k])
+        assert torch.allclose(outputs[rows], expected, rtol=1e-5, atol=1e-5 * expected.abs().max().item())
+        assert torch.allclose(row_grads[rows], torch.mm(grad_outputs[rows], buckets.operators[k]), rtol=1e-6, atol=1e-6)
@@ -0,0 +1,89 @@
+import numpy as np
+
+from imednet.utils import dmp_batch
+from imednet.utils.dmp_cache import RolloutCache
+from imednet.utils.dmp_class import DMP
+
+
+def random_parameters(rng, count, N=25, dof=2):
+    return (1 + 2 * rng.rand(count, dof), 40 * rng.rand(count, dof), 40 * rng.rand(count, dof),
+            500 * rng.randn(count, N, dof))
+
+
+def make_dmp(tau, y0, goal, w):
+    dmp = DMP(w.shape[0], 0.01)
+    dmp.values(w.shape[0], 0.01, tau, y0, np.zeros_like(y0), goal, w)
+    return dmp
+
+
+def test_joint_hits_and_copies():
+    cache = RolloutCache()
+    tau, y0, goal, w = random_parameters(np.random.RandomState(0), 2)
+    reference = make_dmp(tau[0], y0[0], goal[0], w[0])
+    reference.joint()
+
+    first = make_dmp(tau[0], y0[0], goal[0], w[0])
+    first.joint(cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    second = make_dmp(tau[0], y0[0], goal[0], w[0])
+    second.joint(cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    make_dmp(tau[1], y0[1], goal[1], w[1]).joint(cache=cache)
+    assert (cache.hits, cache.misses, cache.info()['size']) == (1, 2, 2)
+
+    for dmp in (first, second):
+        for name in ('t', 'Y', 'dY', 'ddY'):
+            assert np.array_equal(getattr(dmp, name), getattr(reference, name))
+    # a hit gets its own writable arrays, changing them leaves the cache alone
+    assert second.Y.flags.writeable and not np.shares_memory(first.Y, second.Y)
+    second.Y[:] = 0
+    first.Y[:] = 0
+    third = make_dmp(tau[0], y0[0], goal[0], w[0])
+    third.joint(cache=cache)
+    assert np.array_equal(third.Y, reference.Y)
+
+
+def test_batch_joint_rolls_out_repeated_keys_once(monkeypatch):
+    cache = RolloutCache()
+    tau, y0, goal, w = random_parameters(np.random.RandomState(1), 3)
+    order = [0, 1, 0, 2, 1, 0]
+    expected = dmp_batch.joint(tau[order], y0[order], goal[order], w[order], 0.01)
+
+    rolled_out = []
+    joint = dmp_batch.joint
+
+    def counting_joint(tau, *args, **kwargs):
+        rolled_out.append(len(tau))
+        return joint(tau, *args, **kwargs)
+
+    monkeypatch.setattr(dmp_batch, 'joint', counting_joint)
+    result = cache.batch_joint(tau[order], y0[order], goal[order], w[order], 0.01)
+    assert rolled_out == [3]
+    assert (cache.hits, cache.misses) == (0, 6)
+    for actual, wanted in zip(result, expected):
+        assert np.array_equal(actual, wanted)
+
+    # everything is cached now, nothing is rolled out
+    result = cache.batch_joint(tau[order], y0[order], goal[order], w[order], 0.01)
+    assert rolled_out == [3]
+    assert cache.hits == 6
+    for actual, wanted in zip(result, expected):
+        assert np.array_equal(actual, wanted)
+        assert actual.flags.writeable
+    # repeated samples of a batch do not share memory
+    result[1][0] = 0
+    assert np.array_equal(result[1][2], expected[1][2])
+
+
+def test_quantization_and_eviction():
+    cache = RolloutCache(maxsize=2, quantization=1e-6)
+    tau, y0, goal, w = random_parameters(np.random.RandomState(2), 3)
+
+    def key(shift):
+        return cache.key(tau[0], y0[0] + shift, 0, goal[0], w[0], 0.01)
+
+    assert key(0) == key(1e-9) and key(0) != key(1e-3)
+    cache.batch_joint(tau, y0, goal, w, 0.01)
+    assert cache.info()['size'] == 2 and cache.evictions == 1
+    cache.clear()
+    assert cache.info()['size'] == 0 and cache.nbytes == 0
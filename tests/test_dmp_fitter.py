@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from imednet.utils import dmp_batch
+from imednet.utils.dmp_class import DMP, DMPFitter
+
+
+@pytest.mark.parametrize('samples, dof', [(300, 2), (500, 3)])
+def test_fitter_matches_track(samples, dof):
+    N = 25
+    rng = np.random.RandomState(0)
+    t = np.cumsum(np.r_[0, rng.uniform(0.8, 1.2, samples - 1)])
+    t = 3 * t / t[-1]
+    s = t / t[-1]
+    y = sum(rng.randn(dof) * np.sin(np.pi * f * s[:, None] + rng.rand(dof)) / f for f in range(1, 6))
+    trajectory = np.column_stack((10 * y, t))
+
+    t_d, y_d, yd_d, ydd_d, _ = dmp_batch.derivatives([trajectory])
+    reference = DMP(N, 0.01)
+    reference.track(np.repeat(t_d[0][:, None], dof, axis=1), y_d[0], yd_d[0], ydd_d[0])
+
+    fitter = DMPFitter(N, 0.01, t_d[0, -1], dof)
+    for sample in trajectory:
+        fitter.add(sample[-1], sample[:-1])
+    dmp = fitter.dmp()
+
+    assert np.allclose(dmp.tau, reference.tau)
+    assert np.allclose(dmp.y0, reference.y0) and np.allclose(dmp.dy0, reference.dy0)
+    assert np.allclose(dmp.goal, reference.goal)
+    assert np.abs(dmp.w - reference.w).max() <= 1e-4 * np.abs(reference.w).max()
@@ -0,0 +1,48 @@
+import pytest
+import torch
+
+from imednet.utils.dmp_fused import fused_rollout
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator, operator_rollout, parallel_integrate
+
+
+def scaled_inputs(params, inputs):
+    division = params.Dof*(params.N+2)
+    scaling = params.scale_tensor
+    return scaling[0:division] * (inputs - scaling[-1]) + scaling[division:division*2]
+
+
+@pytest.mark.parametrize('N, dof, tau', [(25, 2, 3), (10, 3, 2), (15, 7, 1)])
+def test_fused_rollout_matches_integration(dmp_parameters, N, dof, tau):
+    params = dmp_parameters(N, dof, tau)
+    torch.manual_seed(0)
+    inputs_np = scaled_inputs(params, 2*torch.rand(32, dof*(N+2)) - 1)
+    rows = inputs_np.view(-1, N+2, dof).transpose(2, 1).contiguous().view(-1, N+2)
+
+    expected = parallel_integrate(params.data_tensor, rows, tau)
+    scale = expected.abs().max()
+    for tasks in (1, 3):
+        result = fused_rollout(params.data_tensor, rows, tasks=tasks)
+        assert result.shape == expected.shape == (dof*32, params.time_steps)
+        assert (result - expected).abs().max() <= 1e-5 * scale
+    result = operator_rollout(inputs_np, params.data_tensor, params.grad_tensor)
+    assert (fused_rollout(params.data_tensor, rows) - result).abs().max() <= 1e-5 * scale
+
+
+@pytest.mark.parametrize('N, dof, tau', [(25, 2, 3), (10, 3, 2), (15, 7, 1)])
+def test_fused_mode_gradients(dmp_parameters, N, dof, tau):
+    params = dmp_parameters(N, dof, tau)
+    torch.manual_seed(1)
+    inputs = (2*torch.rand(16, dof*(N+2)) - 1).requires_grad_()
+    outputs = DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.scale_tensor, 'fused')
+    expected = DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.scale_tensor)
+    assert (outputs - expected).abs().max() <= 1e-5 * expected.abs().max()
+
+    # autograd through the rollout operator applied to the scaled inputs
+    reference_inputs = inputs.detach().double().requires_grad_()
+    reference = operator_rollout(scaled_inputs(params, reference_inputs), params.data_tensor,
+                                 params.grad_tensor.double())
+
+    grad_outputs = torch.randn_like(outputs)
+    grad, = torch.autograd.grad(outputs, inputs, grad_outputs)
+    reference_grad, = torch.autograd.grad(reference, reference_inputs, grad_outputs.double())
+    assert (grad.double() - reference_grad).abs().max() <= 1e-5 * reference_grad.abs().max()
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import torch
+
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator
+
+
+def reference_rollout(params, inputs):
+    """
+    Euler rollout of the network outputs step by step in float64, with the
+    phase and the basis functions evaluated at every step as in the
+    original integrate, so autograd through it gives reference gradients.
+    """
+    N, dof, a_x, a_z, dt = params.N, params.Dof, params.a_x, params.a_z, params.dt
+    division = dof*(N+2)
+    scaling = params.scale_tensor.double()
+    inputs_np = scaling[0:division] * (inputs - scaling[-1]) + scaling[division:division*2]
+    rows = inputs_np.view(-1, N+2, dof).transpose(2, 1).reshape(-1, N+2)
+    y0, goal, w = rows[:, 0], rows[:, 1], rows[:, 2:]
+    c, sigma2 = params.c.double(), params.sigma2.double()
+    tau = (params.time_steps - 1) * dt
+
+    x = 1.0
+    y = y0
+    z = torch.zeros_like(y0)
+    Y = [y]
+    for i in range(params.time_steps - 1):
+        psi = torch.exp(-0.5 * (x - c)**2 / sigma2)
+        fx = torch.mv(w * x, psi) / psi.sum()
+        dz = (a_z * (a_z / 4 * (goal - y) - z) + fx) / tau
+        dy = z / tau
+        x = x - a_x * x / tau * dt
+        y = y + dy * dt
+        z = z + dz * dt
+        Y.append(y)
+    return torch.stack(Y, 1)
+
+
+@pytest.mark.parametrize('N, dof, tau', [(25, 2, 3), (10, 3, 2), (50, 1, 1.5), (15, 7, 1)])
+def test_integrator_matches_step_by_step_rollout(dmp_parameters, N, dof, tau):
+    params = dmp_parameters(N, dof, tau)
+    torch.manual_seed(0)
+    inputs = (2*torch.rand(16, dof*(N+2)) - 1).requires_grad_()
+    outputs = DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.scale_tensor)
+
+    reference_inputs = inputs.detach().double().requires_grad_()
+    reference = reference_rollout(params, reference_inputs)
+    assert outputs.shape == reference.shape
+    assert (outputs.double() - reference).abs().max().item() <= 1e-4 * reference.abs().max().item()
+
+    grad_outputs = torch.randn_like(outputs)
+    grad, = torch.autograd.grad(outputs, inputs, grad_outputs)
+    reference_grad, = torch.autograd.grad(reference, reference_inputs, grad_outputs.double())
+    np.testing.assert_allclose(grad.numpy(), reference_grad.numpy(),
+                               rtol=0, atol=1e-4 * reference_grad.abs().max().item())
@@ -0,0 +1,29 @@
+import pytest
+import torch
+
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator
+from imednet.utils.dmp_loss import GramMSELoss, parameter_rows, project_trajectories
+
+
+@pytest.mark.parametrize('N, dof, noise', [(25, 2, 0.5), (10, 3, 0.0), (25, 2, 5.0)])
+def test_gram_loss_matches_trajectory_mse(dmp_parameters, N, dof, noise):
+    params = dmp_parameters(N, dof, 3)
+    division = dof*(N+2)
+    torch.manual_seed(0)
+    with torch.no_grad():
+        targets = DMPIntegrator.apply(2*torch.rand(64, division) - 1, params.data_tensor,
+                                      params.grad_tensor, params.scale_tensor)
+        targets = targets + noise * torch.randn_like(targets)
+    projected = torch.from_numpy(project_trajectories(targets, params.grad_tensor))
+    outputs = (2*torch.rand(64, division) - 1).requires_grad_()
+
+    trajectories = DMPIntegrator.apply(outputs, params.data_tensor, params.grad_tensor, params.scale_tensor)
+    loss = torch.nn.MSELoss()(trajectories, targets)
+    grad, = torch.autograd.grad(loss, outputs)
+
+    gram = GramMSELoss(params.grad_tensor)(parameter_rows(outputs, params.data_tensor, params.scale_tensor),
+                                           projected)
+    gram_grad, = torch.autograd.grad(gram, outputs)
+
+    assert gram.item() == pytest.approx(loss.item(), rel=1e-4)
+    assert (gram_grad - grad).abs().max() <= 1e-4 * grad.abs().max()
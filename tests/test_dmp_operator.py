@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator, operator_rollout, parallel_integrate
+
+
+@pytest.mark.parametrize('N, dof, tau', [(25, 2, 3), (10, 3, 2), (50, 1, 1.5)])
+def test_operator_rollout_matches_integration(dmp_parameters, N, dof, tau):
+    params = dmp_parameters(N, dof, tau)
+    division = dof*(N+2)
+    torch.manual_seed(0)
+    inputs = 2*torch.rand(32, division) - 1
+    scaling = params.scale_tensor
+    inputs_np = scaling[0:division] * (inputs - scaling[-1]) + scaling[division:division*2]
+    rows = inputs_np.view(-1, N+2, dof).transpose(2, 1).contiguous().view(-1, N+2)
+
+    expected = parallel_integrate(params.data_tensor, rows, tau)
+    result = operator_rollout(inputs_np, params.data_tensor, params.grad_tensor)
+
+    assert result.shape == expected.shape == (dof*32, params.time_steps)
+    assert (result - expected).abs().max() <= 1e-5 * expected.abs().max()
+
+
+def test_operator_mode_matches_default_mode(dmp_parameters):
+    params = dmp_parameters(25, 2, 3)
+    torch.manual_seed(0)
+    inputs = 2*torch.rand(16, 54) - 1
+    expected = DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.scale_tensor)
+    result = DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.scale_tensor, 'operator')
+    assert (result - expected).abs().max() <= 1e-5 * expected.abs().max()
+
+
+def test_rollout_operator_is_not_shared(dmp_parameters):
+    first = dmp_parameters(25, 2, 3)
+    second = dmp_parameters(25, 2, 3)
+    expected = second.grad_tensor.clone()
+    first.grad_tensor.mul_(2)
+    assert torch.equal(second.grad_tensor, expected)
+    assert torch.equal(dmp_parameters(25, 2, 3).grad_tensor, expected)
@@ -0,0 +1,47 @@
+import numpy as np
+import torch
+
+from imednet.data.smnist_loader import Mapping
+from imednet.utils.dmp_layer_no_cuda import DMPIntegrator, DMPParameters
+
+
+def tau_parameters(N, dof, tau, tau_range):
+    """DMPParameters whose tau column maps [-1, 1] to tau_range."""
+    scale = Mapping()
+    scale.x_max = np.concatenate(([tau_range[1]], 30*np.ones(2*dof), 300*np.ones(N*dof)))
+    scale.x_min = np.concatenate(([tau_range[0]], -30*np.ones(2*dof), -300*np.ones(N*dof)))
+    scale.y_max = 1
+    scale.y_min = -1
+    return DMPParameters(N, tau, 0.01, dof, scale)
+
+
+def test_tau_mode_gradcheck():
+    params = tau_parameters(5, 2, 0.5, (0.4, 0.6))
+    torch.manual_seed(0)
+    inputs = (1.8*torch.rand(2, 1 + 2*7, dtype=torch.float64) - 0.9).requires_grad_()
+
+    def rollout(inputs):
+        return DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.tau_scale_tensor, 'tau')
+
+    assert torch.autograd.gradcheck(rollout, (inputs,), eps=1e-6, atol=1e-6, rtol=1e-4)
+
+
+def test_tau_mode_matches_default_mode_at_fixed_tau(dmp_parameters):
+    N, dof = 25, 2
+    params = dmp_parameters(N, dof, 3)
+    torch.manual_seed(1)
+    inputs = (2*torch.rand(8, dof*(N+2)) - 1).requires_grad_()
+    tau_inputs = torch.cat((torch.zeros(8, 1), inputs.detach()), 1).requires_grad_()
+
+    expected = DMPIntegrator.apply(inputs, params.data_tensor, params.grad_tensor, params.scale_tensor)
+    outputs = DMPIntegrator.apply(tau_inputs, params.data_tensor, params.grad_tensor, params.tau_scale_tensor,
+                                  'tau')
+    assert outputs.shape == expected.shape
+    assert (outputs - expected).abs().max() <= 1e-4 * expected.abs().max()
+
+    grad_outputs = torch.randn_like(expected)
+    expected_grad, = torch.autograd.grad(expected, inputs, grad_outputs)
+    grad, = torch.autograd.grad(outputs, tau_inputs, grad_outputs)
+    # the tau column has no range, so no gradient
+    assert not grad[:, 0].any()
+    assert (grad[:, 1:] - expected_grad).abs().max() <= 1e-4 * expected_grad.abs().max()
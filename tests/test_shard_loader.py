@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import scipy.io as sio
+
+from imednet.data.smnist_loader import MatLoader
+from imednet.data.shard_loader import ShardWriter, ShardedDataset, convert_mat
+
+
+def cell(items):
+    array = np.empty((1, len(items)), dtype=object)
+    for i, item in enumerate(items):
+        array[0, i] = item
+    return array
+
+
+def write_mat(file, lengths, rng):
+    images = [rng.randint(0, 256, (40, 40)).astype(np.uint8) for _ in lengths]
+    dmps = [{'tau': np.array([[3.0]]), 'w': 500 * rng.randn(25, 2), 'goal': 40 * rng.rand(1, 2),
+             'y0': 40 * rng.rand(1, 2)} for _ in lengths]
+    trajectories = [40 * rng.rand(length, 3) for length in lengths]
+    sio.savemat(file, {'Data': {'imageArray': cell(images), 'DMPParamsArray': cell(dmps),
+                                'trajArray': cell(trajectories)}})
+
+
+def test_ragged_trajectories(tmp_path):
+    rng = np.random.RandomState(0)
+    file = str(tmp_path / 'data.mat')
+    write_mat(file, rng.randint(250, 320, 50), rng)
+    images, outputs, scale, trajectories = MatLoader.load_data(file, load_original_trajectories=True, cache=False)
+    shards = str(tmp_path / 'shards')
+    index = convert_mat(file, shards, shard_size=16, load_original_trajectories=True)
+    assert len(index['shards']) == 4 and index['trajectory_length'] is None
+
+    dataset = ShardedDataset(shards)
+    x, y = dataset[np.arange(len(dataset))]
+    assert np.array_equal(x.numpy(), images)
+    assert np.allclose(y.numpy(), outputs, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        ShardedDataset(shards, 'trajectories')
+    dataset = ShardedDataset(shards, 'trajectories', length=301)
+    order = rng.permutation(len(dataset))
+    x, y = dataset[order]
+    assert y.shape == (len(dataset), 2, 301)
+    for i, k in enumerate(order):
+        expected = np.stack([np.interp(np.linspace(0, 1, 301), np.linspace(0, 1, len(trajectories[k])),
+                                       trajectories[k][:, d]) for d in range(2)])
+        assert np.allclose(y[i].numpy(), expected, atol=1e-4)
+        assert np.array_equal(x[i].numpy(), images[k])
+
+
+def test_equal_trajectories(tmp_path):
+    rng = np.random.RandomState(1)
+    trajectories = rng.rand(30, 301, 3).astype(np.float32)
+    writer = ShardWriter(str(tmp_path), shard_size=8)
+    for i in range(0, 30, 7):
+        count = len(trajectories[i:i + 7])
+        writer.append(rng.randint(0, 256, (count, 40, 40)), rng.randn(count, 55), trajectories[i:i + 7])
+    assert writer.close()['trajectory_length'] == 301
+
+    dataset = ShardedDataset(str(tmp_path), 'trajectories')
+    x, y = dataset[np.arange(len(dataset))]
+    assert np.array_equal(y.numpy(), np.swapaxes(trajectories[:, :, :2], 1, 2))
+    x_i, y_i = dataset[29]
+    assert np.array_equal(y_i.numpy(), trajectories[29, :, :2].T)